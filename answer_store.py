@@ -0,0 +1,100 @@
+"""Persistent store for report answers.
+
+Answers are written one at a time as they are entered and keyed by
+(project number, quarter, section), so a browser refresh or server restart
+loses nothing and sessions only hold the quarters they are working on.
+SQLite is the default backend; set ``GRANTI_ANSWER_DB=:memory:`` for a
+throwaway per-process store. Listeners (see ``add_listener``) are told about
+every saved answer, which keeps derived indexes such as quarter_history.py
+current.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+DATA_DIR = os.environ.get("GRANTI_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "granti_data"))
+DB_PATH = os.environ.get("GRANTI_ANSWER_DB", os.path.join(DATA_DIR, "answers.sqlite3"))
+
+
+class SQLiteAnswerStore:
+    def __init__(self, path=DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS answers (
+                project_number TEXT NOT NULL,
+                quarter INTEGER NOT NULL,
+                section TEXT NOT NULL,
+                answer TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (project_number, quarter, section)
+            ) WITHOUT ROWID""")
+        self._listeners = []
+
+    def add_listener(self, listener):
+        """Calls ``listener(project_number, quarter, section, answer)`` after every saved answer."""
+        self._listeners.append(listener)
+
+    def save_answer(self, project_number, quarter, section, answer):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers VALUES (?, ?, ?, ?, ?)",
+                (str(project_number), quarter, section, answer, time.time()))
+        for listener in self._listeners:
+            listener(str(project_number), quarter, section, answer)
+
+    def get_answer(self, project_number, quarter, section):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT answer FROM answers WHERE project_number = ? AND quarter = ? AND section = ?",
+                (str(project_number), quarter, section)).fetchone()
+        return row[0] if row else None
+
+    def load_quarter(self, project_number, quarter):
+        """Returns ``{section: answer}`` for one quarter."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT section, answer FROM answers WHERE project_number = ? AND quarter = ?",
+                (str(project_number), quarter)).fetchall()
+        return dict(rows)
+
+    def load_quarters(self, project_number, quarters):
+        """Returns ``{quarter: {section: answer}}`` for the given quarters (empty ones included)."""
+        return {q: self.load_quarter(project_number, q) for q in quarters}
+
+    def load_project(self, project_number):
+        """Returns ``{quarter: {section: answer}}`` for every quarter of the project with answers."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT quarter, section, answer FROM answers WHERE project_number = ?",
+                (str(project_number),)).fetchall()
+        quarters = {}
+        for quarter, section, answer in rows:
+            quarters.setdefault(quarter, {})[section] = answer
+        return quarters
+
+    def quarters_with_answers(self, project_number):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT quarter FROM answers WHERE project_number = ? ORDER BY quarter",
+                (str(project_number),)).fetchall()
+        return [r[0] for r in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the process-wide answer store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = SQLiteAnswerStore()
+    return _store
@@ -1,589 +1,674 @@
 import streamlit as st
-import google.oauth2.credentials
-from google_auth_oauthlib.flow import Flow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-import os
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import answer_store
+import blob_store
+import retrieval
+import text_extract
+import autosave
+import credential_cache
+import instrumentation
+import project_registry
+import generation_jobs
+import quarter_history
+import report_export
+import report_model
+import report_session
+import transcript
+import uuid
 import json
-from datetime import datetime
-import io
 import sys
-import traceback
-# Consider adding PyPDF2 if PDF parsing is attempted later:
-# import PyPDF2
+import threading
+# The Google client stack (google_auth_oauthlib, googleapiclient, and google_services/report_docs which
+# import it) is only imported when authentication or generation first needs it; it dominates cold start.
 
 # --- Configuration ---
 SCOPES = ['https://www.googleapis.com/auth/documents', 'https://www.googleapis.com/auth/drive.file']
 REDIRECT_URI_TYPE = 'urn:ietf:wg:oauth:2.0:oob'
 GRANTI_AUNTY_AVATAR = "https://images.icon-icons.com/3708/PNG/512/girl_female_woman_person_face_people_curly_hair_icon_230020.png" # Replace with your desired URL or local path if added to repo
 
-# --- Load Individual Secret Values ---
-# (Same robust loading logic as before)
-client_id = None
-project_id = None
-auth_uri = None
-token_uri = None
-auth_provider_x509_cert_url = None
-client_secret = None
-redirect_uris = None
-
-print("--- Attempting to load individual credential values from secrets ---")
-try:
-    secrets_web = st.secrets.get("google_credentials", {}).get("web", {})
-    if not secrets_web: raise ValueError("`[google_credentials.web]` section not found or empty.")
-    client_id = secrets_web.get("client_id")
-    project_id = secrets_web.get("project_id")
-    auth_uri = secrets_web.get("auth_uri")
-    token_uri = secrets_web.get("token_uri")
-    auth_provider_x509_cert_url = secrets_web.get("auth_provider_x509_cert_url")
-    client_secret = secrets_web.get("client_secret")
-    redirect_uris = secrets_web.get("redirect_uris")
-    required_values = {"client_id": client_id, "project_id": project_id, "auth_uri": auth_uri, "token_uri": token_uri, "client_secret": client_secret}
-    missing = [k for k, v in required_values.items() if not v]
-    if missing: raise ValueError(f"Required credential values missing from secrets: {missing}")
-    if redirect_uris is not None and not isinstance(redirect_uris, list):
-         if isinstance(redirect_uris, str): redirect_uris = [redirect_uris]
-         else: raise TypeError(f"redirect_uris must be list/str, found {type(redirect_uris)}")
-    print("--- Individual credential values loaded successfully ---")
-except (KeyError, AttributeError, ValueError, TypeError) as e:
-    err_msg = f"Error accessing/validating secrets: {e}. Check TOML format/keys."
-    print(f"ERROR: {err_msg}\n{traceback.format_exc()}")
-    st.error(err_msg)
-    st.stop()
-except Exception as e:
-    err_msg = f"Unexpected error loading secrets: {e}"
-    print(f"ERROR: {err_msg}\n{traceback.format_exc()}")
-    st.error(err_msg)
-    st.stop()
-
-
-# --- Constants & Prompts ---
-PROJECT_DETAILS = { # (Unchanged)
-    "Lead Company Name": "FLOX Limited",
-    "Project title": "NetFLOX360 – Bridging Poultry Farm Data with Factory Insights using Artificial Intelligence for Sustainable Growth",
-    "Project Number": "10103645",
-    "Total Quarters": 4
-}
-report_section_keys = [ # (Unchanged)
-    "quarter_end_date",
-    "overall_summary", "progress", "issues_actions", "scope", "time",
-    "cost", "exploitation", "risk_management", "project_planning",
-    "next_quarter_forecast",
-]
-report_section_prompts = { # Updated prompts
-    "start": "Hello there! I'm Granti Aunty. I can help you draft your Innovate UK Quarterly Report for NetFLOX360. Which reporting quarter (1-{0}) are you working on?",
-    "request_grant_app": "Okay, Quarter {0}. To help provide context, please upload your original **Grant Application PDF** using the uploader below. I won't store it long-term, just for this session.",
-    "grant_app_received": "Thanks! I've received the Grant Application file for this session. Remember to refer to it!\nNow, what is the **end date** for Quarter {0} (YYYY-MM-DD)?",
-    "quarter_end_date": "Got the date! Let's start with the '{0}' section.", # Will be formatted dynamically
-    "overall_summary": "Okay, let's draft the **Overall Summary**. Please provide brief points on Scope, Time, Cost, Exploitation, Risk, and PM status. Remember to check your Grant Application for objectives.",
-    "progress": "Next, tell me about **Progress**. What were the highlights, key achievements, and overall successes this quarter? How did you address any previous issues?",
-    "issues_actions": "Now for **Issues and Actions**. Briefly list any key issues faced this quarter and the actions taken or planned. Do you need any help from the Monitoring Officer?",
-    "scope": "Let's discuss **Scope**. Has it remained aligned with the original plan (check your Grant Application)? Any changes, concerns, or deviations? Are technical objectives still on track?",
-    "time": "How about **Time**? Which deliverables/milestones were due (check your Project Plan/Gantt)? Were they achieved? If delayed, please explain the reason, impact, and corrective actions.",
-     "cost": "Now for the **Cost** summary. Please provide a general statement on costs vs forecast and explain any significant variances (>5-10%) per partner.",
-    "exploitation": "Tell me about **Exploitation** activities this quarter (market engagement, IP progress, dissemination, etc.). How does this align with your Exploitation Plan?",
-    "risk_management": "What are the updates regarding **Risk Management**? Any new/retired risks, changes in impact/likelihood (check your Risk Register)? What are the biggest risks now?",
-    "project_planning": "How has **Project Planning** been? Describe team collaboration, PM challenges, and any improvements made. Has the Gantt chart been updated?",
-    "next_quarter_forecast": "Finally, what is the **Updated forecast for next quarter**? Main activities, challenges, and scheduled deliverables?",
-    "upload_request": "Need to upload supporting evidence (e.g., Risk Register, Gantt)? Use the uploader in the sidebar. **Note: Files are only available during this session.**",
-    "ready_to_generate": "Excellent! I have collected information for all sections for Q{0}. Are you ready for me to generate the Google Doc draft? (Type 'yes' to confirm)",
-    "generation_complete": "All done! You can find the draft document titled '{0}' in your Google Drive.",
-    "error": "Oh dear, something went wrong. Please try again or check the logs if the issue persists."
-}
-
-# --- Google Authentication (Unchanged) ---
+logger = instrumentation.get_logger("app")
+
+# --- OAuth Client Settings (read from secrets when first needed, then cached for the process) ---
+@st.cache_resource(show_spinner=False)
+def google_client_config():
+    """Returns the validated OAuth client config from ``[google_credentials.web]``. Raises ValueError/TypeError if invalid."""
+    with instrumentation.span("secrets.load"):
+        secrets_web = st.secrets.get("google_credentials", {}).get("web", {})
+        if not secrets_web: raise ValueError("`[google_credentials.web]` section not found or empty.")
+        web = {key: secrets_web.get(key) for key in ("client_id", "project_id", "auth_uri", "token_uri", "auth_provider_x509_cert_url", "client_secret")}
+        missing = [k for k in ("client_id", "project_id", "auth_uri", "token_uri", "client_secret") if not web[k]]
+        if missing: raise ValueError(f"Required credential values missing from secrets: {missing}")
+        redirect_uris = secrets_web.get("redirect_uris")
+        if redirect_uris is not None and not isinstance(redirect_uris, list):
+             if isinstance(redirect_uris, str): redirect_uris = [redirect_uris]
+             else: raise TypeError(f"redirect_uris must be list/str, found {type(redirect_uris)}")
+        if redirect_uris is not None: web["redirect_uris"] = list(redirect_uris)
+    logger.debug("Credential values loaded from secrets")
+    return {"web": web}
+
+
+# --- Project (see project_registry.py; every session serving a project shares its compiled config) ---
+def project():
+    """Returns this session's project config."""
+    return project_registry.get_registry().get(st.session_state.project_id)
+
+# --- Google Authentication ---
+def warm_up_google_stack():
+    """Imports the Google client stack (and parses the discovery docs) in the background before it is needed."""
+    threading.Thread(target=__import__, args=("report_docs",), name="google-warm-up", daemon=True).start()
+
+def invalidate_google_services(credentials):
+    google_services = sys.modules.get("google_services")
+    if google_services and credentials: # Nothing can be cached for them if it was never imported
+        google_services.invalidate(credentials)
+
+def remember_credentials(credentials):
+    """Caches the refresh token (encrypted) so sessions opened later in this browser sign in without consent."""
+    user_key = st.session_state.get('user_key')
+    if not credential_cache.valid_user_key(user_key):
+        # The user key lives in a browser cookie (see sync_user_key_cookie); it is never written to disk
+        user_key = st.session_state.user_key = credential_cache.new_user_key()
+    try:
+        credential_cache.get_manager().save(user_key, credentials)
+    except Exception as e:
+        logger.exception("Could not cache Google credentials", error=e)
+
 def get_credentials():
-    print("--- Entering get_credentials function ---")
     if 'credentials' in st.session_state and st.session_state.credentials and st.session_state.credentials.valid:
-         print("DEBUG: Valid credentials found in session state.")
          return st.session_state.credentials
-    client_config = {"web": {"client_id": client_id,"project_id": project_id,"auth_uri": auth_uri,"token_uri": token_uri,"auth_provider_x509_cert_url": auth_provider_x509_cert_url,"client_secret": client_secret}}
-    if redirect_uris is not None: client_config["web"]["redirect_uris"] = redirect_uris
-    print("DEBUG: Creating OAuth Flow instance...")
     try:
-        flow = Flow.from_client_config(client_config, scopes=SCOPES, redirect_uri=REDIRECT_URI_TYPE)
-        print("DEBUG: OAuth Flow instance created successfully.")
+        client_config = google_client_config()
+    except (KeyError, AttributeError, ValueError, TypeError) as e:
+        logger.exception("Error accessing/validating secrets", error=e)
+        st.error(f"Error accessing/validating secrets: {e}. Check TOML format/keys.")
+        return None
     except Exception as e:
-        err_msg = f"Error creating OAuth Flow: {e}"
-        print(f"ERROR: {err_msg}\n{traceback.format_exc()}")
-        st.error(err_msg + " Check app logs/secrets.")
+        logger.exception("Unexpected error loading secrets", error=e)
+        st.error(f"Unexpected error loading secrets: {e}")
         return None
-    if REDIRECT_URI_TYPE == 'urn:ietf:wg:oauth:2.0:oob':
-        print("DEBUG: Using 'oob' OAuth flow.")
-        try: auth_url, _ = flow.authorization_url(prompt='consent')
-        except Exception as e: print(f"ERROR: Auth URL generation failed: {e}\n{traceback.format_exc()}"); st.error(f"Error generating auth URL: {e}"); return None
-        st.warning(f"**Action Required:**\n1. Go to: [Google Auth Link]({auth_url})\n2. Grant permissions.\n3. Copy the code.\n4. Paste code below.")
-        auth_code = st.text_input("Enter authorization code:", key="google_auth_code_input", type="password")
-        if auth_code:
-            print("DEBUG: Auth code entered. Fetching token...")
-            try:
+    warm_up_google_stack()
+    if REDIRECT_URI_TYPE != 'urn:ietf:wg:oauth:2.0:oob':
+        st.error("'oob' flow required for this setup."); return None
+    # The flow and its auth URL are kept for the whole login: a new flow on every rerun would pair the
+    # pasted code with a different PKCE code verifier than the one the auth URL was issued for
+    if st.session_state.get('oauth_flow') is None:
+        try:
+            with instrumentation.span("oauth.flow"):
+                from google_auth_oauthlib.flow import Flow
+                flow = Flow.from_client_config(client_config, scopes=SCOPES, redirect_uri=REDIRECT_URI_TYPE)
+        except Exception as e:
+            err_msg = f"Error creating OAuth Flow: {e}"
+            logger.exception("Error creating OAuth Flow", error=e)
+            st.error(err_msg + " Check app logs/secrets.")
+            return None
+        # Offline access so we get a refresh token and later sessions don't need to consent again
+        try: auth_url, _ = flow.authorization_url(prompt='consent', access_type='offline')
+        except Exception as e: logger.exception("Auth URL generation failed", error=e); st.error(f"Error generating auth URL: {e}"); return None
+        st.session_state.oauth_flow = (flow, auth_url)
+    flow, auth_url = st.session_state.oauth_flow
+    st.warning(f"**Action Required:**\n1. Go to: [Google Auth Link]({auth_url})\n2. Grant permissions.\n3. Copy the code.\n4. Paste code below.")
+    auth_code = st.text_input("Enter authorization code:", key="google_auth_code_input", type="password")
+    if auth_code:
+        try:
+            with instrumentation.span("oauth.fetch_token"):
                 flow.fetch_token(code=auth_code)
-                st.session_state.credentials = flow.credentials
-                print("DEBUG: Token fetch success.")
-                st.success("Google authentication successful!")
-                st.rerun()
-                return flow.credentials
-            except Exception as e:
-                err_msg = f"Error fetching token: {e}"
-                print(f"ERROR: {err_msg}\n{traceback.format_exc()}")
-                st.error(err_msg + ". Check code/permissions.")
-                if 'credentials' in st.session_state: del st.session_state['credentials']
-                return None
-        else: print("DEBUG: Waiting for auth code."); st.info("Waiting for authorization code."); return None
-    else: st.error("'oob' flow required for this setup."); return None
-
-# --- Google Docs API Function (With Added Logging & Checks) ---
-def create_google_doc(credentials, quarter_number, answers):
-    """Creates a new Google Doc with the report content."""
-    print("--- Entering create_google_doc function ---")
+            invalidate_google_services(st.session_state.get('credentials'))
+            st.session_state.credentials = flow.credentials
+            st.session_state.auth_in_progress = False
+            st.session_state.oauth_flow = None
+            remember_credentials(flow.credentials)
+            logger.info("Google authentication successful")
+            st.success("Google authentication successful!")
+            st.rerun()
+            return flow.credentials
+        except Exception as e:
+            err_msg = f"Error fetching token: {e}"
+            logger.exception("Error fetching token", error=e)
+            st.error(err_msg + ". Check code/permissions.")
+            if 'credentials' in st.session_state: del st.session_state['credentials']
+            return None
+    else: st.info("Waiting for authorization code."); return None
+
+# --- Google Docs Generation (publishing runs on the background job queue, see generation_jobs.py) ---
+def check_docs_credentials(credentials):
+    """Checks credentials and scopes before a generation job is queued. Returns True if usable."""
 
     # --- Pre-API Call Checks ---
     if not credentials:
         err_msg = "Credentials object is None when trying to create doc."
-        print(f"ERROR: {err_msg}")
+        logger.error(err_msg)
         st.error(err_msg)
-        return None
-
-    print(f"DEBUG: Type of credentials object passed: {type(credentials)}")
+        return False
 
     # Check validity and scopes
     if hasattr(credentials, 'valid'):
-        print(f"DEBUG: Credentials valid attribute: {credentials.valid}")
         if not credentials.valid:
              # Check for refresh token which might allow refresh
              if hasattr(credentials, 'has_scopes') and credentials.has_scopes(SCOPES) and hasattr(credentials, 'refresh_token') and credentials.refresh_token:
-                  print("WARN: Credentials seem expired but refresh token exists. Attempting refresh implicitly by library...")
-                  # The library often handles refresh automatically if refresh token is present & scopes match
-                  # We can try forcing a refresh for debugging, requires RequestsCallback transport
-                  # try:
-                  #      from google.auth.transport.requests import Request
-                  #      credentials.refresh(Request())
-                  #      print("DEBUG: Manual refresh attempted.")
-                  #      if not credentials.valid: raise Exception("Refresh failed.")
-                  # except Exception as refresh_err:
-                  #      err_msg = f"Credentials expired and refresh failed: {refresh_err}"
-                  #      print(f"ERROR: {err_msg}")
-                  #      st.error(err_msg + " Please re-authenticate.")
-                  #      if 'credentials' in st.session_state: del st.session_state['credentials']
-                  #      st.rerun()
-                  #      return None
-
+                  # Cached credentials are refreshed ahead of expiry (see credential_cache.py), so this
+                  # only happens for credentials that aren't cached; refresh them here instead of re-consenting
+                  try:
+                       from google.auth.transport.requests import Request
+                       with instrumentation.span("oauth.refresh"):
+                            credentials.refresh(Request())
+                  except Exception as e:
+                       logger.warn("Credentials expired and refresh failed", error=e)
+                       st.error("Your Google login has expired. Please log in again.")
+                       st.session_state.credentials = None
+                       return False
              else:
                   err_msg = "Credentials are not valid and/or refresh token is missing/scopes insufficient for refresh."
-                  print(f"ERROR: {err_msg}")
+                  logger.error(err_msg)
                   st.error(err_msg + " Please re-authenticate.")
                   if 'credentials' in st.session_state: del st.session_state['credentials']
                   st.rerun() # Force rerun to prompt login
-                  return None
+                  return False
     else:
-        print("WARN: Credentials object does not have 'valid' attribute. Proceeding cautiously.")
+        logger.warn("Credentials object does not have a 'valid' attribute; proceeding cautiously")
 
     granted_scopes = []
     if hasattr(credentials, 'scopes'):
         granted_scopes = credentials.scopes or []
-        print(f"DEBUG: Scopes associated with credentials: {granted_scopes}")
         # Verify required scopes are present
         required_scopes_set = set(SCOPES)
         granted_scopes_set = set(granted_scopes)
         if not required_scopes_set.issubset(granted_scopes_set):
              missing_scopes = required_scopes_set - granted_scopes_set
              err_msg = f"Required scopes missing: {missing_scopes}. Please re-authenticate and ensure ALL permissions ({', '.join(SCOPES)}) are granted."
-             print(f"ERROR: {err_msg}")
+             logger.error("Required scopes missing", missing=sorted(missing_scopes))
              st.error(err_msg)
              if 'credentials' in st.session_state: del st.session_state['credentials']
              st.rerun() # Force rerun to prompt login
-             return None
-        else:
-            print("DEBUG: All required scopes appear granted.")
+             return False
     else:
-        print("WARN: Could not read scopes from credentials object. Cannot verify permissions.")
+        logger.warn("Could not read scopes from credentials object; cannot verify permissions")
     # --- End Pre-API Call Checks ---
+    return True
+
+def quarter_report_model(quarter_number, answers=None):
+    """Builds a quarter's report model from the answer store, with context from earlier quarters (see quarter_history.py)."""
+    config = project()
+    if answers is None:
+        answers = answer_store.get_store().load_quarter(config.details['Project Number'], quarter_number)
+    contexts = quarter_history.get_history().report_context(config.details['Project Number'], quarter_number, config.section_keys)
+    return report_model.build_report_model(config.details, config.section_keys, quarter_number, answers, contexts)
+
+def start_generation(credentials, quarter_number):
+    """Builds the report model and queues it for publishing. Returns the queued job, or None."""
+    if not check_docs_credentials(credentials):
+        return None
+    import report_docs
+    model = quarter_report_model(quarter_number)
+    title = report_model.report_title(project().details, quarter_number)
+    try:
+        return generation_jobs.get_queue().submit_unique(report_model.content_hash(model), st.session_state.session_id, quarter_number,
+                                                         report_docs.publish_report, credentials, title, model, st.session_state.session_id, quarter_number)
+    except generation_jobs.QueueFullError as e:
+        logger.error("Could not queue generation job", error=e)
+        st.error("The document generator is busy right now. Please try again in a minute.")
+        return None
 
+def start_update(credentials, quarter_number, existing):
+    """Queues an in-place update of the quarter's existing draft. Returns the job, or None."""
+    if not check_docs_credentials(credentials):
+        return None
+    import report_docs
+    model = quarter_report_model(quarter_number)
     try:
-        print("DEBUG: Building Google Docs and Drive services...")
-        # Add cache_discovery=False for debugging if suspecting stale discovery docs
-        service_docs = build('docs', 'v1', credentials=credentials, cache_discovery=False)
-        service_drive = build('drive', 'v3', credentials=credentials, cache_discovery=False) # Use separate variable
-        print("DEBUG: Services built successfully.")
-
-        title = f"Innovate UK Q{quarter_number} Report - {PROJECT_DETAILS['Project Number']} - Draft {datetime.now().strftime('%Y%m%d_%H%M')}"
-        print(f"DEBUG: Attempting to create doc with title: {title}")
-
-        # --- Create Document using Drive API first (often more reliable for creation) ---
-        file_metadata = {
-            'name': title,
-            'mimeType': 'application/vnd.google-apps.document'
-        }
-        print(f"DEBUG: Calling drive.files().create() with metadata: {file_metadata}")
-        # Use fields='id' to only request the ID back
-        created_file = service_drive.files().create(body=file_metadata, fields='id').execute()
-        doc_id = created_file.get('id')
-
-        # doc_body_for_docs_create = {'title': title}
-        # print(f"DEBUG: Calling docs.documents().create() with body: {doc_body_for_docs_create}")
-        # doc = service_docs.documents().create(body=doc_body_for_docs_create).execute()
-        # doc_id = doc.get('documentId')
-
-        if not doc_id:
-            err_msg = "Failed to create Google Doc: No document ID returned from Drive API."
-            print(f"ERROR: {err_msg}")
-            st.error(err_msg)
-            return None
-        print(f"DEBUG: Google Doc created via Drive API with ID: {doc_id}")
-
-        # --- Now populate the created document using Docs API ---
-        print("DEBUG: Building report text content...")
-        full_text = f"# Innovate UK Quarterly Report - Q{quarter_number}\n\n"
-        full_text += f"**Project:** {PROJECT_DETAILS['Project title']} ({PROJECT_DETAILS['Project Number']})\n"
-        full_text += f"**Quarter End Date:** {answers.get('quarter_end_date', 'N/A')}\n\n---\n\n"
-        for key in report_section_keys:
-            if key == "quarter_end_date": continue
-            section_title = key.replace('_', ' ').title()
-            content = answers.get(key, "*No data entered for this section.*")
-            if st.session_state.current_quarter > 1:
-                 prev_q_num = st.session_state.current_quarter - 1
-                 prev_answer = st.session_state.get('all_answers', {}).get(prev_q_num, {}).get(key)
-                 if prev_answer:
-                      # Truncate previous answer reasonably
-                      prev_answer_snippet = prev_answer[:200] + ('...' if len(prev_answer) > 200 else '')
-                      content += f"\n\n*(Context: Your answer for Q{prev_q_num} was: '{prev_answer_snippet}')*"
-            full_text += f"## {section_title}\n\n{content}\n\n---\n\n"
-        print(f"DEBUG: Report text built (length: {len(full_text)} chars).")
-
-        print("DEBUG: Preparing batchUpdate request...")
-        # Insert text at the beginning of the document body (index 1)
-        requests = [{'insertText': {'location': {'index': 1}, 'text': full_text}}]
-        print(f"DEBUG: Request body for batchUpdate: {requests}") # Log the request body
-
-        print(f"DEBUG: Executing batchUpdate for doc ID: {doc_id}...")
-        result = service_docs.documents().batchUpdate(documentId=doc_id, body={'requests': requests}).execute()
-        print(f"DEBUG: batchUpdate executed successfully. Result: {result}") # Log the result
-        st.success(f"Successfully created and populated Google Doc.")
-
-        doc_url = f"https://docs.google.com/document/d/{doc_id}/edit"
-        st.markdown(f"**[Open Generated Document]({doc_url})**", unsafe_allow_html=True)
-
-        return title
-
-    except HttpError as error:
-        err_msg = f"Google API Error during document operation: {error}"
-        print(f"ERROR: {err_msg}")
-        error_details_bytes = getattr(error, 'resp', {}).get('content', b'{}')
-        error_details_str = error_details_bytes.decode('utf-8', errors='ignore') # Decode bytes
-        print(f"ERROR DETAILS FROM GOOGLE (Decoded): {error_details_str}")
-        st.error(err_msg)
-        try:
-             # Try parsing Google's detailed error message
-             error_json = json.loads(error_details_str)
-             st.json(error_json) # Display detailed error from Google if available
-             google_error_message = error_json.get('error', {}).get('message', 'No specific message found in JSON.')
-             st.error(f"Google Error Message: {google_error_message}")
-        except Exception as parse_error:
-             print(f"Could not parse Google error details as JSON: {parse_error}")
-             st.write(f"Raw error content: {error_details_str}") # Show decoded string
+        return generation_jobs.get_queue().submit(st.session_state.session_id, quarter_number, report_docs.update_report, credentials, existing['doc_id'], existing['title'], model, st.session_state.session_id, quarter_number)
+    except generation_jobs.QueueFullError as e:
+        logger.error("Could not queue update job", error=e)
+        st.error("The document generator is busy right now. Please try again in a minute.")
         return None
-    except Exception as e:
-         err_msg = f"Unexpected error during document creation: {e}"
-         print(f"ERROR: {err_msg}\n{traceback.format_exc()}")
-         st.error(err_msg)
-         return None
+
+def start_bulk_generation(credentials):
+    """Queues one job that publishes every quarter with saved answers. Returns the job, or None."""
+    if not check_docs_credentials(credentials):
+        return None
+    import report_docs
+    store = answer_store.get_store()
+    project_number = project().details['Project Number']
+    quarters = store.quarters_with_answers(project_number)
+    all_answers = store.load_quarters(project_number, quarters)
+    reports = {}
+    for quarter_number in quarters:
+        model = quarter_report_model(quarter_number, all_answers[quarter_number])
+        reports[quarter_number] = (report_model.report_title(project().details, quarter_number), model)
+    if not reports:
+        return None
+    logger.debug("Bulk generation", quarters=sorted(reports))
+    try:
+        return generation_jobs.get_queue().submit(st.session_state.session_id, tuple(reports), report_docs.publish_reports_batch, credentials, reports, st.session_state.session_id)
+    except generation_jobs.QueueFullError as e:
+        logger.error("Could not queue bulk generation job", error=e)
+        st.error("The document generator is busy right now. Please try again in a minute.")
+        return None
+
+# --- Restore Autosaved Session (see autosave.py) ---
+# View state that is autosaved alongside the conversation state (report_session.SessionState)
+AUTOSAVE_KEYS = ["project_id", "uploaded_files_session_info", "user_name", "profile_pic"]
+
+def browser_session_id():
+    """ID of this Streamlit (browser tab) session; it owns the autosave log's lease."""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def browser_session_live(browser_session):
+    return st.runtime.exists() and st.runtime.get_instance().is_active_session(browser_session)
+
+def sync_cookie(name, value, max_age):
+    """Makes the browser's cookie ``name`` match ``value`` (cleared if it is None).
+
+    Streamlit can't set cookies itself, so a one-pixel same-origin iframe sets it from the page. Cookies only reach the
+    server when a session starts, so this runs on every script run until the browser reconnects with it.
+    """
+    if st.context.cookies.get(name) == value:
+        return
+    cookie = f"{name}={value}; Max-Age={max_age}" if value else f"{name}=; Max-Age=0"
+    st.iframe("<script>window.parent.document.cookie = " + json.dumps(cookie + "; Path=/; SameSite=Strict")
+              + " + (window.parent.location.protocol === 'https:' ? '; Secure' : '');</script>", height=1)
+
+if 'session_id' not in st.session_state:
+    # The session ID lives in a browser cookie so a refresh or reconnect finds the same autosave log (see sync_cookie)
+    session_id = st.context.cookies.get(autosave.COOKIE_NAME)
+    if "sid" in st.query_params:
+        # Links from before the cookie carried the ID in the URL; take it once and take it off the address bar
+        session_id = st.query_params["sid"]
+        del st.query_params["sid"]
+        st.session_state.sid_link_used = True
+    if not autosave.valid_session_id(session_id):
+        session_id = uuid.uuid4().hex
+    restored_state, restored_messages = autosave.get_autosaver().restore(session_id)
+    if not autosave.get_autosaver().claim(session_id, browser_session_id(), browser_session_live):
+        # The session is open in another tab: carry on from its transcript under a new ID, so each tab has its own log
+        logger.debug("Autosave log in use by another tab; forking the session", session_id=session_id)
+        session_id = uuid.uuid4().hex
+        autosave.get_autosaver().claim(session_id, browser_session_id(), browser_session_live)
+    st.session_state.session_id = session_id
+    if restored_messages:
+        logger.debug("Restoring autosaved session", session_id=session_id, messages=len(restored_messages), stage=restored_state.get('stage'))
+        for key in AUTOSAVE_KEYS:
+            if key in restored_state: st.session_state[key] = restored_state[key]
+        st.session_state.report_state = report_session.SessionState.from_snapshot(restored_state, restored_messages)
+
+def autosave_checkpoint():
+    """Appends this session's state changes and new messages to its autosave log."""
+    state = report_state()
+    values = state.snapshot()
+    values.update({key: st.session_state.get(key) for key in AUTOSAVE_KEYS})
+    autosave.get_autosaver().record(st.session_state.session_id, values, state.messages, owner=browser_session_id())
+
+def save_and_rerun():
+    autosave_checkpoint()
+    st.rerun()
+
+# --- Document Retrieval (see text_extract.py and retrieval.py) ---
+EXTRACTABLE_TYPES = {"application/pdf": "pdf", "text/plain": "txt", "application/vnd.openxmlformats-officedocument.wordprocessingml.document": "docx"}
+
+def session_index():
+    """Returns this session's retrieval index, re-adding already extracted uploads if it had to be recreated."""
+    index, created = retrieval.get_index(st.session_state.session_id, project().section_queries)
+    if created:
+        sources = [(info['sha256'], name) for name, info in st.session_state.get('uploaded_files_session_info', {}).items() if info.get('sha256')]
+        grant_app_info = report_state().grant_app
+        if grant_app_info and grant_app_info.get('sha256'):
+            sources.append((grant_app_info['sha256'], grant_app_info['name']))
+        if sources:
+            threading.Thread(target=lambda: [index.add_source(d, n) for d, n in sources], daemon=True).start()
+    return index
+
+def uploader_key(name):
+    return f"{name}_{st.session_state.get(name + '_generation', 0)}"
+
+def release_uploader(name):
+    """Swaps a file uploader for an empty one once its file is spooled, so Streamlit frees the upload's bytes.
+
+    Must be called from inside the fragment that draws the uploader.
+    """
+    st.session_state[name + '_generation'] = st.session_state.get(name + '_generation', 0) + 1
+    st.rerun(scope="fragment")
+
+def spool_and_index(uploaded_file):
+    """Spools an upload into the blob store and, for text documents, starts background extraction and indexing.
+
+    Returns the blob's SHA-256 digest.
+    """
+    digest = blob_store.get_store().put(uploaded_file)
+    file_type = EXTRACTABLE_TYPES.get(uploaded_file.type)
+    if file_type:
+        index, name = session_index(), uploaded_file.name
+        text_extract.submit(digest, file_type, on_done=lambda d: index.add_source(d, name))
+    return digest
+
+def document_prompt_context(section_key):
+    """Prompt text quoting the most relevant passages of the uploaded documents for a section."""
+    passages = session_index().section_passages(section_key)
+    if passages:
+        quoted = "\n".join(f"> *{source}, p.{page}:* {text[:300]}..." for source, page, text, _ in passages[:2])
+        return f"\n\n*Relevant passages from your uploaded documents:*\n{quoted}"
+    if section_key not in ["scope", "time", "overall_summary"]: # Sections likely related to original app
+        return ""
+    info = report_state().grant_app
+    if not info:
+        return "\n*(You might want to refer to your original grant application.)*"
+    progress = text_extract.status(info.get('sha256'))
+    if progress["status"] == text_extract.PENDING:
+        pages = f" (page {progress['pages_done']} of {progress['pages_total']})" if progress['pages_total'] else ""
+        return f"\n*(I'm still reading your grant application '{info['name']}'{pages}. Remember to consult it!)*"
+    return f"\n*(Remember to consult your uploaded grant application: '{info['name']}')*"
+
+# --- Report Conversation (see report_session.py; this script is only the view) ---
+class GoogleDocsBackend:
+    """Document backend for the report session: queues publishing jobs with this session's Google credentials."""
+    def authenticated(self):
+        return current_credentials() is not None
+
+    def published(self, quarter_number):
+        import report_docs
+        return report_docs.published_report(st.session_state.session_id, quarter_number, quarter_report_model(quarter_number))
+
+    def generate(self, quarter_number):
+        return start_generation(current_credentials(), quarter_number)
+
+    def update(self, quarter_number, doc):
+        return start_update(current_credentials(), quarter_number, doc)
+
+    def generate_all(self):
+        return start_bulk_generation(current_credentials())
+
+    def job_status(self, job_id):
+        job = generation_jobs.get_queue().get(job_id)
+        return job.status if job else "unknown"
+
+    def describe_error(self, error):
+        import report_docs
+        return report_docs.describe_google_error(error)
+
+def report_state():
+    return st.session_state.report_state
+
+def report_conversation():
+    config = project()
+    return report_session.ReportSession(
+        report_state(), config.details, config.section_keys, config.prompts,
+        answers=answer_store.get_store(), documents=GoogleDocsBackend(), document_context=document_prompt_context,
+        history=quarter_history.get_history())
+
+def current_credentials():
+    """Returns the session's Google credentials if they are usable, without showing any auth UI.
+
+    With a cached login (the user key cookie) they come from the credential manager, which loads them
+    from the encrypted cache on first use and refreshes them before they expire.
+    """
+    user_key = st.session_state.get('user_key')
+    if user_key:
+        try:
+            creds = credential_cache.get_manager().load(user_key, google_client_config(), SCOPES)
+        except Exception as e:
+            logger.warn("Could not load cached Google credentials", error=e)
+            creds = None
+        if creds is not None and creds is not st.session_state.get('credentials'):
+            invalidate_google_services(st.session_state.get('credentials'))
+            st.session_state.credentials = creds
+    creds = st.session_state.get('credentials')
+    return creds if creds and creds.valid else None
+
+def sync_user_key_cookie():
+    """Makes the browser's user key cookie match the session's user key (set after a login, cleared on logout)."""
+    sync_cookie(credential_cache.COOKIE_NAME, st.session_state.get('user_key'), credential_cache.COOKIE_MAX_AGE_SECONDS)
 
 # --- Initialize Streamlit Session State ---
-if 'messages' not in st.session_state: st.session_state.messages = []
-if 'stage' not in st.session_state: st.session_state.stage = "start"
-if 'current_quarter' not in st.session_state: st.session_state.current_quarter = None
-if 'current_section_index' not in st.session_state: st.session_state.current_section_index = 0
-# Store all answers per quarter
-if 'all_answers' not in st.session_state: st.session_state.all_answers = {}
 if 'credentials' not in st.session_state: st.session_state.credentials = None
+# Key of this user's cached Google login (see credential_cache.py); read from the browser's cookie, set on first login
+if 'user_key' not in st.session_state:
+    user_key = st.context.cookies.get(credential_cache.COOKIE_NAME)
+    if "uid" in st.query_params:
+        # Links from before the cookie carried the key in the URL; take it once and take it off the address bar
+        user_key = st.query_params["uid"]
+        del st.query_params["uid"]
+        st.session_state.uid_link_used = True
+    st.session_state.user_key = user_key if credential_cache.valid_user_key(user_key) else None
 # Store general uploaded file info (name, type, size) - content maybe too large
 if 'uploaded_files_session_info' not in st.session_state: st.session_state.uploaded_files_session_info = {}
-# Store grant application specific info (if uploaded)
-if 'grant_app_info' not in st.session_state: st.session_state.grant_app_info = None
 # Profile Info
 if 'user_name' not in st.session_state: st.session_state.user_name = "User"
+# Blob store digest of the profile picture (the bytes live on disk, see blob_store.py)
 if 'profile_pic' not in st.session_state: st.session_state.profile_pic = None
 
 
 # --- App Layout ---
 st.set_page_config(page_title="Granti Aunty", layout="centered")
 st.title("Granti Aunty")
-st.write(f"Your Innovate UK Reporting Assistant for: **{PROJECT_DETAILS['Project title']}**")
+sync_cookie(autosave.COOKIE_NAME, st.session_state.session_id, autosave.COOKIE_MAX_AGE_SECONDS)
+if st.session_state.get('sid_link_used'):
+    st.warning("This link carried your chat session (`?sid=`), and anyone who opens it can read your conversation. "
+               "It has been removed from the address bar; don't share or bookmark the old link.")
+
+# --- Project Selection (see project_registry.py) ---
+# A session serves one project, picked before the conversation starts: restored with the autosave, from the URL, or the only one there is
+if project_registry.get_registry().get(st.session_state.get('project_id')) is None:
+    registry = project_registry.get_registry()
+    project_id = st.query_params.get("project")
+    if registry.get(project_id) is None:
+        if len(registry.ids()) == 1:
+            project_id = registry.ids()[0]
+        else:
+            project_id = st.selectbox("Which project are you reporting on?", registry.ids(), index=None,
+                                      format_func=lambda i: registry.get(i).title, placeholder="Choose a project...")
+            if project_id is None:
+                st.stop()
+    st.session_state.project_id = project_id
+    st.query_params["project"] = project_id
+
+if 'report_state' not in st.session_state:
+    # The chat opens with the start prompt
+    st.session_state.report_state = report_session.SessionState()
+    report_state().messages.append({"role": "assistant", "content": report_conversation().opening_message()})
+st.write(f"Your Innovate UK Reporting Assistant for: **{project().details['Project title']}**")
 st.caption("Let's draft your quarterly report together!")
 
+# Each part of the page is a fragment: interacting with a widget reruns only the fragment it lives in.
+
 # --- Sidebar ---
-st.sidebar.title("Settings & Info")
-
-# Profile Section
-st.sidebar.subheader("Your Profile")
-new_name = st.sidebar.text_input("Your Name:", value=st.session_state.user_name, key="user_name_input")
-if new_name != st.session_state.user_name:
-    st.session_state.user_name = new_name
-    st.rerun() # Update name display immediately
-
-profile_pic_file = st.sidebar.file_uploader("Upload Profile Picture:", type=['png', 'jpg', 'jpeg'], key="profile_pic_uploader")
-if profile_pic_file:
-    st.session_state.profile_pic = profile_pic_file.getvalue() # Store image bytes
-    # No rerun needed here, image will display on next natural rerun
-
-if st.session_state.profile_pic:
-    st.sidebar.image(st.session_state.profile_pic, caption=f"{st.session_state.user_name}'s Profile Pic", width=100)
-else:
-    st.sidebar.text("(No profile picture uploaded)")
-
-
-# Google Auth Section
-st.sidebar.divider()
-st.sidebar.subheader("Google Authentication")
-creds = st.session_state.get('credentials')
-if creds and creds.valid:
-    st.sidebar.success("Authenticated with Google.")
-    if st.sidebar.button("Logout Google"):
-         st.session_state.credentials = None
-         st.rerun()
-else:
-    st.sidebar.warning("Not authenticated with Google (needed to create Google Doc).")
-    if st.sidebar.button("Login with Google"):
-        get_credentials() # Call to potentially display the auth prompt
-
-# General File Uploader Section
-st.sidebar.divider()
-st.sidebar.subheader("Upload Supporting Files")
-support_file = st.sidebar.file_uploader(
-    "Upload Risk Register, Gantt, Evidence etc.",
-    type=['pdf', 'docx', 'xlsx', 'png', 'jpg', 'txt'],
-    key="support_file_uploader",
-    help="Files uploaded here are only available during the current session."
-)
-if support_file:
-    MAX_FILE_SIZE_MB = 5
-    if support_file.size > MAX_FILE_SIZE_MB * 1024 * 1024:
-        st.sidebar.error(f"File size exceeds {MAX_FILE_SIZE_MB}MB limit.")
+def profile_pic_path():
+    return blob_store.get_store().touch(st.session_state.profile_pic) if st.session_state.profile_pic else None
+
+@st.fragment
+def profile_fragment():
+    st.subheader("Your Profile")
+    st.text_input("Your Name:", key="user_name", on_change=autosave_checkpoint)
+
+    profile_pic_file = st.file_uploader("Upload Profile Picture:", type=['png', 'jpg', 'jpeg'], key=uploader_key("profile_pic_uploader"))
+    if profile_pic_file:
+        st.session_state.profile_pic = blob_store.get_store().put(profile_pic_file) # Store the digest, not the bytes
+        autosave_checkpoint()
+        release_uploader("profile_pic_uploader")
+        # Chat avatars pick the new picture up on the next chat turn
+
+    pic_path = profile_pic_path()
+    if pic_path:
+        st.image(pic_path, caption=f"{st.session_state.user_name}'s Profile Pic", width=100)
     else:
-        # Store info, maybe overwrite if same name uploaded?
-        st.session_state.uploaded_files_session_info[support_file.name] = {
-            "type": support_file.type, "size": support_file.size
-        }
-        st.sidebar.success(f"File '{support_file.name}' available for session.")
-
-
-# --- Display Chat History ---
-chat_container = st.container()
-with chat_container:
-    for message in st.session_state.messages:
+        st.text("(No profile picture uploaded)")
+
+def logout_google():
+    invalidate_google_services(st.session_state.credentials)
+    st.session_state.credentials = None
+    if st.session_state.user_key:
+        credential_cache.get_manager().forget(st.session_state.user_key)
+    st.session_state.user_key = None # Clears the browser's cookie too (see sync_user_key_cookie)
+
+def start_google_login():
+    st.session_state.auth_in_progress = True
+
+@st.fragment
+def google_auth_fragment():
+    st.subheader("Google Authentication")
+    sync_user_key_cookie()
+    if st.session_state.get('uid_link_used'):
+        st.warning("This link carried your Google sign-in (`?uid=`), and anyone who opens it is signed in as you. "
+                   "It has been removed from the address bar; don't share or bookmark the old link.")
+    if current_credentials():
+        st.success("Authenticated with Google.")
+        st.caption("You stay signed in on this browser until you log out.")
+        st.button("Logout Google", on_click=logout_google)
+    else:
+        st.warning("Not authenticated with Google (needed to create Google Doc).")
+        st.button("Login with Google", on_click=start_google_login)
+        if st.session_state.get('auth_in_progress'):
+            get_credentials() # Keeps showing the auth prompt until a code has been entered
+
+@st.fragment
+def support_files_fragment():
+    st.subheader("Upload Supporting Files")
+    support_file = st.file_uploader(
+        "Upload Risk Register, Gantt, Evidence etc.",
+        type=['pdf', 'docx', 'xlsx', 'png', 'jpg', 'txt'],
+        key=uploader_key("support_file_uploader"),
+        help="Files are kept on the server and restored when this session is reopened."
+    )
+    if support_file:
+        # The widget holds the whole upload in memory until it is released below, so keep a limit
+        MAX_FILE_SIZE_MB = 50
+        if support_file.size > MAX_FILE_SIZE_MB * 1024 * 1024:
+            st.error(f"File size exceeds {MAX_FILE_SIZE_MB}MB limit.")
+        else:
+            st.session_state.uploaded_files_session_info[support_file.name] = {
+                "type": support_file.type, "size": support_file.size,
+                "sha256": spool_and_index(support_file) # Spooled to disk and indexed for relevant-passage lookup
+            }
+            autosave_checkpoint()
+            release_uploader("support_file_uploader")
+    for name in st.session_state.uploaded_files_session_info:
+        st.caption(f"✓ {name}")
+
+@st.fragment
+def export_fragment():
+    """Local DOCX/Markdown/PDF download of a quarter's report (see report_export.py); no Google login needed."""
+    st.subheader("Download Report")
+    quarters = set(answer_store.get_store().quarters_with_answers(project().details['Project Number']))
+    if report_state().quarter:
+        quarters.add(report_state().quarter)
+    if not quarters:
+        st.caption("Answer a section to download a draft.")
+        return
+    quarters = sorted(quarters)
+    quarter = st.selectbox("Quarter", quarters, index=len(quarters) - 1, format_func=lambda q: f"Q{q}", key="export_quarter")
+    fmt = st.radio("Format", list(report_export.FORMATS), format_func=lambda f: report_export.FORMATS[f]["label"], horizontal=True, key="export_format")
+    # Built when asked for, so the download has the answers saved up to that click
+    if st.button("Prepare download", key="export_prepare"):
+        model = quarter_report_model(quarter)
+        st.download_button(f"Download {report_export.FORMATS[fmt]['label']}", data=report_export.export(model, fmt),
+                           file_name=report_export.export_filename(model, fmt), mime=report_export.FORMATS[fmt]["mime"], on_click="ignore")
+
+@st.fragment
+def changes_fragment():
+    """Side-by-side view of what changed in each section between two quarters (see quarter_history.py)."""
+    st.subheader("What Changed")
+    history = quarter_history.get_history()
+    project_number = project().details['Project Number']
+    quarters = history.quarters(project_number)
+    if len(quarters) < 2:
+        st.caption("Answer sections for two quarters to compare them.")
+        return
+    base = st.selectbox("Since", quarters[:-1], index=0, format_func=lambda q: f"Q{q}", key="changes_base")
+    later = [q for q in quarters if q > base]
+    quarter = st.selectbox("Up to", later, index=len(later) - 1, format_func=lambda q: f"Q{q}", key="changes_quarter")
+    sections = [key for key in project().section_keys if key != "quarter_end_date"]
+    rows = history.changes_since(project_number, base, quarter, sections)
+    with st.expander(f"Q{base} → Q{quarter}", expanded=False):
+        st.dataframe([{"Section": row["section"].replace('_', ' ').title(), "Status": row["status"],
+                       f"Q{base}": row["before"] or "", f"Q{quarter}": row["after"] or "",
+                       "+/- sentences": f"+{row['sentences_added']} / -{row['sentences_removed']}"} for row in rows],
+                     hide_index=True, width="stretch")
+
+with st.sidebar:
+    st.title("Settings & Info")
+    profile_fragment()
+    st.divider()
+    google_auth_fragment()
+    st.divider()
+    export_fragment()
+    st.divider()
+    changes_fragment()
+    st.divider()
+    support_files_fragment()
+
+
+# --- Poll Background Generation Job ---
+@st.fragment(run_every=1.0)
+def generation_status_poller():
+    """Reruns on its own every second until the session's generation job finishes."""
+    job = generation_jobs.get_queue().get(report_state().generation_job_id)
+    if job and not job.finished:
+        quarters_label = ", ".join(f"Q{q}" for q in job.quarter) if isinstance(job.quarter, tuple) else f"Q{job.quarter}"
+        st.info(f"Creating and populating Google Doc for {quarters_label}... ({job.status})")
+        return
+    report_conversation().dispatch(report_session.JOB_FINISHED, job)
+    save_and_rerun() # Full rerun: the result has to appear in the chat fragment's transcript
+
+# --- Chat Transcript (see transcript.py) ---
+def render_transcript():
+    """Draws the latest messages in full; older ones are paged and only drawn when picked."""
+    messages = report_state().messages
+    pages, window_start = transcript.split_window(len(messages))
+    if pages:
+        page = st.selectbox("Earlier messages", options=pages, index=None, format_func=transcript.page_label,
+                            placeholder=f"{window_start} earlier messages - pick a page to show it", key="transcript_page")
+        if page:
+            with st.container(border=True):
+                st.markdown(transcript.page_markdown(messages, page))
+    user_avatar = transcript.avatar_thumbnail(st.session_state.profile_pic)
+    for message in messages[window_start:]:
         role = message["role"]
-        avatar_icon = st.session_state.profile_pic if role == "user" else GRANTI_AUNTY_AVATAR
+        avatar_icon = user_avatar if role == "user" else GRANTI_AUNTY_AVATAR
         with st.chat_message(role, avatar=avatar_icon):
             st.markdown(message["content"])
 
-# --- Handle Grant App Upload within Chat ---
-grant_app_uploader_key = "grant_app_main_uploader"
-if st.session_state.stage == "request_grant_app":
-     grant_app_file = st.file_uploader(
-          "Upload Grant Application PDF",
-          type=['pdf'],
-          key=grant_app_uploader_key
-     )
-     if grant_app_file:
-          # Process Grant App Upload
-          print(f"DEBUG: Grant Application PDF uploaded: {grant_app_file.name}")
-          st.session_state.grant_app_info = {
-               "name": grant_app_file.name,
-               "size": grant_app_file.size,
-               "type": grant_app_file.type
-               # We could store bytes or extracted text here if needed & feasible
-          }
-          st.session_state.stage = "ask_section" # Move to next stage (asking for end date)
-          st.session_state.current_section_index = 0 # Reset section index for first question
-          bot_response = report_section_prompts["grant_app_received"].format(st.session_state.current_quarter)
-          st.session_state.messages.append({"role": "assistant", "content": bot_response})
-          # Clear the specific uploader after successful upload using rerun
-          st.rerun() # Rerun to move past the uploader and show the next prompt
-
-
-# --- Handle General Chat Input ---
-if prompt := st.chat_input("Your answer or command...", key="chat_input_main"):
-    print(f"DEBUG: User input received: '{prompt[:50]}...'")
-    st.session_state.messages.append({"role": "user", "content": prompt})
-
-    current_stage = st.session_state.stage
-    print(f"DEBUG: Current stage: {current_stage}")
-    bot_response = ""
-    trigger_rerun = True
-
-    try:
-        # --- Bot Logic Stages ---
-        if current_stage == "start":
-            print("DEBUG: Handling 'start' stage.")
-            # Use Selectbox for Quarter Selection now - This logic needs rethink
-            # The prompt now happens *before* selection. Selection widget needed.
-            # Let's adjust: The start prompt is just text. User selection happens via widget.
-            # We need a way to *trigger* the process after selection. Maybe a button?
-            # For now, let's assume the first user text input *is* the quarter number.
-
-            try:
-                 quarter_options = list(range(1, PROJECT_DETAILS['Total Quarters'] + 1))
-                 # This selection should ideally happen via a widget before chat starts,
-                 # but integrating into the flow:
-                 try_quarter = int(prompt)
-                 if try_quarter in quarter_options:
-                      st.session_state.current_quarter = try_quarter
-                      st.session_state.stage = "request_grant_app" # NEW Stage
-                      bot_response = report_section_prompts["request_grant_app"].format(st.session_state.current_quarter)
-                 else:
-                      bot_response = f"Please enter a valid quarter number {quarter_options} to begin."
-            except ValueError:
-                 bot_response = f"Please tell me which quarter number {quarter_options} you want to report on."
-            print(f"DEBUG: 'start' processed. Next stage: {st.session_state.stage}. Bot response: '{bot_response[:50]}...'")
-
-
-        elif current_stage == "request_grant_app":
-             # This stage primarily waits for the file uploader callback above.
-             # If user types instead of uploading:
-             bot_response = "Please use the file uploader that appeared above to upload your Grant Application PDF."
-             trigger_rerun = False # Don't rerun, wait for uploader
-
-        elif current_stage == "ask_section":
-            print(f"DEBUG: Handling 'ask_section'. Current index: {st.session_state.current_section_index}")
-            last_section_index = st.session_state.current_section_index
-            last_key = report_section_keys[last_section_index]
-            print(f"DEBUG: Saving answer for section: '{last_key}'")
-
-            # Store answer in the new structure
-            if st.session_state.current_quarter not in st.session_state.all_answers:
-                 st.session_state.all_answers[st.session_state.current_quarter] = {}
-            st.session_state.all_answers[st.session_state.current_quarter][last_key] = prompt
-
-            # Move to next section
-            st.session_state.current_section_index += 1
-
-            if st.session_state.current_section_index < len(report_section_keys):
-                 next_key = report_section_keys[st.session_state.current_section_index]
-                 print(f"DEBUG: Asking for next section: '{next_key}'")
-                 base_prompt = report_section_prompts.get(next_key, "Please provide details for the next section.")
-                 
-                 # Add context from previous quarter if applicable
-                 context_str = ""
-                 if st.session_state.current_quarter > 1:
-                      prev_q_num = st.session_state.current_quarter - 1
-                      prev_answer = st.session_state.get('all_answers', {}).get(prev_q_num, {}).get(next_key)
-                      if prev_answer:
-                           context_str = f"\n\n*(For context, last quarter (Q{prev_q_num}) you wrote: '{prev_answer[:150]}...')*" # Show more context
-
-                 # Add reminder about grant app
-                 grant_app_context_str = ""
-                 if next_key in ["scope", "time", "overall_summary"]: # Sections likely related to original app
-                      if st.session_state.grant_app_info:
-                           grant_app_context_str = f"\n*(Remember to consult your uploaded grant application: '{st.session_state.grant_app_info['name']}')*"
-                      else:
-                           grant_app_context_str = "\n*(You might want to refer to your original grant application.)*"
-
-
-                 bot_response = base_prompt + context_str + grant_app_context_str
-
-                 # Add upload reminder
-                 if next_key in ["time", "risk_management", "cost"]:
-                      bot_response += "\n\n" + report_section_prompts["upload_request"]
-            else:
-                 print("DEBUG: All sections collected. Moving to 'confirm_generate'.")
-                 st.session_state.stage = "confirm_generate"
-                 bot_response = report_section_prompts["ready_to_generate"].format(st.session_state.current_quarter)
-            print(f"DEBUG: 'ask_section' processed. Next stage: {st.session_state.stage}. Bot response: '{bot_response[:50]}...'")
-
-        # --- Stages confirm_generate, generating, done remain largely the same ---
-        # --- Need to update create_google_doc to use st.session_state.all_answers ---
-        elif current_stage == "confirm_generate": # (Logic Unchanged)
-            print("DEBUG: Handling 'confirm_generate' stage.")
-            if prompt.lower() in ["yes", "y", "ok", "generate", "confirm"]:
-                print("DEBUG: User confirmed generation. Checking credentials...")
-                creds = get_credentials()
-                if not creds or not creds.valid:
-                     bot_response = "Authentication needed. Please use the 'Login with Google' button in the sidebar and complete the authorization steps first."
-                     print("DEBUG: Credentials invalid/missing for generation.")
-                     trigger_rerun = False
-                else:
-                    print("DEBUG: Credentials valid. Moving to 'generating' stage.")
-                    st.session_state.stage = "generating"
-                    bot_response = "Okay, generating the Google Doc now..."
-            else:
-                print("DEBUG: User did not confirm generation.")
-                bot_response = "Okay, I won't generate the document yet. Let me know if you change your mind or type 'yes' to generate."
-            print(f"DEBUG: 'confirm_generate' processed. Next stage: {st.session_state.stage}. Bot response: '{bot_response[:50]}...'")
-
-
-        elif current_stage == "generating": # (Updated create_google_doc call)
-             print("DEBUG: Handling 'generating' stage.")
-             creds = get_credentials()
-             if creds and creds.valid:
-                 print("DEBUG: Credentials valid, attempting document creation...")
-                 # Get answers for the current quarter from the new structure
-                 current_answers = st.session_state.all_answers.get(st.session_state.current_quarter, {})
-                 with st.spinner("Creating and populating Google Doc... This may take a moment."):
-                      doc_title = create_google_doc( # Pass current_answers
-                          creds,
-                          st.session_state.current_quarter,
-                          current_answers
-                      )
-                 if doc_title:
-                      print(f"DEBUG: Document creation successful. Title: {doc_title}")
-                      bot_response = report_section_prompts["generation_complete"].format(doc_title)
-                      st.session_state.stage = "done"
-                 else:
-                      print("ERROR: Document creation failed (create_google_doc returned None).")
-                      bot_response = report_section_prompts["error"] + " Failed during document creation. Please check Google permissions or try again."
-                      st.session_state.stage = "confirm_generate"
-             else:
-                 print("ERROR: Credentials invalid/expired before generation could start.")
-                 bot_response = "Google authentication failed or expired. Please log in again via the sidebar before generating."
-                 st.session_state.stage = "confirm_generate"
-             trigger_rerun = True
-             print(f"DEBUG: 'generating' processed. Next stage: {st.session_state.stage}. Bot response: '{bot_response[:50]}...'")
-
-
-        elif current_stage == "done": # (Logic Unchanged)
-            print("DEBUG: Handling 'done' stage.")
-            bot_response = "Report generation complete. You can start a new report by telling me the quarter number."
-            st.session_state.stage = "start"
-            print(f"DEBUG: 'done' processed. Resetting to 'start'. Bot response: '{bot_response[:50]}...'")
-
-        else: # Default / Error stage (Logic Unchanged)
-             print(f"ERROR: Unknown stage encountered: {current_stage}. Resetting.")
-             bot_response = report_section_prompts.get("error", "Sorry, I'm in an unknown state. Let's start over.")
-             st.session_state.stage = "start"
-             print(f"DEBUG: Unknown stage handled. Resetting to 'start'. Bot response: '{bot_response[:50]}...'")
-
-
-    except Exception as e: # General Error Handling (Logic Unchanged)
-         print(f"ERROR: Unexpected exception in chatbot logic (Stage: {current_stage}): {e}")
-         print(traceback.format_exc())
-         st.error(f"An unexpected error occurred: {e}")
-         bot_response = report_section_prompts.get("error", "An unexpected error occurred. Resetting.")
-         st.session_state.stage = "start"
-
-
-    if bot_response:
-        st.session_state.messages.append({"role": "assistant", "content": bot_response})
-
-    if trigger_rerun:
-        print("--- Triggering Streamlit Rerun ---")
-        st.rerun()
-    else:
-        print("--- Suppressing Streamlit Rerun (likely waiting for user action) ---")
-
-
-# --- Initial Bot Prompt ---
-# Add the initial prompt only if the chat history is empty.
-if not st.session_state.messages:
-     print("--- Adding initial bot prompt ---")
-     initial_prompt = report_section_prompts["start"]
-     st.session_state.messages.append({"role": "assistant", "content": initial_prompt})
-     st.rerun() # Rerun to display the initial message
+# --- Chat ---
+@st.fragment
+def chat_fragment():
+    """Transcript, grant application uploader and chat input.
+
+    Input is handled before anything is drawn, so a chat turn is rendered in the
+    same (fragment) run that processed it - no follow-up rerun needed.
+    """
+    transcript_slot = st.container()
+    uploader_slot = st.empty()
+    status_slot = st.container()
+
+    conversation = report_conversation()
+    prompt = st.chat_input("Your answer or command...", key="chat_input_main")
+    if prompt:
+        conversation.send(prompt)
+    if report_state().stage == report_session.REQUEST_GRANT_APP:
+        grant_app_file = uploader_slot.file_uploader("Upload Grant Application PDF", type=['pdf'], key="grant_app_main_uploader")
+        if grant_app_file:
+            conversation.dispatch(report_session.GRANT_APP_UPLOADED, {
+                "name": grant_app_file.name,
+                "size": grant_app_file.size,
+                "type": grant_app_file.type,
+                # Bytes are spooled to the blob store; text is extracted in the background (see text_extract.py)
+                "sha256": spool_and_index(grant_app_file)
+            })
+            uploader_slot.empty() # Move past the uploader
+    if conversation.error:
+        st.error(f"An unexpected error occurred: {conversation.error}")
+    autosave_checkpoint()
+
+    with transcript_slot:
+        render_transcript()
+    if report_state().stage == report_session.GENERATING and report_state().generation_job_id:
+        with status_slot:
+            generation_status_poller()
+
+chat_fragment()
 
 # --- Quarter Selection Widget (Alternative Approach) ---
 # This widget approach conflicts slightly with the pure chat flow initiated above.
 # You would typically have the user select the quarter *before* starting the chat input loop.
 # Example - place this near the top if you prefer widget selection:
-# quarter_options = list(range(1, PROJECT_DETAILS['Total Quarters'] + 1))
+# quarter_options = list(range(1, project().details['Total Quarters'] + 1))
 # selected_q = st.selectbox("Select Reporting Quarter:", options=quarter_options, index=None, placeholder="Choose quarter...")
 # if selected_q and st.button("Start Report for Q{selected_q}"):
 #      st.session_state.current_quarter = selected_q
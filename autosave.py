@@ -0,0 +1,251 @@
+"""Crash-safe autosave of chat sessions.
+
+Every state transition of a session (changed stage/section index/etc., new
+chat messages) is appended as one JSON line to that session's write-ahead log
+under ``granti_data/sessions/``. Appends only hit the OS page cache; a single
+background thread fsyncs all dirty logs together every ``FSYNC_INTERVAL_SECONDS``
+and compacts logs that have grown past ``COMPACT_AFTER_RECORDS`` into one
+snapshot record. ``restore()`` replays a log (ignoring a torn final line) so a
+reconnecting session picks up exactly where it was.
+
+A log has a single writer. A browser session ``claim()``s its log before
+writing to it. If another live session already holds it (the same link open
+in two tabs), the caller forks to a new session ID instead. Otherwise both
+would append from their own transcripts into one log.
+
+The session ID is a bearer credential for the whole transcript, so app.py
+keeps it in a browser cookie (``COOKIE_NAME``), never in the URL. Older links
+carried it as ``?sid=``; such a link is accepted once, stripped from the
+address bar and the user is warned not to share it.
+"""
+import copy
+import json
+import os
+import re
+import threading
+import time
+
+import instrumentation
+
+DATA_DIR = os.environ.get("GRANTI_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "granti_data"))
+SESSIONS_DIR = os.path.join(DATA_DIR, "sessions")
+FSYNC_INTERVAL_SECONDS = 1.0
+COMPACT_AFTER_RECORDS = 500
+IDLE_CLOSE_SECONDS = 15 * 60
+COOKIE_NAME = "granti_sid"
+COOKIE_MAX_AGE_SECONDS = 30 * 24 * 60 * 60
+
+logger = instrumentation.get_logger("autosave")
+
+_SESSION_ID_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def valid_session_id(session_id):
+    return isinstance(session_id, str) and bool(_SESSION_ID_RE.match(session_id))
+
+
+def _log_path(session_id):
+    return os.path.join(SESSIONS_DIR, f"{session_id}.wal")
+
+
+def _replay(path):
+    """Returns ``(state, messages, record_count, valid_bytes)`` rebuilt from a log file."""
+    state, messages, count, valid_bytes = {}, [], 0, 0
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("incomplete record")
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warn("Ignoring torn record at the end of the autosave log", path=path)
+                    break
+                op = record.get('op')
+                if op == 'snapshot':
+                    state, messages = record['state'], record['messages']
+                elif op == 'set':
+                    state.update(record['values'])
+                elif op == 'message':
+                    messages.append(record['message'])
+                count += 1
+                valid_bytes += len(line)
+    except FileNotFoundError:
+        pass
+    return state, messages, count, valid_bytes
+
+
+class SessionLog:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.path = _log_path(session_id)
+        self.lock = threading.Lock()
+        state, messages, self.records, valid_bytes = _replay(self.path)
+        self.last_state = state
+        self.message_count = len(messages)
+        self.dirty = False
+        self.last_used = time.time()
+        self._file = open(self.path, 'a', encoding='utf-8')
+        if self._file.tell() > valid_bytes:
+            self._file.truncate(valid_bytes)  # Drop a torn record left by a crash mid-append
+
+    def _append(self, record):
+        self._file.write(json.dumps(record, separators=(',', ':'), default=str) + "\n")
+        self.records += 1
+
+    def record(self, state, messages):
+        """Appends whatever changed since the last call. Cheap when nothing did.
+
+        Returns False if the log has already been closed (the caller should reopen it).
+        """
+        with self.lock:
+            if self._file.closed:
+                return False
+            changed = {k: copy.deepcopy(v) for k, v in state.items() if self.last_state.get(k, _MISSING) != v}
+            if changed:
+                self._append({'op': 'set', 'values': changed})
+                self.last_state.update(changed)
+            if len(messages) < self.message_count:
+                # Transcript was reset; start the log over from a snapshot
+                self._write_snapshot(dict(self.last_state), list(messages))
+                self.message_count = len(messages)
+            new_messages = messages[self.message_count:]
+            for message in new_messages:
+                self._append({'op': 'message', 'message': message})
+            self.message_count = len(messages)
+            if changed or new_messages:
+                self._file.flush()
+                self.dirty = True
+            self.last_used = time.time()
+            return True
+
+    def sync(self):
+        with self.lock:
+            if self.dirty and not self._file.closed:
+                os.fsync(self._file.fileno())
+                self.dirty = False
+
+    def _write_snapshot(self, state, messages):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'op': 'snapshot', 'state': state, 'messages': messages}, separators=(',', ':'), default=str) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._file.close()
+        os.replace(tmp_path, self.path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self.records = 1
+        self.dirty = False
+
+    def compact(self):
+        with self.lock:
+            self._file.flush()
+            state, messages, _, _ = _replay(self.path)
+            self._write_snapshot(state, messages)
+
+    def close(self):
+        with self.lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+
+_MISSING = object()
+
+
+class Autosaver:
+    def __init__(self):
+        os.makedirs(SESSIONS_DIR, exist_ok=True)
+        self._lock = threading.Lock()
+        self._logs = {}
+        self._leases = {}  # session_id -> (owner, is_live)
+        self._thread = threading.Thread(target=self._sync_loop, name="autosave-sync", daemon=True)
+        self._thread.start()
+
+    def _log(self, session_id):
+        log = self._logs.get(session_id)
+        if log is None:
+            with self._lock:
+                log = self._logs.get(session_id)
+                if log is None:
+                    log = self._logs[session_id] = SessionLog(session_id)
+        return log
+
+    # --- Leases ---
+    def claim(self, session_id, owner, is_live=None):
+        """Makes ``owner`` the only writer of the session's log. Returns False if another live owner holds it.
+
+        ``is_live(owner)`` says whether an owner is still connected; without it
+        an owner holds its lease for as long as the process runs.
+        """
+        with self._lock:
+            current = self._leases.get(session_id)
+            if current and current[0] != owner and (current[1] is None or current[1](current[0])):
+                return False
+            self._leases[session_id] = (owner, is_live)
+            return True
+
+    def record(self, session_id, state, messages, owner=None):
+        """Appends what changed to the session's log; ignored if ``owner`` doesn't hold the session's lease."""
+        lease = self._leases.get(session_id)
+        if owner is not None and lease and lease[0] != owner:
+            logger.warn("Ignoring autosave from a session that doesn't own the log", session_id=session_id)
+            return
+        if not self._log(session_id).record(state, messages):
+            with self._lock:
+                self._logs.pop(session_id, None)
+            self._log(session_id).record(state, messages)
+
+    def restore(self, session_id):
+        """Returns ``(state, messages)`` for a session, or ``({}, [])`` if it has no log."""
+        with self._lock:
+            log = self._logs.get(session_id)
+        if log is not None:
+            with log.lock:
+                if not log._file.closed:
+                    log._file.flush()
+                state, messages, _, _ = _replay(log.path)
+            return state, messages
+        state, messages, _, _ = _replay(_log_path(session_id))
+        return state, messages
+
+    def _sync_loop(self):
+        while True:
+            time.sleep(FSYNC_INTERVAL_SECONDS)
+            with self._lock:
+                logs = list(self._logs.values())
+                leases = list(self._leases.items())
+            for session_id, (owner, is_live) in leases:
+                try:
+                    if is_live is not None and not is_live(owner):
+                        with self._lock:
+                            if self._leases.get(session_id, (None,))[0] == owner:
+                                del self._leases[session_id]
+                except Exception as e:
+                    logger.warn("Autosave lease check failed", session_id=session_id, error=e)
+            now = time.time()
+            for log in logs:
+                try:
+                    log.sync()
+                    if log.records > COMPACT_AFTER_RECORDS:
+                        log.compact()
+                    if now - log.last_used > IDLE_CLOSE_SECONDS:
+                        with self._lock:
+                            self._logs.pop(log.session_id, None)
+                        log.close()
+                except Exception as e:
+                    logger.warn("Autosave sync failed", session_id=log.session_id, error=e)
+
+
+_autosaver = None
+_autosaver_lock = threading.Lock()
+
+
+def get_autosaver():
+    """Returns the process-wide autosaver."""
+    global _autosaver
+    if _autosaver is None:
+        with _autosaver_lock:
+            if _autosaver is None:
+                _autosaver = Autosaver()
+    return _autosaver
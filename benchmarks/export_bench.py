@@ -0,0 +1,70 @@
+"""Time to export a full report locally as Markdown, DOCX and PDF.
+
+A report with every section of the report template answered (plus previous
+quarter context) is exported repeatedly in each format (see
+report_export.py). Cold runs clear the export cache first. Warm runs replay
+the cached chunks, like a repeated download of an unchanged report.
+
+    python benchmarks/export_bench.py [--answer-chars 1500] [--runs 50] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import report_export  # noqa: E402
+import report_model  # noqa: E402
+
+PROJECT_DETAILS = {"Project title": "Export benchmark", "Project Number": "10000000"}
+SECTION_KEYS = ["quarter_end_date", "overall_summary", "progress", "issues_actions", "scope", "time", "cost",
+                "exploitation", "risk_management", "project_planning", "next_quarter_forecast"]  # Mirrors the sections in projects/_defaults.toml
+SENTENCE = "We completed the integration work package, onboarded two farms and ran the first trial (costs within 5%). "
+
+
+def make_model(answer_chars):
+    answer = (SENTENCE * (answer_chars // len(SENTENCE) + 1))[:answer_chars]
+    answers = {key: answer for key in SECTION_KEYS}
+    answers["quarter_end_date"] = "30/06/2025"
+    contexts = report_model.contexts_from_answers(2, {1: dict(answers)}, SECTION_KEYS)
+    return report_model.build_report_model(PROJECT_DETAILS, SECTION_KEYS, 2, answers, contexts)
+
+
+def time_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answer-chars", type=int, default=1500, help="Length of every section's answer")
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    model = make_model(args.answer_chars)
+    results = {"answer_chars": args.answer_chars, "formats": {}}
+    for fmt in report_export.FORMATS:
+        def cold():
+            report_export._cache.clear()
+            report_export._cache_bytes = 0
+            return report_export.export(model, fmt)
+        size = len(cold())
+        results["formats"][fmt] = {"bytes": size, "cold_ms": time_ms(cold, args.runs),
+                                   "cached_ms": time_ms(lambda: report_export.export(model, fmt), args.runs)}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for fmt, result in results["formats"].items():
+        print(f"{fmt:<5} {result['bytes']:>8} bytes  cold {result['cold_ms']:>8} ms  cached {result['cached_ms']:>7} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""A local stand-in for the parts of the Google Drive and Docs APIs the app uses.
+
+It runs in a background thread, and documents are kept in memory. Point the
+app at it with ``GRANTI_GOOGLE_API_ROOT=http://127.0.0.1:<port>/`` (see
+google_services.py). ``latency_ms`` adds a fixed delay to every call to mimic
+the real round trip.
+
+``quotas`` makes it enforce Google-style quotas: ``{api: {"project": n, "user":
+n}}`` requests per ``quota_window`` seconds, where api is "docs.read",
+"docs.write" or "drive" and users are told apart by their access token. Calls
+over quota get a 429 and are counted in ``calls`` as "429 <api>".
+
+    server = FakeGoogleServer(latency_ms=80).start()
+    os.environ["GRANTI_GOOGLE_API_ROOT"] = server.url
+"""
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+_DOC_RE = re.compile(r"^/v1/documents/([^/:]+)$")
+_BATCH_UPDATE_RE = re.compile(r"^/v1/documents/([^/:]+):batchUpdate$")
+_FILE_RE = re.compile(r"^/drive/v3/files/([^/]+)$")
+_APP_PROPERTY_RE = re.compile(r"appProperties has \{ key='([^']+)' and value='([^']+)' \}")
+NORMAL_TEXT = "NORMAL_TEXT"
+
+
+class FakeGoogleServer:
+    def __init__(self, latency_ms=0, host="127.0.0.1", port=0, quotas=None, quota_window=60.0):
+        self.latency = latency_ms / 1000.0
+        self.quotas = quotas or {}
+        self.quota_window = quota_window
+        self.lock = threading.Lock()
+        self.usage = {}  # (api, "project"/user token, window number) -> calls
+        self.files = {}  # id -> Drive file metadata
+        self.bodies = {}  # id -> document text
+        self.styles = {}  # id -> named paragraph style of each character of the text
+        self.last_requests = {}  # id -> requests of the document's latest batchUpdate
+        self.calls = {}  # "METHOD /path-kind" -> count
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="fake-google", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def count(self, kind):
+        with self.lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+    def within_quota(self, api, user):
+        """Counts a call against the project's and the user's quota; False if either is used up."""
+        limits = self.quotas.get(api)
+        if not limits:
+            return True
+        window = int(time.time() // self.quota_window)
+        keys = [((api, "project", window), limits.get("project")), ((api, user, window), limits.get("user"))]
+        with self.lock:
+            for key in list(self.usage):
+                if key[2] < window:
+                    del self.usage[key]
+            if any(limit is not None and self.usage.get(key, 0) >= limit for key, limit in keys):
+                return False
+            for key, _ in keys:
+                self.usage[key] = self.usage.get(key, 0) + 1
+        return True
+
+    # --- Drive ---
+    def create_file(self, metadata):
+        file_id = uuid.uuid4().hex
+        with self.lock:
+            self.files[file_id] = dict(metadata, id=file_id)
+            self.bodies[file_id] = "\n"
+            self.styles[file_id] = [NORMAL_TEXT]
+        return {"id": file_id}
+
+    def list_files(self, query):
+        match = _APP_PROPERTY_RE.search(query or "")
+        with self.lock:
+            files = [f for f in self.files.values()
+                     if not match or f.get("appProperties", {}).get(match.group(1)) == match.group(2)]
+        return {"files": [{"id": f["id"]} for f in files]}
+
+    def update_file(self, file_id, metadata):
+        """Applies a files.update body; like Drive, appProperties are merged key by key."""
+        with self.lock:
+            current = self.files.get(file_id)
+            if current is None:
+                return None
+            app_properties = dict(current.get("appProperties", {}), **metadata.get("appProperties", {}))
+            current.update(metadata, appProperties=app_properties)
+            return {"id": file_id}
+
+    def delete_file(self, file_id):
+        with self.lock:
+            self.bodies.pop(file_id, None)
+            self.styles.pop(file_id, None)
+            self.last_requests.pop(file_id, None)
+            return self.files.pop(file_id, None) is not None
+
+    # --- Docs ---
+    def get_document(self, doc_id):
+        with self.lock:
+            text, styles = self.bodies.get(doc_id), self.styles.get(doc_id)
+        if text is None:
+            return None
+        # Only enough structure for reading the body's end index and its paragraphs
+        content, index = [{"endIndex": 1, "sectionBreak": {}}], 1
+        for line in text.splitlines(keepends=True):
+            end = index + len(line)
+            content.append({"startIndex": index, "endIndex": end, "paragraph": {
+                "elements": [{"startIndex": index, "endIndex": end, "textRun": {"content": line}}],
+                "paragraphStyle": {"namedStyleType": styles[index - 1]}}})
+            index = end
+        return {"documentId": doc_id, "body": {"content": content}}
+
+    def paragraph_styles(self, doc_id):
+        """``[(paragraph text, named style), ...]`` of a document."""
+        document = self.get_document(doc_id)
+        return [(e["paragraph"]["elements"][0]["textRun"]["content"], e["paragraph"]["paragraphStyle"]["namedStyleType"])
+                for e in document["body"]["content"] if "paragraph" in e]
+
+    def batch_update(self, doc_id, requests):
+        """Applies text inserts and deletes and paragraph styles; indices count characters (enough for ASCII text)."""
+        with self.lock:
+            text, styles = self.bodies.get(doc_id), self.styles.get(doc_id)
+            if text is None:
+                return None
+            styles = list(styles)
+            for request in requests:
+                if 'insertText' in request:
+                    at = request['insertText']['location']['index'] - 1
+                    inserted = request['insertText']['text']
+                    # Like Docs, new text takes the style of the paragraph it is inserted into
+                    text = text[:at] + inserted + text[at:]
+                    styles[at:at] = [styles[at] if at < len(styles) else NORMAL_TEXT] * len(inserted)
+                elif 'deleteContentRange' in request:
+                    r = request['deleteContentRange']['range']
+                    text = text[:r['startIndex'] - 1] + text[r['endIndex'] - 1:]
+                    del styles[r['startIndex'] - 1:r['endIndex'] - 1]
+                elif 'updateParagraphStyle' in request:
+                    r = request['updateParagraphStyle']['range']
+                    # Every paragraph the range touches gets the style
+                    start = text.rfind("\n", 0, r['startIndex'] - 1) + 1
+                    end = text.find("\n", max(r['endIndex'] - 2, start))
+                    end = len(text) if end == -1 else end + 1
+                    styles[start:end] = [request['updateParagraphStyle']['paragraphStyle']['namedStyleType']] * (end - start)
+            self.bodies[doc_id], self.styles[doc_id] = text, styles
+            self.last_requests[doc_id] = requests
+        return {"documentId": doc_id, "replies": [{} for _ in requests]}
+
+
+def _make_handler(server):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, payload=None):
+            body = json.dumps(payload if payload is not None else {}).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _not_found(self):
+            self._reply(404, {"error": {"code": 404, "message": "Requested entity was not found.", "status": "NOT_FOUND"}})
+
+        def _json_body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def _route(self, method):
+            if server.latency:
+                time.sleep(server.latency)
+            url = urlparse(self.path)
+            path = url.path.rstrip("/")
+            api = "drive" if path.startswith("/drive/") else ("docs.read" if method == "GET" else "docs.write")
+            if not server.within_quota(api, self.headers.get("Authorization", "")):
+                server.count(f"429 {api}")
+                self.rfile.read(int(self.headers.get("Content-Length") or 0))  # Keep the connection usable
+                return self._reply(429, {"error": {"code": 429, "message": f"Quota exceeded for {api}.", "status": "RESOURCE_EXHAUSTED"}})
+            if method == "POST" and path == "/drive/v3/files":
+                server.count("drive.files.create")
+                return self._reply(200, server.create_file(self._json_body()))
+            if method == "GET" and path == "/drive/v3/files":
+                server.count("drive.files.list")
+                return self._reply(200, server.list_files(parse_qs(url.query).get("q", [""])[0]))
+            match = _FILE_RE.match(path)
+            if method == "PATCH" and match:
+                server.count("drive.files.update")
+                result = server.update_file(match.group(1), self._json_body())
+                return self._reply(200, result) if result else self._not_found()
+            if method == "DELETE" and match:
+                server.count("drive.files.delete")
+                if not server.delete_file(match.group(1)):
+                    return self._not_found()
+                self.send_response(204)
+                self.send_header("Content-Length", "0")
+                return self.end_headers()
+            match = _DOC_RE.match(path)
+            if method == "GET" and match:
+                server.count("docs.documents.get")
+                doc = server.get_document(match.group(1))
+                return self._reply(200, doc) if doc else self._not_found()
+            match = _BATCH_UPDATE_RE.match(path)
+            if method == "POST" and match:
+                server.count("docs.documents.batchUpdate")
+                result = server.batch_update(match.group(1), self._json_body().get("requests", []))
+                return self._reply(200, result) if result else self._not_found()
+            server.count(f"unhandled {method} {path}")
+            self._reply(501, {"error": {"code": 501, "message": f"Fake server does not implement {method} {path}"}})
+
+        def do_GET(self):
+            self._route("GET")
+
+        def do_POST(self):
+            self._route("POST")
+
+        def do_PATCH(self):
+            self._route("PATCH")
+
+        def do_DELETE(self):
+            self._route("DELETE")
+
+    return Handler
@@ -0,0 +1,80 @@
+"""Time to look up earlier-quarter context and build the "what changed" view.
+
+A project with ``--quarters`` quarters of answers to every section of the report
+template is loaded into a throwaway answer store. Per-prompt context lookups
+and whole-report contexts go through the quarter history (see
+quarter_history.py). A baseline times the same contexts rebuilt from
+the store's answers each time. The "what changed since Q1" view is timed cold
+(just after an answer was saved) and cached.
+
+    python benchmarks/history_bench.py [--quarters 12] [--answer-chars 1500] [--runs 200] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ["GRANTI_ANSWER_DB"] = ":memory:"  # Read by answer_store when it is imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import answer_store  # noqa: E402
+import quarter_history  # noqa: E402
+import report_model  # noqa: E402
+
+PROJECT = "10000000"
+SECTION_KEYS = ["quarter_end_date", "overall_summary", "progress", "issues_actions", "scope", "time", "cost",
+                "exploitation", "risk_management", "project_planning", "next_quarter_forecast"]  # Mirrors the sections in projects/_defaults.toml
+SENTENCE = "We completed work package {} and onboarded {} farms for the trial (costs within 5%). "
+
+
+def time_ms(fn, runs):
+    samples = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return round(statistics.median(samples), 4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--quarters", type=int, default=12)
+    parser.add_argument("--answer-chars", type=int, default=1500, help="Length of every section's answer")
+    parser.add_argument("--runs", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    store = answer_store.SQLiteAnswerStore(":memory:")
+    for quarter in range(1, args.quarters + 1):
+        for i, key in enumerate(SECTION_KEYS):
+            text = "".join(SENTENCE.format(quarter, n + i) for n in range(args.answer_chars // len(SENTENCE) + 1))
+            store.save_answer(PROJECT, quarter, key, text[:args.answer_chars])
+    history = quarter_history.QuarterHistory(store)
+    last = args.quarters
+
+    start = time.perf_counter()
+    history.quarters(PROJECT)
+    results = {"quarters": args.quarters, "answer_chars": args.answer_chars,
+               "load_ms": round((time.perf_counter() - start) * 1000, 3)}
+    results["prompt_context_ms"] = time_ms(lambda: history.context(PROJECT, last, "progress"), args.runs)
+    results["report_context_ms"] = time_ms(lambda: history.report_context(PROJECT, last, SECTION_KEYS), args.runs)
+    results["baseline_report_context_ms"] = time_ms(
+        lambda: report_model.contexts_from_answers(last, store.load_project(PROJECT), SECTION_KEYS), args.runs)
+
+    def cold_changes():
+        store.save_answer(PROJECT, last, "progress", store.get_answer(PROJECT, last, "progress"))  # Invalidates the cached view
+        return history.changes_since(PROJECT, 1, last, SECTION_KEYS)
+    results["changes_cold_ms"] = time_ms(cold_changes, args.runs)
+    results["changes_cached_ms"] = time_ms(lambda: history.changes_since(PROJECT, 1, last, SECTION_KEYS), args.runs)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for key, value in results.items():
+        print(f"{key:<28} {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+"""Load test: many concurrent chat sessions against one app process.
+
+Each simulated user drives app.py end to end through Streamlit's ``AppTest``:
+- pick a quarter
+- upload the grant application
+- answer every section
+- confirm, then poll until the Google Doc has been generated
+
+Google is replaced by the local fake in fake_google.py, so generation
+exercises the real publishing code over HTTP. All sessions share this
+process, just like sessions on one Streamlit server. ``AppTest`` swaps
+process-wide state (the script run context, secrets, query params) in and
+out around each run, so script runs are serialised with a lock. Everything
+around them runs concurrently: generation jobs, text extraction and the
+fake Google API. A turn's latency is the time its script run took. Time
+spent waiting for the lock is reported separately.
+
+The run reports:
+- p50/p95/p99 turn latency (one ``AppTest.run()`` per chat turn) and lock wait
+- generation latency (confirmation to link)
+- RSS growth per session
+- throughput
+
+Results are printed as a table, and as JSON with ``--json``/``--output`` for
+tracking regressions over time.
+
+    python benchmarks/load_test.py --sessions 20 --concurrency 10 --api-latency-ms 80 --output results.json
+
+With the defaults (20 sessions, concurrency 10, 50 ms API latency) on a
+single-core Linux VM with Python 3.11, one run gave:
+- 1.4 sessions/s
+- turn latency p50 32 ms, p95 69 ms
+- generation p95 1.7 s
+- about 21 MB RSS per session (13 MB at 50 sessions)
+
+Notes:
+- ``AppTest`` has no file_uploader support, so the upload step spools the PDF
+  and sends the session's ``grant_app_uploaded`` event directly (see
+  report_session.py), then reruns the app.
+- ``AppTest`` runs the whole script on every run, so turn latencies are an
+  upper bound on the fragment reruns a browser would trigger.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT, "app.py")
+SCOPES = ['https://www.googleapis.com/auth/documents', 'https://www.googleapis.com/auth/drive.file']
+FAKE_WEB_SECRETS = {
+    "client_id": "load-test.apps.googleusercontent.com", "project_id": "load-test",
+    "auth_uri": "https://accounts.google.com/o/oauth2/auth", "token_uri": "https://oauth2.googleapis.com/token",
+    "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs", "client_secret": "load-test",
+}
+_run_lock = threading.Lock()  # One AppTest script run at a time (see the module docstring)
+ANSWER_TEXT = ("This quarter we completed the data integration work package, onboarded two more farms and "
+               "ran the first factory trial. Costs are within 5% of forecast. ") * 3
+
+
+def minimal_pdf(pages=3):
+    """Bytes of a small valid PDF with a line of text per page."""
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for page in range(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td (Grant application page {page + 1}: project scope, milestones and risk register.) Tj ET"
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {len(objects)} 0 R /Resources << /Font << /F1 3 0 R >> >> >>")
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {pages} >>"
+    out, offsets = bytearray(b"%PDF-1.4\n"), []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    return bytes(out)
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+class SimulatedUser:
+    def __init__(self, number, args, pdf):
+        from google.oauth2.credentials import Credentials
+        from streamlit.testing.v1 import AppTest
+
+        self.number = number
+        self.args = args
+        self.pdf = pdf
+        self.turn_seconds = []
+        self.wait_seconds = []
+        self.generation_seconds = None
+        self.error = None
+        self.at = AppTest.from_file(APP_PATH, default_timeout=args.run_timeout)
+        self.at.secrets["google_credentials"] = {"web": FAKE_WEB_SECRETS}
+        self.at.session_state["credentials"] = Credentials(token=f"load-test-token-{number}", scopes=SCOPES)
+        self.at.session_state["project_id"] = args.project
+
+    def _run(self):
+        queued = time.perf_counter()
+        with _run_lock:
+            start = time.perf_counter()
+            self.at.run()
+            elapsed = time.perf_counter() - start
+        self.wait_seconds.append(start - queued)
+        if self.at.exception:
+            raise RuntimeError(f"App raised: {self.at.exception[0].value}")
+        return elapsed
+
+    def _say(self, text):
+        self.at.chat_input[0].set_value(text)
+        self.turn_seconds.append(self._run())
+
+    def _stage(self):
+        return self.at.session_state["report_state"].stage
+
+    def _upload_grant_app(self):
+        import blob_store
+        import report_session
+        import text_extract
+
+        digest = blob_store.get_store().put_bytes(self.pdf)
+        text_extract.submit(digest, "pdf")
+        with _run_lock:
+            state = self.at.session_state["report_state"]
+            # Only the transition matters here; the reply text comes from a placeholder prompt
+            session = report_session.ReportSession(state, {}, [], {"grant_app_received": "Grant application received (Q{0})."}, answers=None)
+            session.dispatch(report_session.GRANT_APP_UPLOADED, {"name": "grant_application.pdf", "size": len(self.pdf), "type": "application/pdf", "sha256": digest})
+        self.turn_seconds.append(self._run())
+
+    def converse(self):
+        try:
+            self._run()  # Opening page load
+            self._say(str(self.number % self.args.quarters + 1))
+            self._upload_grant_app()
+            for _ in range(self.args.section_count):
+                self._say(ANSWER_TEXT)
+            if self._stage() != "confirm_generate":
+                raise RuntimeError(f"Expected to be asked for confirmation, stage is '{self._stage()}'")
+            start = time.perf_counter()
+            self._say("yes")
+            deadline = start + self.args.generation_timeout
+            while self._stage() == "generating":
+                if time.perf_counter() > deadline:
+                    raise TimeoutError("Generation did not finish in time")
+                time.sleep(self.args.poll_interval)
+                self._run()
+            if self._stage() != "done":
+                raise RuntimeError(f"Generation failed, stage is '{self._stage()}': {self.at.session_state['report_state'].messages[-1]['content'][:200]}")
+            self.generation_seconds = time.perf_counter() - start
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        return self
+
+
+def summarize(users, elapsed, rss_before, rss_after, server, args):
+    turns = [t for u in users for t in u.turn_seconds]
+    waits = [t for u in users for t in u.wait_seconds]
+    generations = [u.generation_seconds for u in users if u.generation_seconds is not None]
+    ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None  # noqa: E731
+    return {
+        "benchmark": "load_test",
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {k: getattr(args, k) for k in ("sessions", "concurrency", "api_latency_ms", "quarters", "project")},
+        "sessions_completed": sum(1 for u in users if u.error is None),
+        "sessions_failed": sum(1 for u in users if u.error is not None),
+        "errors": sorted({u.error for u in users if u.error})[:10],
+        "turns": len(turns),
+        "turn_latency_ms": {"p50": ms(percentile(turns, 50)), "p95": ms(percentile(turns, 95)), "p99": ms(percentile(turns, 99)),
+                            "mean": ms(statistics.mean(turns)) if turns else None},
+        "lock_wait_ms": {"p50": ms(percentile(waits, 50)), "p95": ms(percentile(waits, 95))},
+        "generation_latency_ms": {"p50": ms(percentile(generations, 50)), "p95": ms(percentile(generations, 95)), "p99": ms(percentile(generations, 99))},
+        "rss_mb": {"before": round(rss_before / 2**20, 1), "after": round(rss_after / 2**20, 1),
+                   "per_session": round((rss_after - rss_before) / 2**20 / max(len(users), 1), 2)},
+        "throughput": {"elapsed_s": round(elapsed, 2), "turns_per_s": round(len(turns) / elapsed, 2),
+                       "conversations_per_min": round(len(generations) / elapsed * 60, 2),
+                       "sessions_per_s": round(len(generations) / elapsed, 3)},
+        "google_api_calls": dict(server.calls),
+    }
+
+
+def print_table(result):
+    print(f"sessions: {result['sessions_completed']} completed, {result['sessions_failed']} failed "
+          f"(concurrency {result['config']['concurrency']}, API latency {result['config']['api_latency_ms']}ms)")
+    for error in result["errors"]:
+        print(f"  error: {error}")
+    for name in ("turn_latency_ms", "lock_wait_ms", "generation_latency_ms"):
+        print(f"{name:<24}" + "  ".join(f"{k}={v}" for k, v in result[name].items()))
+    print(f"{'rss_mb':<24}" + "  ".join(f"{k}={v}" for k, v in result["rss_mb"].items()))
+    print(f"{'throughput':<24}" + "  ".join(f"{k}={v}" for k, v in result["throughput"].items()))
+    print(f"{'google_api_calls':<24}" + "  ".join(f"{k}={v}" for k, v in sorted(result["google_api_calls"].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sessions", type=int, default=20, help="Conversations to run in total")
+    parser.add_argument("--concurrency", type=int, default=10, help="Conversations in flight at once")
+    parser.add_argument("--api-latency-ms", type=float, default=50, help="Delay the fake Google server adds to every call")
+    parser.add_argument("--quarters", type=int, default=4)
+    parser.add_argument("--project", default="netflox360", help="Project the sessions report on (see project_registry.py)")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Seconds between reruns while generating")
+    parser.add_argument("--run-timeout", type=float, default=30, help="Timeout for a single script run")
+    parser.add_argument("--generation-timeout", type=float, default=120)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    parser.add_argument("--output", help="Also write the JSON results to this file")
+    args = parser.parse_args()
+
+    # Everything the app persists goes to a throwaway directory; set before the app's modules are imported
+    os.environ.setdefault("GRANTI_DATA_DIR", tempfile.mkdtemp(prefix="granti-load-"))
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from fake_google import FakeGoogleServer
+    import project_registry
+
+    # The harness answers every section of the project's report, then expects to be asked to confirm
+    args.section_count = len(project_registry.get_registry().get(args.project).section_keys)
+
+    server = FakeGoogleServer(latency_ms=args.api_latency_ms).start()
+    os.environ["GRANTI_GOOGLE_API_ROOT"] = server.url
+    pdf = minimal_pdf()
+
+    # Load the app's modules (and Streamlit's) first, so RSS growth is what the sessions themselves hold
+    SimulatedUser(-1, args, pdf)._run()
+    users = [SimulatedUser(i, args, pdf) for i in range(args.sessions)]
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="load-user") as pool:
+        users = list(pool.map(SimulatedUser.converse, users))
+    elapsed = time.perf_counter() - start
+    rss_after = rss_bytes()
+    server.stop()
+
+    result = summarize(users, elapsed, rss_before, rss_after, server, args)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print_table(result)
+    return 0 if result["sessions_failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
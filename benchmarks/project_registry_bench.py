@@ -0,0 +1,78 @@
+"""Load time and memory of the project registry with many projects.
+
+``--projects`` copies of projects/netflox360.toml (with distinct numbers) and
+the shared _defaults.toml are written to a temporary directory and loaded with
+project_registry.py. The run reports the one-off load time, the memory held
+per compiled project, and the memory per session. A session only holds its
+project's ID and looks the shared config up, so the last two stay flat however
+many sessions there are.
+
+    python benchmarks/project_registry_bench.py [--projects 50] [--sessions 1000] [--json]
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import project_registry  # noqa: E402
+
+PROJECT_FILE = """[project]
+lead_company = "Benchmark Company {n} Ltd"
+title = "Benchmark project {n}"
+short_name = "Bench{n}"
+number = "{number}"
+total_quarters = 8
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix="granti-projects-")
+    try:
+        shutil.copy(os.path.join(ROOT, "projects", project_registry.DEFAULTS_FILE), directory)
+        for n in range(args.projects):
+            with open(os.path.join(directory, f"bench{n}.toml"), "w", encoding="utf-8") as f:
+                f.write(PROJECT_FILE.format(n=n, number=20000000 + n))
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        registry = project_registry.ProjectRegistry(directory)
+        load_ms = (time.perf_counter() - start) * 1000
+        registry_bytes = tracemalloc.get_traced_memory()[0]
+        # What app.py keeps per session: the project ID, resolved to the shared config on use
+        sessions = [{"project_id": registry.ids()[i % args.projects]} for i in range(args.sessions)]
+        configs = {id(registry.get(s["project_id"])) for s in sessions}
+        session_bytes = tracemalloc.get_traced_memory()[0] - registry_bytes
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = {
+        "projects": args.projects,
+        "sessions": args.sessions,
+        "load_ms": round(load_ms, 2),
+        "bytes_per_project": registry_bytes // args.projects,
+        "bytes_per_session": session_bytes // args.sessions,
+        "distinct_configs": len(configs),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for key, value in results.items():
+        print(f"{key:<18} {value}")
+
+
+if __name__ == "__main__":
+    main()
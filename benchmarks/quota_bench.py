@@ -0,0 +1,129 @@
+"""Google API quota under sustained load from many users.
+
+Reports are published concurrently for several users against the fake Google
+server in fake_google.py. The server enforces the same quotas the limiter in
+quota.py budgets for. Every ``--bulk-every``-th report runs at
+``quota.BULK`` priority, like the "generate all" job; the rest are interactive.
+Quota windows are compressed to ``--window`` seconds and budgets scaled by
+``--scale``, so a short run is bound by quota rather than by the fake server.
+
+The run reports:
+- 429s the fake server sent (zero with the limiter on)
+- time spent waiting for quota, per priority (the ``quota.wait.*`` spans)
+- report latency per priority
+- throughput
+
+Run it with ``--no-limiter`` to see the 429s the limiter prevents.
+
+    python benchmarks/quota_bench.py --users 6 --reports 60 --window 5 --scale 0.05 [--no-limiter] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCOPES = ['https://www.googleapis.com/auth/documents', 'https://www.googleapis.com/auth/drive.file']
+PROJECT_DETAILS = {"Project title": "Quota benchmark", "Project Number": "10000000"}
+SECTION_KEYS = ["quarter_end_date", "overall_summary", "progress", "risks"]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=6)
+    parser.add_argument("--reports", type=int, default=60, help="Reports to publish in total")
+    parser.add_argument("--concurrency", type=int, default=16, help="Reports in flight at once")
+    parser.add_argument("--bulk-every", type=int, default=3, help="Every Nth report runs at bulk priority")
+    parser.add_argument("--window", type=float, default=5.0, help="Quota window in seconds (Google's is 60)")
+    parser.add_argument("--scale", type=float, default=0.05, help="Fraction of Google's default quotas to enforce")
+    parser.add_argument("--api-latency-ms", type=float, default=20)
+    parser.add_argument("--no-limiter", action="store_true", help="Turn the app's quota limiter off")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    # Read by the app's modules when they are imported
+    os.environ.setdefault("GRANTI_DATA_DIR", tempfile.mkdtemp(prefix="granti-quota-"))
+    os.environ["GRANTI_QUOTA_WINDOW_SECONDS"] = str(args.window)
+    os.environ["GRANTI_QUOTA_SCALE"] = str(args.scale)
+    os.environ["GRANTI_QUOTA"] = "0" if args.no_limiter else "1"
+    sys.path.insert(0, ROOT)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from fake_google import FakeGoogleServer
+    import quota
+
+    server = FakeGoogleServer(latency_ms=args.api_latency_ms, quotas=quota.scaled_budgets(), quota_window=args.window).start()
+    os.environ["GRANTI_GOOGLE_API_ROOT"] = server.url
+    from google.oauth2.credentials import Credentials
+    import instrumentation
+    import report_docs
+    import report_model
+
+    users = [Credentials(token=f"quota-bench-user-{i}", scopes=SCOPES) for i in range(args.users)]
+    answers = {key: f"Answer for {key}." for key in SECTION_KEYS}
+
+    def publish(number):
+        level = quota.BULK if args.bulk_every and number % args.bulk_every == 0 else quota.INTERACTIVE
+        model = report_model.build_report_model(PROJECT_DETAILS, SECTION_KEYS, number % 4 + 1, answers, {})
+        start = time.perf_counter()
+        try:
+            with quota.priority(level):
+                report_docs.publish_report(users[number % len(users)], f"Report {number}", model, f"quota-bench-{number}", number % 4 + 1)
+            error = None
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        return quota.PRIORITY_NAMES[level], time.perf_counter() - start, error
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="quota-bench") as pool:
+        outcomes = list(pool.map(publish, range(args.reports)))
+    elapsed = time.perf_counter() - start
+    server.stop()
+
+    spans = instrumentation.span_stats()
+    result = {
+        "benchmark": "quota_bench",
+        "config": {k: getattr(args, k) for k in ("users", "reports", "concurrency", "bulk_every", "window", "scale", "no_limiter")},
+        "budgets": quota.scaled_budgets(),
+        "http_429": sum(count for kind, count in server.calls.items() if kind.startswith("429 ")),
+        "reports_failed": sum(1 for _, _, error in outcomes if error),
+        "errors": sorted({error for _, _, error in outcomes if error})[:5],
+        "elapsed_s": round(elapsed, 2),
+        "reports_per_s": round(args.reports / elapsed, 2),
+        "google_api_calls": dict(server.calls),
+    }
+    for name in quota.PRIORITY_NAMES.values():
+        latencies = [seconds for level, seconds, error in outcomes if level == name and not error]
+        waits = spans.get(f"quota.wait.{name}", {"count": 0, "total_seconds": 0.0})
+        result[name] = {
+            "reports": len(latencies),
+            "latency_ms": {"p50": round(percentile(latencies, 50) * 1000, 1) if latencies else None,
+                           "p95": round(percentile(latencies, 95) * 1000, 1) if latencies else None},
+            "quota_waits": waits["count"],
+            "quota_wait_s": round(waits["total_seconds"], 2),
+        }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print(f"limiter {'off' if args.no_limiter else 'on'}: {result['http_429']} HTTP 429s, {result['reports_failed']} reports failed, "
+              f"{args.reports} reports in {result['elapsed_s']}s ({result['reports_per_s']}/s)")
+        for error in result["errors"]:
+            print(f"  error: {error}")
+        for name in quota.PRIORITY_NAMES.values():
+            r = result[name]
+            print(f"  {name:<12} reports={r['reports']}  p50={r['latency_ms']['p50']}ms  p95={r['latency_ms']['p95']}ms  "
+                  f"waited {r['quota_wait_s']}s over {r['quota_waits']} calls")
+    return 0 if result["http_429"] == 0 or args.no_limiter else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""Time to render long reports into Docs batchUpdate requests.
+
+A report whose sections hold ``--answer-mb`` megabytes of answers in total is
+rendered with ``docs_renderer.render_requests``. Sizes default to either side
+of the 4 MB per-request chunking boundary (``MAX_REQUEST_BYTES``). Answers
+mix ASCII with accented letters and emoji, so the UTF-16 index arithmetic is
+exercised too. The run reports render time, the number of chunks and the
+largest chunk's serialized size, which must stay under the boundary.
+
+    python benchmarks/render_bench.py [--answer-mb 0.5 3.5 4.5 12] [--runs 5] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import docs_renderer  # noqa: E402
+import report_model  # noqa: E402
+
+PROJECT_DETAILS = {"Project title": "Render benchmark", "Project Number": "10000000"}
+SECTION_KEYS = ["quarter_end_date", "overall_summary", "progress", "issues_actions", "scope", "time", "cost",
+                "exploitation", "risk_management", "project_planning", "next_quarter_forecast"]  # Mirrors the sections in projects/_defaults.toml
+SENTENCE = "Trial farms onboarded in Pérez and Åsa's regions 🐔, costs within 5%.\n"
+
+
+def make_model(answer_mb):
+    sections = [key for key in SECTION_KEYS if key != "quarter_end_date"]
+    answer_bytes = int(answer_mb * 1024 * 1024 / len(sections))
+    sentence_bytes = len(SENTENCE.encode('utf-8'))
+    answers = {key: SENTENCE * max(1, answer_bytes // sentence_bytes) for key in sections}
+    answers["quarter_end_date"] = "30/06/2025"
+    return report_model.build_report_model(PROJECT_DETAILS, SECTION_KEYS, 2, answers, {})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--answer-mb", type=float, nargs="+", default=[0.5, 3.5, 4.5, 12], help="Total answer sizes to render")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    results = []
+    for answer_mb in args.answer_mb:
+        segments = docs_renderer.report_segments(make_model(answer_mb))
+        samples = []
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            chunks = docs_renderer.render_requests(segments)
+            samples.append((time.perf_counter() - start) * 1000)
+        chunk_bytes = [docs_renderer.payload_bytes(requests) for requests in chunks]
+        results.append({
+            "answer_mb": answer_mb,
+            "segments": len(segments),
+            "render_ms": round(statistics.median(samples), 1),
+            "chunks": len(chunks),
+            "max_chunk_bytes": max(chunk_bytes),
+            "payload_mb": round(sum(chunk_bytes) / 1024 / 1024, 2),
+            "within_limit": max(chunk_bytes) <= docs_renderer.MAX_REQUEST_BYTES,
+        })
+    if args.json:
+        print(json.dumps({"max_request_bytes": docs_renderer.MAX_REQUEST_BYTES, "reports": results}, indent=2))
+        return 0 if all(r["within_limit"] for r in results) else 1
+    for r in results:
+        print(f"{r['answer_mb']:>6} MB  {r['segments']:>6} segments  render {r['render_ms']:>8} ms  {r['chunks']:>2} chunk(s)  "
+              f"largest {r['max_chunk_bytes']:>9} bytes{'' if r['within_limit'] else '  OVER LIMIT'}")
+    return 0 if all(r["within_limit"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""Index build time, query latency and memory of the per-session BM25 index.
+
+For each ``--pages`` corpus size, synthetic documents (``--pages-per-doc``
+pages of ~400 words each, drawn from a Zipf-like vocabulary) are written to
+the extracted-text cache of a throwaway data directory and indexed with
+retrieval.py. Build time is reported cold (passages analysed and indexed) and
+warm (analysis cached, as when another session indexes the same upload).
+Queries are the project's section queries plus free-text chat questions, timed
+with ``SessionIndex.search``. Memory is measured with tracemalloc: the shared
+analysed-passage cache separately from what each session's index holds. The
+latter is also scaled to a full index LRU: ``MAX_SESSION_INDEXES`` sessions,
+or fewer when ``MAX_INDEXED_PASSAGES`` is reached first.
+
+    python benchmarks/retrieval_bench.py [--pages 10 100 1000] [--queries 200] [--json]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+DATA_DIR = tempfile.mkdtemp(prefix="granti-retrieval-")
+os.environ["GRANTI_DATA_DIR"] = DATA_DIR  # Read by text_extract when it is imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import project_registry  # noqa: E402
+import retrieval  # noqa: E402
+import text_extract  # noqa: E402
+
+WORDS_PER_PAGE = 400
+VOCABULARY = 20000
+CHAT_QUESTIONS = [
+    "How many farms were onboarded in the trial?",
+    "What were the main risks to the factory integration?",
+    "Summarise the cost variance against the grant budget",
+    "Which work packages slipped and why?",
+    "What exploitation activities are planned with poultry processors?",
+]
+
+
+def write_document(rng, words, weights, pages):
+    """Writes one document's pages to the extracted-text cache and returns its digest."""
+    text = text_extract.PAGE_SEPARATOR.join(" ".join(rng.choices(words, weights, k=WORDS_PER_PAGE)) for _ in range(pages))
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    with open(os.path.join(text_extract.CACHE_DIR, f"{digest}.txt"), "w", encoding='utf-8') as f:
+        f.write(text)
+    return digest
+
+
+def build(section_queries, digests):
+    index = retrieval.SessionIndex(section_queries)
+    start = time.perf_counter()
+    for n, digest in enumerate(digests):
+        index.add_source(digest, f"document-{n}.pdf")
+    return index, (time.perf_counter() - start) * 1000
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def run(pages, pages_per_doc, query_count, section_queries, words, weights):
+    rng = random.Random(pages)
+    digests = [write_document(rng, words, weights, min(pages_per_doc, pages - done)) for done in range(0, pages, pages_per_doc)]
+    retrieval._analyzed.clear()
+
+    tracemalloc.start()
+    cold_index, cold_ms = build(section_queries, digests)
+    analyzed_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del cold_index
+    # Measure the index alone, with the passages already analysed
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    index, warm_ms = build(section_queries, digests)
+    session_bytes = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    full_lru_sessions = min(retrieval.MAX_SESSION_INDEXES, max(1, retrieval.MAX_INDEXED_PASSAGES // max(len(index._passages), 1)))
+    queries = list(section_queries.values()) + CHAT_QUESTIONS
+    samples = []
+    for i in range(query_count):
+        start = time.perf_counter()
+        index.search(queries[i % len(queries)])
+        samples.append((time.perf_counter() - start) * 1000)
+    return {
+        "pages": pages,
+        "documents": len(digests),
+        "passages": len(index._passages),
+        "build_cold_ms": round(cold_ms, 1),
+        "build_warm_ms": round(warm_ms, 1),
+        "query_p50_ms": round(statistics.median(samples), 3),
+        "query_p95_ms": round(percentile(samples, 0.95), 3),
+        "analyzed_cache_mb": round((analyzed_bytes - session_bytes) / 1024 / 1024, 2),
+        "session_index_mb": round(session_bytes / 1024 / 1024, 2),
+        "full_lru_sessions": full_lru_sessions,
+        "full_lru_mb": round(session_bytes * full_lru_sessions / 1024 / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000], help="Corpus sizes, in pages per session")
+    parser.add_argument("--pages-per-doc", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--project", default="netflox360", help="Project whose section queries are used")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    section_queries = dict(project_registry.get_registry().get(args.project).section_queries)
+    # Query words rank just below the most common filler words, so searches walk realistic posting lists
+    query_words = sorted({token for query in list(section_queries.values()) + CHAT_QUESTIONS for token in retrieval.tokenize(query)})
+    fillers = [f"term{n}" for n in range(VOCABULARY - len(query_words))]
+    words = fillers[:50] + query_words + fillers[50:]
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+
+    os.makedirs(text_extract.CACHE_DIR, exist_ok=True)
+    try:
+        results = [run(pages, args.pages_per_doc, args.queries, section_queries, words, weights) for pages in args.pages]
+    finally:
+        shutil.rmtree(DATA_DIR, ignore_errors=True)
+    if args.json:
+        print(json.dumps({"max_session_indexes": retrieval.MAX_SESSION_INDEXES, "max_indexed_passages": retrieval.MAX_INDEXED_PASSAGES,
+                          "corpora": results}, indent=2))
+        return
+    for r in results:
+        print(f"{r['pages']:>5} pages  {r['passages']:>6} passages  build {r['build_cold_ms']:>8} ms cold / {r['build_warm_ms']:>8} ms warm  "
+              f"query p50 {r['query_p50_ms']:>7} ms  p95 {r['query_p95_ms']:>7} ms  "
+              f"index {r['session_index_mb']:>6} MB/session ({r['full_lru_mb']} MB for a full LRU of {r['full_lru_sessions']})")
+
+
+if __name__ == "__main__":
+    main()
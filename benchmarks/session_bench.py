@@ -0,0 +1,110 @@
+"""Throughput of the headless report conversation engine (report_session.py).
+
+Drives complete simulated conversations (pick a quarter, upload the grant
+application, answer every section, confirm, finish the job) against in-memory
+backends and reports conversations per second and the per-turn cost of the
+logic alone, without Streamlit or Google.
+
+    python benchmarks/session_bench.py [--conversations 2000] [--sqlite] [--json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import answer_store  # noqa: E402
+import generation_jobs  # noqa: E402
+import report_session  # noqa: E402
+
+PROJECT_DETAILS = {"Project title": "Benchmark project", "Project Number": "0000", "Total Quarters": 4}
+SECTION_KEYS = ["quarter_end_date", "overall_summary", "progress", "issues_actions", "scope", "time",
+                "cost", "exploitation", "risk_management", "project_planning", "next_quarter_forecast"]
+PROMPTS = dict({key: f"Tell me about {key}." for key in SECTION_KEYS}, **{
+    "start": "Which quarter (1-{0})?", "request_grant_app": "Q{0}: upload your grant application.",
+    "grant_app_received": "Thanks! End date for Q{0}?", "upload_request": "Upload evidence in the sidebar.",
+    "ready_to_generate": "Ready to generate Q{0}?", "update_available": "Update '{0}' instead?",
+    "update_complete": "'{0}' updated ({1}).", "generation_complete": "Done: '{0}'.", "error": "Oh dear.",
+})
+
+
+class DictAnswers:
+    def __init__(self):
+        self.answers = {}
+
+    def save_answer(self, project_number, quarter, section, answer):
+        self.answers[(project_number, quarter, section)] = answer
+
+    def get_answer(self, project_number, quarter, section):
+        return self.answers.get((project_number, quarter, section))
+
+
+class FakeDocuments(report_session.NoDocuments):
+    """Queues nothing; jobs finish as soon as the conversation asks about them."""
+    last_job = None
+
+    def authenticated(self):
+        return True
+
+    def generate(self, quarter):
+        job = generation_jobs.GenerationJob("bench", quarter, None, (), {})
+        job.status = generation_jobs.DONE
+        job.result = {"doc_id": job.job_id, "title": f"Q{quarter} report", "url": "https://example.invalid"}
+        self.last_job = job
+        return job
+
+
+def run_conversation(answers, documents, quarter):
+    state = report_session.SessionState()
+    session = report_session.ReportSession(state, PROJECT_DETAILS, SECTION_KEYS, PROMPTS, answers, documents)
+    turns = [lambda: session.send(str(quarter)),
+             lambda: session.dispatch(report_session.GRANT_APP_UPLOADED, {"name": "app.pdf", "size": 1, "type": "application/pdf", "sha256": None})]
+    turns += [lambda key=key: session.send(f"Answer for {key} in Q{quarter}. " * 10) for key in SECTION_KEYS]
+    turns += [lambda: session.send("yes"), lambda: session.dispatch(report_session.JOB_FINISHED, documents.last_job)]
+    timings = []
+    for turn in turns:
+        start = time.perf_counter()
+        turn()
+        timings.append(time.perf_counter() - start)
+    assert state.stage == report_session.DONE, state.stage
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--sqlite", action="store_true", help="Use an in-memory SQLite answer store instead of a dict")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    answers = answer_store.SQLiteAnswerStore(":memory:") if args.sqlite else DictAnswers()
+    documents = FakeDocuments()
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()):  # The engine's DEBUG prints would dominate
+        start = time.perf_counter()
+        for i in range(args.conversations):
+            timings.extend(run_conversation(answers, documents, i % 4 + 1))
+        elapsed = time.perf_counter() - start
+    timings.sort()
+    result = {
+        "conversations": args.conversations,
+        "turns": len(timings),
+        "conversations_per_second": round(args.conversations / elapsed, 1),
+        "turn_p50_us": round(statistics.median(timings) * 1e6, 2),
+        "turn_p99_us": round(timings[int(len(timings) * 0.99) - 1] * 1e6, 2),
+        "answer_store": "sqlite" if args.sqlite else "dict",
+    }
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        for key, value in result.items():
+            print(f"{key:<26}{value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Cold-start import cost of app.py, measured with ``python -X importtime``.
+
+Each scenario imports a set of modules in a fresh interpreter:
+- ``baseline``: nothing (interpreter startup only)
+- ``app``: the modules app.py imports at the top level (read from its source)
+- ``google``: the Google client stack the app now only imports on first
+  authentication or generation (report_docs pulls in google_services,
+  googleapiclient and google_auth_httplib2)
+- ``eager``: both of the above, i.e. what every cold start used to pay
+
+For each scenario the script reports the total import time, the wall time of
+the interpreter and the slowest top-level imports. Modules that are not
+installed are reported and skipped.
+
+    python benchmarks/startup_bench.py [--runs 5] [--top 10] [--json]
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GOOGLE_MODULES = ["google_auth_oauthlib.flow", "report_docs"]
+
+
+def app_imports():
+    """Top-level ``import``/``from ... import`` module names in app.py, in order."""
+    with open(os.path.join(ROOT, "app.py"), encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    return list(dict.fromkeys(names))
+
+
+def importable(modules):
+    """Splits ``modules`` into those that import cleanly here and those that don't (missing dependencies)."""
+    missing = [m for m in modules if subprocess.run([sys.executable, "-c", f"import {m}"], cwd=ROOT, capture_output=True).returncode]
+    return [m for m in modules if m not in missing], missing
+
+
+def measure(modules, top):
+    """One fresh interpreter: returns (wall_ms, import_ms, slowest top-level imports)."""
+    env = dict(os.environ, GRANTI_DATA_DIR=os.environ.get("GRANTI_DATA_DIR", os.path.join(ROOT, "granti_data")))
+    code = "; ".join(f"import {m}" for m in modules) or "pass"
+    start = time.perf_counter()
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if proc.returncode:
+        raise RuntimeError(f"Importing {modules} failed:\n{proc.stderr[-2000:]}")
+    top_level = []
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"; nested imports are indented further
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):
+            top_level.append((int(cumulative_us), name.strip()))
+    import_ms = sum(us for us, _ in top_level) / 1000
+    slowest = sorted(top_level, reverse=True)[:top]
+    return wall_ms, import_ms, [{"module": name, "ms": round(us / 1000, 2)} for us, name in slowest]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per scenario (the median is reported)")
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest imports to list")
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+
+    app_modules = app_imports()
+    scenarios = {"baseline": [], "app": app_modules, "google": GOOGLE_MODULES, "eager": app_modules + GOOGLE_MODULES}
+    results = {"python": sys.version.split()[0], "scenarios": {}}
+    for name, modules in scenarios.items():
+        available, missing = importable(modules)
+        runs = [measure(available, args.top) for _ in range(args.runs)]
+        results["scenarios"][name] = {
+            "modules": available,
+            "missing": missing,
+            "wall_ms": round(statistics.median(r[0] for r in runs), 1),
+            "import_ms": round(statistics.median(r[1] for r in runs), 1),
+            "slowest": runs[len(runs) // 2][2],
+        }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name, result in results["scenarios"].items():
+        print(f"{name}: {result['import_ms']} ms importing, {result['wall_ms']} ms interpreter wall time")
+        if result["missing"]:
+            print(f"  not installed (skipped): {', '.join(result['missing'])}")
+        for entry in result["slowest"]:
+            print(f"  {entry['ms']:>9.2f} ms  {entry['module']}")
+
+
+if __name__ == "__main__":
+    main()
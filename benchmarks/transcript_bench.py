@@ -0,0 +1,98 @@
+"""Per-turn cost of drawing the chat transcript at different transcript lengths.
+
+Compares the old approach (every message drawn as a chat bubble on every
+turn) with the windowed transcript (see transcript.py), with and without an
+older page opened. Streamlit is replaced by a recorder that counts the
+elements a run would send to the browser. The per-element cost of the real
+frontend is not measured; it scales with the element counts reported here.
+
+    python benchmarks/transcript_bench.py [--sizes 50,500,5000] [--turns 200] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import transcript  # noqa: E402
+
+
+class Recorder:
+    """Stands in for the Streamlit calls the transcript makes; counts elements and bytes sent."""
+    def __init__(self):
+        self.elements = 0
+        self.bytes = 0
+
+    def chat_message(self, role, content):
+        self.elements += 2  # Bubble container plus its markdown
+        self.bytes += len(content)
+
+    def markdown(self, text):
+        self.elements += 1
+        self.bytes += len(text)
+
+
+def make_messages(count):
+    answer = "We completed the work package on schedule and started recruiting for the pilot. " * 4
+    return [{"role": "user" if i % 2 else "assistant", "content": f"{i}: {answer}"} for i in range(count)]
+
+
+def draw_all(messages, out, open_page):
+    for message in messages:
+        out.chat_message(message["role"], message["content"])
+
+
+def draw_windowed(messages, out, open_page):
+    pages, window_start = transcript.split_window(len(messages))
+    if pages:
+        out.elements += 1  # Page picker
+        if open_page:
+            out.markdown(transcript.page_markdown(messages, pages[0]))
+    for message in messages[window_start:]:
+        out.chat_message(message["role"], message["content"])
+
+
+def measure(draw, size, turns, open_page=False):
+    messages = make_messages(size)
+    timings = []
+    out = Recorder()
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"turn {turn}"})
+        out = Recorder()
+        start = time.perf_counter()
+        draw(messages, out, open_page)
+        timings.append((time.perf_counter() - start) * 1000)
+        messages.pop()
+    timings.sort()
+    return {
+        "messages": size,
+        "p50_ms": round(statistics.median(timings), 4),
+        "p95_ms": round(timings[int(len(timings) * 0.95) - 1], 4),
+        "elements_per_turn": out.elements,
+        "bytes_per_turn": out.bytes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="50,500,5000")
+    parser.add_argument("--turns", type=int, default=200)
+    parser.add_argument("--json", action="store_true", help="Print machine-readable results")
+    args = parser.parse_args()
+    results = []
+    for size in (int(s) for s in args.sizes.split(",")):
+        for name, draw, open_page in (("all", draw_all, False), ("windowed", draw_windowed, False), ("windowed+page", draw_windowed, True)):
+            results.append(dict(mode=name, **measure(draw, size, args.turns, open_page)))
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'mode':<15}{'messages':>10}{'p50 ms':>10}{'p95 ms':>10}{'elements':>10}{'KB sent':>10}")
+    for r in results:
+        print(f"{r['mode']:<15}{r['messages']:>10}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['elements_per_turn']:>10}{r['bytes_per_turn'] / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Content-addressed on-disk spool for uploaded files.
+
+Uploads are streamed once into ``granti_data/blobs/<aa>/<sha256>``; identical
+files uploaded by different sessions share one blob. Reads go through
+read-only memory maps (or the blob's path), so sessions only keep the digest.
+The whole spool is held under ``BUDGET_BYTES`` by evicting the least recently
+used blobs.
+"""
+import hashlib
+import io
+import mmap
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import instrumentation
+
+DATA_DIR = os.environ.get("GRANTI_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "granti_data"))
+BLOB_DIR = os.path.join(DATA_DIR, "blobs")
+BUDGET_BYTES = int(os.environ.get("GRANTI_BLOB_BUDGET_MB", "2048")) * 1024 * 1024
+COPY_CHUNK_BYTES = 1024 * 1024
+TOUCH_INTERVAL_SECONDS = 60  # Don't rewrite mtimes (used as LRU order across restarts) on every read
+
+logger = instrumentation.get_logger("blob_store")
+
+
+class BlobStore:
+    def __init__(self, root=BLOB_DIR, budget_bytes=BUDGET_BYTES):
+        self.root = root
+        self.budget_bytes = budget_bytes
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()  # digest -> (size, last_touched)
+        self._total_bytes = 0
+        os.makedirs(os.path.join(root, "tmp"), exist_ok=True)
+        self._load()
+
+    def _load(self):
+        blobs = []
+        for shard in os.listdir(self.root):
+            shard_dir = os.path.join(self.root, shard)
+            if shard == "tmp" or not os.path.isdir(shard_dir):
+                continue
+            for digest in os.listdir(shard_dir):
+                stat = os.stat(os.path.join(shard_dir, digest))
+                blobs.append((stat.st_mtime, digest, stat.st_size))
+        for mtime, digest, size in sorted(blobs):
+            self._lru[digest] = (size, mtime)
+            self._total_bytes += size
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def put(self, fileobj):
+        """Streams ``fileobj`` into the store and returns its SHA-256 digest."""
+        hasher = hashlib.sha256()
+        size = 0
+        tmp_path = os.path.join(self.root, "tmp", f"{os.getpid()}.{threading.get_ident()}.part")
+        if hasattr(fileobj, 'seek'):
+            fileobj.seek(0)
+        with open(tmp_path, 'wb') as out:
+            while chunk := fileobj.read(COPY_CHUNK_BYTES):
+                hasher.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        digest = hasher.hexdigest()
+        path = self.path(digest)
+        with self._lock:
+            if digest in self._lru:
+                os.remove(tmp_path)  # Already stored (deduplicated)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                self._lru[digest] = (size, 0)
+                self._total_bytes += size
+            self._touch_locked(digest)
+            self._evict_locked(keep=digest)
+        return digest
+
+    def put_bytes(self, data):
+        return self.put(io.BytesIO(data))
+
+    def exists(self, digest):
+        with self._lock:
+            return bool(digest) and digest in self._lru
+
+    def _touch_locked(self, digest):
+        size, last_touched = self._lru[digest]
+        self._lru.move_to_end(digest)
+        now = time.time()
+        if now - last_touched > TOUCH_INTERVAL_SECONDS:
+            try:
+                os.utime(self.path(digest))
+            except OSError:
+                pass
+            self._lru[digest] = (size, now)
+
+    def _evict_locked(self, keep=None):
+        for digest in list(self._lru):
+            if self._total_bytes <= self.budget_bytes:
+                break
+            if digest == keep:
+                continue
+            size, _ = self._lru.pop(digest)
+            self._total_bytes -= size
+            try:
+                os.remove(self.path(digest))
+            except OSError as e:
+                logger.warn("Could not evict blob", digest=digest[:12], error=e)
+            logger.debug("Evicted blob to stay within the spool budget", digest=digest[:12], bytes=size)
+
+    def touch(self, digest):
+        """Marks a blob as recently used; returns its path, or None if it has been evicted."""
+        with self._lock:
+            if digest not in self._lru:
+                return None
+            self._touch_locked(digest)
+        return self.path(digest)
+
+    @contextmanager
+    def open_view(self, digest):
+        """Yields a read-only memory map of a blob. Raises FileNotFoundError if it has been evicted."""
+        path = self.touch(digest)
+        if path is None:
+            raise FileNotFoundError(f"Blob {digest} is not in the store (evicted?)")
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield memoryview(b"")
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                yield view
+
+    @property
+    def total_bytes(self):
+        return self._total_bytes
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the process-wide blob store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore()
+    return _store
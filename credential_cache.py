@@ -0,0 +1,267 @@
+"""Google OAuth credentials that outlive a session.
+
+After a login the refresh token is stored encrypted under
+``granti_data/credentials/``. The file is keyed by a random per-user key that
+lives in a browser cookie (``COOKIE_NAME``), so opening the app again in the
+same browser signs the user straight in with no consent round trip. Each file
+is encrypted (Fernet) with a key derived from both the server secret and the
+user key, so the files on disk cannot be decrypted without the user's cookie.
+The server secret comes from ``GRANTI_CREDENTIAL_KEY``, or from a key file
+generated on first use.
+
+The user key is a bearer credential: whoever has it can publish to the user's
+Google Drive. It must never be put in a URL. Older links carried it as
+``?uid=``. app.py still accepts such a link once, moves the key into the
+cookie, strips it from the address bar and warns that the old link must not
+be shared.
+
+``CredentialManager`` keeps the credentials it hands out fresh: a background
+thread refreshes them shortly before they expire, and concurrent refreshes of
+the same user's credentials share one token request. Users idle for longer
+than ``IDLE_FORGET_SECONDS`` are no longer refreshed, but their encrypted file
+stays on disk.
+"""
+import base64
+import datetime
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+import instrumentation
+
+DATA_DIR = os.environ.get("GRANTI_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "granti_data"))
+CREDENTIALS_DIR = os.path.join(DATA_DIR, "credentials")
+KEY_FILE = os.path.join(CREDENTIALS_DIR, "server.key")
+REFRESH_MARGIN_SECONDS = 5 * 60  # Refresh tokens this long before they expire
+REFRESH_CHECK_SECONDS = 60
+IDLE_FORGET_SECONDS = 60 * 60
+COOKIE_NAME = "granti_uid"
+COOKIE_MAX_AGE_SECONDS = 90 * 24 * 60 * 60
+
+logger = instrumentation.get_logger("credential_cache")
+
+_USER_KEY_RE = re.compile(r"^[0-9a-f]{32}$")
+
+
+def new_user_key():
+    return secrets.token_hex(16)
+
+
+def valid_user_key(user_key):
+    return isinstance(user_key, str) and bool(_USER_KEY_RE.match(user_key))
+
+
+def _server_secret():
+    secret = os.environ.get("GRANTI_CREDENTIAL_KEY")
+    if secret:
+        return secret.encode('utf-8')
+    os.makedirs(CREDENTIALS_DIR, exist_ok=True)
+    try:
+        fd = os.open(KEY_FILE, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(KEY_FILE, 'rb') as f:
+            return f.read()
+    secret = base64.urlsafe_b64encode(secrets.token_bytes(32))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    logger.info("Generated credential cache key (set GRANTI_CREDENTIAL_KEY to manage it yourself)", path=KEY_FILE)
+    return secret
+
+
+def _fernet(server_secret, user_key):
+    from cryptography.fernet import Fernet
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+
+    key = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"granti-credentials:" + user_key.encode('ascii')).derive(server_secret)
+    return Fernet(base64.urlsafe_b64encode(key))
+
+
+def _path(user_key):
+    # The user key itself never touches the disk
+    return os.path.join(CREDENTIALS_DIR, hashlib.sha256(user_key.encode('ascii')).hexdigest()[:40] + ".cred")
+
+
+def needs_refresh(credentials, margin_seconds=REFRESH_MARGIN_SECONDS):
+    if not credentials.token:
+        return True
+    if credentials.expiry is None:
+        return False
+    # google-auth keeps expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return (credentials.expiry - now).total_seconds() < margin_seconds
+
+
+class _Entry:
+    __slots__ = ("credentials", "lock", "last_used")
+
+    def __init__(self, credentials):
+        self.credentials = credentials
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+
+class CredentialManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}  # user key -> _Entry
+        self._server_secret = None
+        self._thread = threading.Thread(target=self._refresh_loop, name="credential-refresh", daemon=True)
+        self._thread.start()
+
+    def _secret(self):
+        if self._server_secret is None:
+            self._server_secret = _server_secret()
+        return self._server_secret
+
+    def _track(self, user_key, credentials):
+        with self._lock:
+            entry = self._entries.get(user_key)
+            if entry is None or entry.credentials is not credentials:
+                entry = self._entries[user_key] = _Entry(credentials)
+            entry.last_used = time.time()
+            return entry
+
+    # --- Disk ---
+    def save(self, user_key, credentials):
+        """Stores ``credentials``' refresh token for ``user_key`` and keeps them fresh from now on."""
+        self._track(user_key, credentials)
+        if not credentials.refresh_token:
+            logger.warn("Credentials have no refresh token; not caching them")
+            return False
+        payload = json.dumps({"refresh_token": credentials.refresh_token, "scopes": list(credentials.scopes or []),
+                              "client_id": credentials.client_id, "saved_at": time.time()}).encode('utf-8')
+        try:
+            token = _fernet(self._secret(), user_key).encrypt(payload)
+        except ImportError:
+            logger.warn("cryptography is not installed; credentials will not be cached")
+            return False
+        path = _path(user_key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        os.makedirs(CREDENTIALS_DIR, exist_ok=True)
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(token)
+        os.replace(tmp_path, path)
+        logger.debug("Cached credentials", file=os.path.basename(path))
+        return True
+
+    def load(self, user_key, client_config, scopes):
+        """Returns fresh credentials for ``user_key`` from memory or the encrypted cache, or None.
+
+        ``client_config`` is the OAuth client config (``{"web": {...}}``). A
+        cached token that Google rejects, or that can't be decrypted, is
+        deleted. Other refresh errors are raised.
+        """
+        with self._lock:
+            entry = self._entries.get(user_key)
+        if entry is not None:
+            return self._fresh_or_forget(user_key)
+        path = _path(user_key)
+        if not os.path.exists(path):
+            return None
+        try:
+            from cryptography.fernet import InvalidToken
+            with open(path, 'rb') as f:
+                payload = json.loads(_fernet(self._secret(), user_key).decrypt(f.read()))
+        except ImportError:
+            logger.warn("cryptography is not installed; cached credentials cannot be read")
+            return None
+        except (InvalidToken, ValueError) as e:
+            logger.warn("Discarding unreadable cached credentials", error=type(e).__name__)
+            self._remove(path)
+            return None
+        web = client_config["web"]
+        if payload.get("client_id") != web["client_id"] or not set(scopes) <= set(payload.get("scopes", [])):
+            logger.info("Cached credentials are for another OAuth client or lack scopes; discarding")
+            self._remove(path)
+            return None
+        from google.oauth2.credentials import Credentials
+        credentials = Credentials(token=None, refresh_token=payload["refresh_token"], token_uri=web["token_uri"],
+                                  client_id=web["client_id"], client_secret=web["client_secret"], scopes=payload["scopes"])
+        self._track(user_key, credentials)
+        return self._fresh_or_forget(user_key)
+
+    def forget(self, user_key):
+        """Logout: stops refreshing the user's credentials and deletes their cache file."""
+        with self._lock:
+            self._entries.pop(user_key, None)
+        self._remove(_path(user_key))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    # --- Refresh ---
+    def _fresh_or_forget(self, user_key):
+        """``fresh``, except that credentials Google rejects are forgotten (and None returned)."""
+        from google.auth.exceptions import RefreshError
+        try:
+            return self.fresh(user_key)
+        except RefreshError as e:
+            # Revoked or expired refresh token; a network error leaves the cache alone
+            logger.warn("Cached credentials were rejected; discarding", error=e)
+            self.forget(user_key)
+            return None
+
+    def fresh(self, user_key):
+        """Returns the user's credentials, refreshing them first if they are about to expire.
+
+        Concurrent callers for the same user share a single refresh. Raises
+        whatever the refresh raises (e.g. ``google.auth.exceptions.RefreshError``).
+        """
+        with self._lock:
+            entry = self._entries.get(user_key)
+        if entry is None:
+            return None
+        entry.last_used = time.time()
+        credentials = entry.credentials
+        if not needs_refresh(credentials):
+            return credentials
+        with entry.lock:
+            if needs_refresh(credentials):  # Unless another caller refreshed them while we waited
+                from google.auth.transport.requests import Request
+                refresh_token = credentials.refresh_token
+                with instrumentation.span("oauth.refresh"):
+                    credentials.refresh(Request())
+                logger.debug("Refreshed credentials", expiry=credentials.expiry)
+                if credentials.refresh_token != refresh_token:
+                    self.save(user_key, credentials)  # Rotated refresh token
+        return credentials
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(REFRESH_CHECK_SECONDS)
+            now = time.time()
+            with self._lock:
+                idle = [key for key, entry in self._entries.items() if now - entry.last_used > IDLE_FORGET_SECONDS]
+                for key in idle:
+                    del self._entries[key]
+                due = [(key, entry) for key, entry in self._entries.items() if needs_refresh(entry.credentials, REFRESH_MARGIN_SECONDS + REFRESH_CHECK_SECONDS)]
+            for user_key, entry in due:
+                try:
+                    last_used = entry.last_used  # Background refreshes don't count as use
+                    self._fresh_or_forget(user_key)
+                    entry.last_used = last_used
+                except Exception as e:
+                    logger.warn("Background credential refresh failed", error=e)
+
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_manager():
+    """Returns the process-wide credential manager."""
+    global _manager
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = CredentialManager()
+    return _manager
@@ -0,0 +1,130 @@
+"""Renders the report model into Google Docs batchUpdate requests.
+
+The report is turned into a list of segments (text plus its paragraph style
+and any bold/italic runs). ``render_requests`` lays the segments out from a
+start index, computing every range in UTF-16 code units as the Docs API
+expects, and emits one ``insertText`` per chunk followed by the
+``updateParagraphStyle`` / ``updateTextStyle`` requests for that text. Output
+is normally a single chunk (one round trip); it is only split when a chunk
+would get close to the API request-size limit.
+"""
+import json
+
+NORMAL_TEXT = "NORMAL_TEXT"
+HEADING_1 = "HEADING_1"
+HEADING_2 = "HEADING_2"
+
+FOOTER_TEXT = "Draft generated by Granti Aunty."
+MISSING_SECTION_TEXT = "No data entered for this section."
+QUARTER_END_DATE_LABEL = "Quarter End Date:"
+
+MAX_REQUEST_BYTES = 4 * 1024 * 1024  # Well under the API's per-request payload limit
+STYLE_REQUEST_BYTES = 256  # Rough serialized size of one style request, for chunking
+MAX_SEGMENT_CHARS = 256 * 1024  # Longer plain paragraphs are split so they can span chunks
+
+
+class Segment:
+    """A run of text ending in a newline, with its paragraph style and (start, end, text_style) runs."""
+    __slots__ = ("text", "style", "runs")
+
+    def __init__(self, text, style=NORMAL_TEXT, runs=()):
+        self.text = text
+        self.style = style
+        self.runs = list(runs)
+
+
+def utf16_len(text):
+    """Length of ``text`` in UTF-16 code units (the unit of Docs API indices)."""
+    return len(text) + sum(1 for ch in text if ord(ch) > 0xFFFF)
+
+
+def _labelled(label, value):
+    return Segment(f"{label} {value}\n", runs=[(0, len(label), {'bold': True})])
+
+
+def _split_long(segment):
+    if segment.runs or len(segment.text) <= MAX_SEGMENT_CHARS:
+        return [segment]
+    text = segment.text
+    return [Segment(text[i:i + MAX_SEGMENT_CHARS], segment.style) for i in range(0, len(text), MAX_SEGMENT_CHARS)]
+
+
+# --- Report Model -> Segments ---
+def date_segment(model):
+    return _labelled(QUARTER_END_DATE_LABEL, model['quarter_end_date'])
+
+
+def section_body_segments(section):
+    """Segments for a section's body (everything between its heading and the next one)."""
+    if section['content'] is None:
+        segments = [Segment(MISSING_SECTION_TEXT + "\n", runs=[(0, len(MISSING_SECTION_TEXT), {'italic': True})])]
+    else:
+        segments = _split_long(Segment(section['content'] + "\n"))
+    if section['context']:
+        segments.append(Segment(section['context'] + "\n", runs=[(0, len(section['context']), {'italic': True})]))
+    return segments
+
+
+def report_segments(model):
+    segments = [
+        Segment(f"Innovate UK Quarterly Report - Q{model['quarter']}\n", HEADING_1),
+        _labelled("Project:", f"{model['project_title']} ({model['project_number']})"),
+        date_segment(model),
+    ]
+    for section in model['sections']:
+        segments.append(Segment(section['title'] + "\n", HEADING_2))
+        segments.extend(section_body_segments(section))
+    segments.append(Segment(FOOTER_TEXT + "\n", runs=[(0, len(FOOTER_TEXT), {'italic': True})]))
+    return segments
+
+
+def segments_text(segments):
+    return "".join(s.text for s in segments)
+
+
+# --- Segments -> Requests ---
+def _range(start, end):
+    return {'startIndex': start, 'endIndex': end}
+
+
+def _chunk_requests(text, start, end, style_requests):
+    return [
+        {'insertText': {'location': {'index': start}, 'text': text}},
+        {'updateParagraphStyle': {'range': _range(start, end), 'paragraphStyle': {'namedStyleType': NORMAL_TEXT}, 'fields': 'namedStyleType'}},
+        {'updateTextStyle': {'range': _range(start, end), 'textStyle': {}, 'fields': 'bold,italic'}},
+    ] + style_requests
+
+
+def render_requests(segments, start_index=1, max_request_bytes=MAX_REQUEST_BYTES):
+    """Returns a list of request lists (chunks) that insert and style ``segments`` from ``start_index``.
+
+    Each chunk only refers to text inserted by itself or by earlier chunks, so
+    chunks must be sent in order.
+    """
+    chunks = []
+    texts, style_requests = [], []
+    chunk_start = index = start_index
+    size = 0
+    for segment in segments:
+        # Sized as sent: the client serializes the body with JSON escapes (\n, \uXXXX for non-ASCII)
+        segment_bytes = len(json.dumps(segment.text)) + STYLE_REQUEST_BYTES * (1 + len(segment.runs))
+        if texts and size + segment_bytes > max_request_bytes:
+            chunks.append(_chunk_requests("".join(texts), chunk_start, index, style_requests))
+            texts, style_requests = [], []
+            chunk_start, size = index, 0
+        segment_end = index + utf16_len(segment.text)
+        if segment.style != NORMAL_TEXT:
+            style_requests.append({'updateParagraphStyle': {'range': _range(index, segment_end), 'paragraphStyle': {'namedStyleType': segment.style}, 'fields': 'namedStyleType'}})
+        for run_start, run_end, text_style in segment.runs:
+            run_index = index + utf16_len(segment.text[:run_start])
+            style_requests.append({'updateTextStyle': {'range': _range(run_index, run_index + utf16_len(segment.text[run_start:run_end])), 'textStyle': text_style, 'fields': ",".join(text_style)}})
+        texts.append(segment.text)
+        size += segment_bytes
+        index = segment_end
+    if texts:
+        chunks.append(_chunk_requests("".join(texts), chunk_start, index, style_requests))
+    return chunks
+
+
+def payload_bytes(requests):
+    return len(json.dumps({'requests': requests}).encode('utf-8'))
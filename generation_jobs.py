@@ -0,0 +1,144 @@
+"""Background job queue for report generation.
+
+Generation jobs run on a bounded, process-wide worker pool so a Streamlit
+script run never blocks on Google round trips. Each job is tagged with the
+session and quarter it belongs to; the chat polls ``GenerationQueue.get`` from
+a fragment until the job is done or failed.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+FINISHED_STATES = (DONE, FAILED)
+
+DEFAULT_WORKERS = int(os.environ.get("GRANTI_GENERATION_WORKERS", "4"))
+DEFAULT_MAX_PENDING = int(os.environ.get("GRANTI_GENERATION_MAX_PENDING", "64"))
+FINISHED_JOB_TTL_SECONDS = 30 * 60
+
+logger = instrumentation.get_logger("generation_jobs")
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the queue already holds its maximum number of unfinished jobs."""
+
+
+class GenerationJob:
+    def __init__(self, session_id, quarter, fn, args, kwargs, key=None):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.session_id = session_id
+        self.quarter = quarter
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+
+    def __repr__(self):
+        return f"<GenerationJob {self.job_id[:8]} session={self.session_id} Q{self.quarter} {self.status}>"
+
+
+class GenerationQueue:
+    def __init__(self, max_workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="granti-gen")
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+    def submit(self, session_id, quarter, fn, *args, **kwargs):
+        """Queues ``fn(*args, **kwargs)`` and returns its ``GenerationJob``."""
+        return self._submit(None, session_id, quarter, fn, args, kwargs)
+
+    def submit_unique(self, key, session_id, quarter, fn, *args, **kwargs):
+        """Like ``submit``, but if the session already has an unfinished job for ``key`` that job is returned instead.
+
+        Keyed by content, this keeps a repeated request (a double confirmation,
+        a rerun) from publishing the same report twice at the same time.
+        """
+        return self._submit(key, session_id, quarter, fn, args, kwargs)
+
+    def _submit(self, key, session_id, quarter, fn, args, kwargs):
+        job = GenerationJob(session_id, quarter, fn, args, kwargs, key)
+        with self._lock:
+            self._prune_locked()
+            if key is not None:
+                running = next((j for j in self._jobs.values() if j.key == key and j.session_id == session_id and not j.finished), None)
+                if running:
+                    logger.debug("Joined the unfinished job for the same content", job=running)
+                    return running
+            pending = sum(1 for j in self._jobs.values() if not j.finished)
+            if pending >= self.max_pending:
+                raise QueueFullError(f"{pending} generation jobs already pending.")
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job)
+        logger.debug("Queued generation job", job=job)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs_for_session(self, session_id):
+        with self._lock:
+            return [j for j in self._jobs.values() if j.session_id == session_id]
+
+    def stats(self):
+        with self._lock:
+            counts = {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+        return counts
+
+    def _run(self, job):
+        job.started_at = time.time()
+        job.status = RUNNING
+        status = FAILED
+        try:
+            job.result = job.fn(*job.args, **job.kwargs)
+            status = DONE
+        except Exception as e:
+            logger.exception("Generation job failed", job=job, error=e)
+            job.error = e
+        finally:
+            job.fn = job.args = job.kwargs = None  # Don't hold on to credentials/report text
+            finished_at = time.time()
+            # A finished job always has finished_at (pruning compares it)
+            with self._lock:
+                job.finished_at = finished_at
+                job.status = status
+
+    def _prune_locked(self):
+        cutoff = time.time() - FINISHED_JOB_TTL_SECONDS
+        for job_id in [k for k, j in self._jobs.items() if j.finished and j.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_queue():
+    """Returns the process-wide generation queue."""
+    global _queue
+    if _queue is None:
+        with _queue_lock:
+            if _queue is None:
+                _queue = GenerationQueue()
+    return _queue
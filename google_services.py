@@ -0,0 +1,223 @@
+"""Shared Google Docs/Drive service factory for Granti Aunty.
+
+Discovery documents are read from a local directory (``GRANTI_DISCOVERY_DIR``,
+default ``discovery/`` in the data directory; drop ``docs.v1.json`` /
+``drive.v3.json`` there to pin them; missing ones are seeded from the copies
+bundled with googleapiclient if the directory is writable) and parsed once
+per process. Built service objects are shared across Streamlit sessions, keyed
+by the identity of the credentials they were built for, so report generation
+never pays for discovery parsing.
+
+Service objects are not thread-safe for I/O, so requests should go through
+``execute()``, which sends them over a per-thread authorized HTTP client once
+the process-wide quota limiter (quota.py) lets them through.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import google_auth_httplib2
+import httplib2
+from googleapiclient.discovery import build_from_document
+from googleapiclient.errors import HttpError
+
+import instrumentation
+import quota
+
+DATA_DIR = os.environ.get("GRANTI_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "granti_data"))
+DISCOVERY_DIR = os.environ.get("GRANTI_DISCOVERY_DIR", os.path.join(DATA_DIR, "discovery"))
+PRELOAD_APIS = [("docs", "v1"), ("drive", "v3")]
+MAX_CACHED_SERVICES = 64
+# Sends API calls to another server instead of googleapis.com (e.g. the fake one in benchmarks/fake_google.py)
+API_ROOT_OVERRIDE = os.environ.get("GRANTI_GOOGLE_API_ROOT")
+
+# Retry policy for Google API calls: jittered exponential backoff on these statuses and on transport errors
+RETRYABLE_STATUS_CODES = frozenset([408, 429, 500, 502, 503, 504])
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_CAP_SECONDS = 32.0
+
+logger = instrumentation.get_logger("google_services")
+
+_lock = threading.Lock()
+_discovery_docs = {}  # (api, version) -> parsed discovery document
+_services = OrderedDict()  # (api, version, identity) -> service, LRU order
+_thread_local = threading.local()
+
+
+def credential_identity(credentials):
+    """Returns a stable key for the account/token a credentials object stands for."""
+    client_id = getattr(credentials, 'client_id', None) or ''
+    secret = getattr(credentials, 'refresh_token', None) or getattr(credentials, 'token', None) or ''
+    return hashlib.sha256(f"{client_id}\0{secret}".encode('utf-8')).hexdigest()
+
+
+# --- Discovery Documents ---
+def _read_discovery_doc(api, version):
+    path = os.path.join(DISCOVERY_DIR, f"{api}.{version}.json")
+    if os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    from googleapiclient.discovery_cache import get_static_doc
+    content = get_static_doc(api, version)
+    if content is None:
+        raise FileNotFoundError(f"No discovery document available for {api} {version} (looked in {DISCOVERY_DIR}).")
+    try:
+        os.makedirs(DISCOVERY_DIR, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+        logger.debug("Seeded local discovery document", path=path)
+    except OSError as e:
+        logger.warn("Could not write discovery document", path=path, error=e)
+    return json.loads(content)
+
+
+def load_discovery_doc(api, version):
+    """Returns the parsed discovery document for an API, loading it at most once per process."""
+    key = (api, version)
+    doc = _discovery_docs.get(key)
+    if doc is None:
+        with _lock:
+            doc = _discovery_docs.get(key)
+            if doc is None:
+                doc = _read_discovery_doc(api, version)
+                if API_ROOT_OVERRIDE:
+                    root = API_ROOT_OVERRIDE.rstrip('/') + '/'
+                    doc = dict(doc, rootUrl=root, mtlsRootUrl=root, baseUrl=root + doc.get('servicePath', ''))
+                _discovery_docs[key] = doc
+    return doc
+
+
+def preload_discovery_docs():
+    for api, version in PRELOAD_APIS:
+        try:
+            load_discovery_doc(api, version)
+        except Exception as e:
+            logger.warn("Preloading discovery document failed", api=api, version=version, error=e)
+
+
+# --- Service Objects ---
+def get_service(api, version, credentials):
+    """Returns a (shared) service object for ``credentials``, building it from the cached discovery doc if needed."""
+    key = (api, version, credential_identity(credentials))
+    with _lock:
+        service = _services.get(key)
+        if service is not None:
+            _services.move_to_end(key)
+            return service
+
+    with instrumentation.span("google.build_service", api=api):
+        service = build_from_document(load_discovery_doc(api, version), credentials=credentials)
+    with _lock:
+        service = _services.setdefault(key, service)
+        _services.move_to_end(key)
+        while len(_services) > MAX_CACHED_SERVICES:
+            _services.popitem(last=False)
+    return service
+
+
+def invalidate(credentials):
+    """Drops every cached service and HTTP client built for ``credentials`` (logout, re-auth, token rotation)."""
+    identity = credential_identity(credentials)
+    with _lock:
+        for key in [k for k in _services if k[2] == identity]:
+            del _services[key]
+    cached = getattr(_thread_local, 'http', None)
+    if cached is not None and cached[0] == identity:
+        _thread_local.http = None
+
+
+def authorized_http(credentials):
+    """Returns this thread's authorized HTTP client for ``credentials``."""
+    identity = credential_identity(credentials)
+    cached = getattr(_thread_local, 'http', None)
+    if cached is None or cached[0] != identity or cached[1].credentials is not credentials:
+        cached = (identity, google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http()))
+        _thread_local.http = cached
+    return cached[1]
+
+
+# --- Quota ---
+def quota_calls(request):
+    """``{api class: calls}`` a request counts against quota; each request in a batch counts separately."""
+    inner = getattr(request, '_requests', None)  # BatchHttpRequest
+    calls = {}
+    for r in (inner.values() if inner is not None else [request]):
+        api = quota.api_class(r.method, r.uri)
+        if api:
+            calls[api] = calls.get(api, 0) + 1
+    return calls
+
+
+def wait_for_quota(request, credentials):
+    limiter = quota.get_limiter()
+    project = getattr(credentials, 'client_id', None) or ''
+    user = credential_identity(credentials)
+    for api, calls in quota_calls(request).items():
+        limiter.acquire(api, project, user, calls, timeout=quota.MAX_WAIT_WINDOWS * limiter.window_seconds)
+
+
+# --- Retries ---
+def is_retryable(error, idempotent=True):
+    """Whether a failed call may be sent again.
+
+    A non-idempotent call (a Docs batchUpdate) is only retried when it
+    certainly wasn't applied: a 429, or a connection that was refused. A 5xx,
+    a reset connection or a timeout may have lost the response to a request
+    the server already applied.
+    """
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS_CODES if idempotent else error.resp.status == 429
+    if not idempotent:
+        return isinstance(error, ConnectionRefusedError)
+    return isinstance(error, (ConnectionError, TimeoutError))
+
+
+def backoff_delay(attempt, error=None):
+    """Seconds to wait before retry number ``attempt`` (0-based): Retry-After if given, else full jitter."""
+    retry_after = error.resp.get('retry-after') if isinstance(error, HttpError) else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_CAP_SECONDS)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+def with_retries(operation, retryable=is_retryable, max_retries=MAX_RETRIES):
+    """Calls ``operation()``, calling it again after failures ``retryable(error)`` accepts, with jittered exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return operation()
+        except Exception as e:
+            if attempt >= max_retries or not retryable(e):
+                raise
+            delay = backoff_delay(attempt, e)
+            logger.warn("Google API call failed; retrying", error=e, retry=attempt + 1, max_retries=max_retries, delay_s=round(delay, 1))
+            time.sleep(delay)
+
+
+def execute(request, credentials, max_retries=MAX_RETRIES, idempotent=True):
+    """Executes a googleapiclient request (or batch) over the calling thread's own HTTP client.
+
+    Every attempt first waits for quota. Retryable failures (429, 5xx,
+    transport errors) are retried with jittered exponential backoff; anything
+    else is raised immediately. Pass ``idempotent=False`` for requests that
+    must not be applied twice (Docs batchUpdate): they are only resent when
+    they certainly weren't applied, see ``is_retryable``.
+    """
+    def attempt():
+        wait_for_quota(request, credentials)
+        return request.execute(http=authorized_http(credentials))
+    return with_retries(attempt, lambda e: is_retryable(e, idempotent), max_retries)
+
+
+# Parse the discovery documents off the script thread as soon as the module is first imported.
+threading.Thread(target=preload_discovery_docs, name="discovery-preload", daemon=True).start()
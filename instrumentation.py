@@ -0,0 +1,246 @@
+"""Leveled structured logging and timing spans.
+
+    logger = instrumentation.get_logger("report_docs")
+    logger.debug("Created doc", doc_id=doc_id)
+    with instrumentation.span("docs.batch_update", requests=len(requests)):
+        ...
+
+Messages are constant strings and values are passed as fields, so nothing is
+formatted unless the level is enabled. ``GRANTI_LOG_LEVEL`` sets the level
+(DEBUG, INFO, WARN, ERROR or OFF) and defaults to INFO. Fields that can carry
+report text or secrets are redacted, and long values are truncated. Lines are
+logfmt by default; set ``GRANTI_LOG_FORMAT=json`` for JSON.
+
+Spans add their durations to per-name histograms. Each finished span can be
+appended to a JSON-lines file (``GRANTI_SPAN_FILE``). The histograms can be
+served in Prometheus text format at ``http://<host>:GRANTI_METRICS_PORT/metrics``.
+With ``GRANTI_SPANS=0``, ``span()`` returns a shared no-op.
+"""
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+DEBUG, INFO, WARN, ERROR, OFF = 10, 20, 30, 40, 100
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARN: "WARN", ERROR: "ERROR"}
+LEVEL = {"DEBUG": DEBUG, "INFO": INFO, "WARN": WARN, "WARNING": WARN, "ERROR": ERROR, "OFF": OFF}.get(
+    os.environ.get("GRANTI_LOG_LEVEL", "INFO").upper(), INFO)
+JSON_FORMAT = os.environ.get("GRANTI_LOG_FORMAT", "").lower() == "json"
+SPANS_ENABLED = os.environ.get("GRANTI_SPANS", "1") != "0"
+SPAN_FILE = os.environ.get("GRANTI_SPAN_FILE")
+METRICS_PORT = os.environ.get("GRANTI_METRICS_PORT")
+
+# Field names whose values are never logged, only their size
+REDACTED_FIELDS = frozenset(["answer", "answers", "body", "client_secret", "code", "content", "model",
+                             "prompt", "refresh_token", "requests", "text", "token"])
+MAX_FIELD_CHARS = 200
+SPAN_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_write_lock = threading.Lock()
+
+
+def _field_value(key, value):
+    if key in REDACTED_FIELDS and value is not None:
+        size = len(value) if hasattr(value, '__len__') else None
+        return f"<redacted len={size}>" if size is not None else "<redacted>"
+    if isinstance(value, BaseException):
+        value = f"{type(value).__name__}: {value}"
+    elif not isinstance(value, (str, int, float, bool)) and value is not None:
+        value = str(value)
+    if isinstance(value, str) and len(value) > MAX_FIELD_CHARS:
+        value = value[:MAX_FIELD_CHARS] + "..."
+    return value
+
+
+def _format(level, name, message, fields):
+    fields = {key: _field_value(key, value) for key, value in fields.items()}
+    if JSON_FORMAT:
+        return json.dumps(dict({"ts": round(time.time(), 3), "level": LEVEL_NAMES[level], "logger": name, "msg": message}, **fields), default=str)
+    parts = [f"{LEVEL_NAMES[level]}: [{name}] {message}"]
+    for key, value in fields.items():
+        parts.append(f"{key}={json.dumps(value) if isinstance(value, str) and (' ' in value or not value) else value}")
+    return " ".join(parts)
+
+
+class Logger:
+    __slots__ = ("name",)
+
+    def __init__(self, name):
+        self.name = name
+
+    def enabled(self, level):
+        return level >= LEVEL
+
+    def _log(self, level, message, fields, exc_info=False):
+        line = _format(level, self.name, message, fields)
+        if exc_info:
+            line += "\n" + traceback.format_exc().rstrip()
+        with _write_lock:
+            print(line, file=sys.stdout, flush=True)
+
+    def debug(self, message, **fields):
+        if DEBUG >= LEVEL:
+            self._log(DEBUG, message, fields)
+
+    def info(self, message, **fields):
+        if INFO >= LEVEL:
+            self._log(INFO, message, fields)
+
+    def warn(self, message, **fields):
+        if WARN >= LEVEL:
+            self._log(WARN, message, fields)
+
+    def error(self, message, **fields):
+        if ERROR >= LEVEL:
+            self._log(ERROR, message, fields)
+
+    def exception(self, message, **fields):
+        """Logs at ERROR with the traceback of the exception being handled."""
+        if ERROR >= LEVEL:
+            self._log(ERROR, message, fields, exc_info=True)
+
+
+_loggers = {}
+
+
+def get_logger(name):
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers.setdefault(name, Logger(name))
+    return logger
+
+
+_log = get_logger("instrumentation")
+
+
+# --- Spans ---
+class _Histogram:
+    __slots__ = ("counts", "count", "total", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(SPAN_BUCKETS) + 1)  # Per bucket (not cumulative); the last one is +Inf
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+
+_histograms = {}  # span name -> _Histogram
+_histograms_lock = threading.Lock()
+_span_file = None
+
+
+def _record(name, seconds, failed, fields):
+    global _span_file
+    with _histograms_lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = _Histogram()
+        histogram.counts[bisect.bisect_left(SPAN_BUCKETS, seconds)] += 1
+        histogram.count += 1
+        histogram.total += seconds
+        histogram.errors += failed
+        if SPAN_FILE:
+            if _span_file is None:
+                _span_file = open(SPAN_FILE, 'a', encoding='utf-8', buffering=1)
+            record = {"ts": round(time.time(), 3), "span": name, "seconds": round(seconds, 6), "error": failed}
+            record.update((key, _field_value(key, value)) for key, value in fields.items())
+            _span_file.write(json.dumps(record, default=str) + "\n")
+    if DEBUG >= LEVEL:
+        _log.debug("span", span=name, ms=round(seconds * 1000, 2), error=failed, **fields)
+
+
+class _Span:
+    __slots__ = ("name", "fields", "start")
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _record(self.name, time.perf_counter() - self.start, exc_type is not None, self.fields)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name, **fields):
+    """Times the ``with`` block under ``name``. ``fields`` go to the span file and debug log only."""
+    if not SPANS_ENABLED:
+        return _NO_SPAN
+    return _Span(name, fields)
+
+
+def span_stats():
+    """Returns ``{name: {"count", "total_seconds", "errors"}}`` for every span recorded so far."""
+    with _histograms_lock:
+        return {name: {"count": h.count, "total_seconds": h.total, "errors": h.errors} for name, h in _histograms.items()}
+
+
+def prometheus_text():
+    """The span histograms in Prometheus text exposition format."""
+    lines = ["# HELP granti_span_seconds Duration of instrumented operations.", "# TYPE granti_span_seconds histogram"]
+    errors = ["# HELP granti_span_errors_total Instrumented operations that raised.", "# TYPE granti_span_errors_total counter"]
+    with _histograms_lock:
+        for name, h in sorted(_histograms.items()):
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip(SPAN_BUCKETS, h.counts):
+                cumulative += count
+                lines.append(f'granti_span_seconds_bucket{{span="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'granti_span_seconds_bucket{{span="{label}",le="+Inf"}} {h.count}')
+            lines.append(f'granti_span_seconds_sum{{span="{label}"}} {h.total}')
+            lines.append(f'granti_span_seconds_count{{span="{label}"}} {h.count}')
+            errors.append(f'granti_span_errors_total{{span="{label}"}} {h.errors}')
+    return "\n".join(lines + errors) + "\n"
+
+
+def start_metrics_server(port, host="127.0.0.1"):
+    """Serves ``/metrics`` on a background thread. Returns the server, or None if the port is taken."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # Only imported when serving (slow to import)
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text().encode('utf-8')
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    try:
+        server = ThreadingHTTPServer((host, int(port)), MetricsHandler)
+    except OSError as e:
+        _log.warn("Could not start metrics server", port=port, error=e)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    _log.info("Serving span metrics", url=f"http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+if METRICS_PORT:
+    start_metrics_server(METRICS_PORT)
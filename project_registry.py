@@ -0,0 +1,135 @@
+"""Grant projects served by this process, loaded from TOML files.
+
+Each ``<id>.toml`` in the projects directory (``GRANTI_PROJECTS_DIR``, default
+``<app>/projects``) describes one project. Its ``[project]`` table holds the
+details. It can override the report ``sections`` and any prompt from
+``_defaults.toml``. Files whose names start with "_" are not projects.
+
+The files are read once per process. Each project is compiled into a
+read-only ``ProjectConfig``: its section keys and retrieval queries, and its
+prompt templates with the project's own fields already filled in. Every
+session serving that project shares the same ``ProjectConfig``. So one server
+can host many projects, and memory grows with sessions, not with projects.
+"""
+import os
+import string
+import threading
+from types import MappingProxyType
+
+try:
+    import tomllib
+except ImportError:  # Python < 3.11
+    import tomli as tomllib
+
+import instrumentation
+
+PROJECTS_DIR = os.environ.get("GRANTI_PROJECTS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "projects"))
+DEFAULTS_FILE = "_defaults.toml"
+
+# [project] key -> details key (the details keys predate the registry)
+DETAIL_KEYS = {
+    "lead_company": "Lead Company Name",
+    "title": "Project title",
+    "number": "Project Number",
+    "total_quarters": "Total Quarters",
+}
+REQUIRED_KEYS = ("title", "number", "total_quarters")
+
+logger = instrumentation.get_logger("project_registry")
+
+_formatter = string.Formatter()
+
+
+def compile_template(template, fields):
+    """Fills ``template``'s named fields from ``fields``, leaving positional ones ({0}, {}) for ``str.format`` later.
+
+    Raises KeyError for a named field the project doesn't have.
+    """
+    parts = []
+    for literal, field, spec, conversion in _formatter.parse(template):
+        parts.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is None:
+            continue
+        if field == "" or field.isdigit():
+            parts.append("{" + field + (f"!{conversion}" if conversion else "") + (f":{spec}" if spec else "") + "}")
+        else:
+            value = _formatter.convert_field(_formatter.get_field(field, (), fields)[0], conversion)
+            parts.append(_formatter.format_field(value, spec).replace("{", "{{").replace("}", "}}"))
+    return "".join(parts)
+
+
+class ProjectConfig:
+    """One project's compiled, read-only configuration."""
+    __slots__ = ("id", "details", "section_keys", "prompts", "section_queries")
+
+    def __init__(self, project_id, project, sections, prompts):
+        missing = [key for key in REQUIRED_KEYS if project.get(key) in (None, "")]
+        if missing:
+            raise ValueError(f"[project] is missing {missing}")
+        fields = dict(project, number=str(project["number"]), short_name=project.get("short_name") or project["title"])
+        self.id = project_id
+        self.details = MappingProxyType({DETAIL_KEYS[key]: fields[key] for key in DETAIL_KEYS if key in fields})
+        self.section_keys = tuple(sections)
+        self.prompts = MappingProxyType({key: compile_template(text, fields) for key, text in prompts.items()})
+        # BM25 queries used to precompute relevant passages for each report section (see retrieval.py)
+        self.section_queries = MappingProxyType({
+            key: key.replace('_', ' ') + " " + self.prompts.get(key, "").replace("*", "")
+            for key in self.section_keys if key != "quarter_end_date"
+        })
+
+    @property
+    def title(self):
+        return self.details["Project title"]
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return tomllib.load(f)
+
+
+class ProjectRegistry:
+    def __init__(self, directory=PROJECTS_DIR):
+        self.directory = directory
+        self._projects = {}  # id -> ProjectConfig
+        with instrumentation.span("projects.load"):
+            defaults_path = os.path.join(directory, DEFAULTS_FILE)
+            defaults = _read(defaults_path) if os.path.exists(defaults_path) else {}
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith(".toml") or name.startswith("_"):
+                    continue
+                project_id = name[:-len(".toml")]
+                try:
+                    config = _read(os.path.join(directory, name))
+                    self._projects[project_id] = ProjectConfig(
+                        project_id, config.get("project", {}),
+                        config.get("sections", defaults.get("sections", [])),
+                        dict(defaults.get("prompts", {}), **config.get("prompts", {})))
+                except (OSError, ValueError, KeyError, IndexError, AttributeError) as e:  # tomllib.TOMLDecodeError is a ValueError
+                    logger.error("Skipping invalid project file", file=name, error=e)
+        if not self._projects:
+            raise ValueError(f"No valid project files found in {directory}")
+        logger.debug("Projects loaded", projects=len(self._projects))
+
+    def get(self, project_id):
+        """Returns the project's config, or None if there is no such project."""
+        return self._projects.get(project_id)
+
+    def ids(self):
+        return list(self._projects)
+
+    def projects(self):
+        return list(self._projects.values())
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """Returns the process-wide project registry."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ProjectRegistry()
+    return _registry
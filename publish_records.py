@@ -0,0 +1,92 @@
+"""Persisted record of the Google Docs each report generation created.
+
+One row per (session, quarter, content hash) tracks the Drive file ID and how
+far publishing got (creating -> created -> populated), so a retry after a
+failure resumes the same document instead of creating a new one, and files
+left behind by abandoned attempts can be found and deleted.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+DATA_DIR = os.environ.get("GRANTI_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "granti_data"))
+DB_PATH = os.path.join(DATA_DIR, "publish_records.sqlite3")
+
+CREATING = "creating"    # Drive create sent, ID not yet known
+CREATED = "created"      # Drive file exists, content not yet inserted
+POPULATED = "populated"  # Report text inserted; the document is complete
+
+
+class PublishRecords:
+    def __init__(self, path=DB_PATH):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS publish_records (
+                session_id TEXT NOT NULL,
+                quarter INTEGER NOT NULL,
+                content_hash TEXT NOT NULL,
+                title TEXT NOT NULL,
+                doc_id TEXT,
+                state TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (session_id, quarter, content_hash)
+            )""")
+
+    def get(self, session_id, quarter, content_hash):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM publish_records WHERE session_id = ? AND quarter = ? AND content_hash = ?",
+                (session_id, quarter, content_hash)).fetchone()
+        return dict(row) if row else None
+
+    def put(self, session_id, quarter, content_hash, title, state, doc_id=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO publish_records VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, quarter, content_hash, title, doc_id, state, time.time()))
+
+    def delete(self, session_id, quarter, content_hash):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM publish_records WHERE session_id = ? AND quarter = ? AND content_hash = ?",
+                (session_id, quarter, content_hash))
+
+    def adopt(self, session_id, quarter, content_hash, title, doc_id):
+        """Records an existing document as holding new content, after an in-place update.
+
+        Every record of the document is dropped first. So a later publish of its
+        old content creates a new document, instead of returning this one.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM publish_records WHERE doc_id = ?", (doc_id,))
+            self._conn.execute(
+                "INSERT OR REPLACE INTO publish_records VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (session_id, quarter, content_hash, title, doc_id, POPULATED, time.time()))
+
+    def unfinished(self, session_id, quarter, exclude_hash=None):
+        """Records for a session/quarter that never got populated (candidate orphans)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM publish_records WHERE session_id = ? AND quarter = ? AND state != ? AND content_hash != ?",
+                (session_id, quarter, POPULATED, exclude_hash or "")).fetchall()
+        return [dict(r) for r in rows]
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Returns the process-wide publish record store."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = PublishRecords()
+    return _store
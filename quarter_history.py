@@ -0,0 +1,224 @@
+"""Quarter-over-quarter context for report answers.
+
+For every answer the history keeps a context snippet (the opening sentences,
+cut at a sentence boundary) and the answer's sentences. Both are computed
+once, when the answer is saved. For each project it also keeps an index from
+(quarter, section) to the latest earlier quarter that answered the section.
+So the "last time you wrote" context for a prompt or a report is a dict
+lookup, and it reaches back past quarters that skipped the section.
+
+Section diffs compare two quarters by content hash and sentence sets, and
+the "what changed since Qn" view is cached until the project's answers
+change. The history subscribes to the answer store (see answer_store.py), so
+it is updated incrementally as each answer is saved. A project is loaded from
+the store once, on first use.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import answer_store
+import instrumentation
+
+SNIPPET_CHARS = 200
+MAX_CACHED_VIEWS = 64
+
+UNCHANGED = "unchanged"
+CHANGED = "changed"
+ADDED = "added"
+REMOVED = "removed"
+MISSING = "missing"  # Answered in neither quarter
+
+logger = instrumentation.get_logger("quarter_history")
+
+# A sentence ends at ., ! or ? (optionally followed by closing quotes/brackets) before whitespace, or at a line break
+_SENTENCE_END_RE = re.compile(r"[.!?][\"')\]]*(?=\s)|\n")
+
+
+def sentences(text):
+    """Splits ``text`` into stripped, non-empty sentences."""
+    parts, start = [], 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        parts.append(text[start:match.end()])
+        start = match.end()
+    parts.append(text[start:])
+    return [p.strip() for p in parts if p.strip()]
+
+
+def snippet(text, limit=SNIPPET_CHARS):
+    """The longest run of whole opening sentences of ``text`` that fits in ``limit`` characters.
+
+    If even the first sentence is longer, it is cut at a word boundary and
+    ends with "...".
+    """
+    text = " ".join(text.split())
+    if len(text) <= limit:
+        return text
+    cut = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        if match.end() > limit:
+            break
+        cut = match.end()
+    if cut:
+        return text[:cut].rstrip()
+    words = text[:limit - 3].rsplit(" ", 1)[0]
+    return words.rstrip(",;:") + "..."
+
+
+class SectionEntry:
+    """One saved answer, with what context and diffs need precomputed."""
+    __slots__ = ("text_hash", "snippet", "sentences")
+
+    def __init__(self, text):
+        self.text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()
+        self.snippet = snippet(text)
+        self.sentences = frozenset(sentences(text))
+
+
+class ProjectHistory:
+    def __init__(self):
+        self.entries = {}  # (quarter, section) -> SectionEntry
+        self.quarters = {}  # section -> sorted quarters with an answer
+        self.context_index = {}  # (quarter, section) -> latest earlier quarter with an answer
+        self.version = 0
+
+    def record(self, quarter, section, text):
+        self.entries[(quarter, section)] = SectionEntry(text)
+        self.version += 1
+        answered = self.quarters.setdefault(section, [])
+        if quarter in answered:
+            return
+        answered.append(quarter)
+        answered.sort()
+        position = answered.index(quarter)
+        if position:
+            # Quarters up to this one take their context from the answered quarter before it
+            for later in range(answered[position - 1] + 1, quarter + 1):
+                self.context_index[(later, section)] = answered[position - 1]
+        # Quarters after this one, up to and including the next answered one, now take their context from it
+        end = answered[position + 1] if position + 1 < len(answered) else quarter + 1
+        for later in range(quarter + 1, end + 1):
+            self.context_index[(later, section)] = quarter
+
+    def context_quarter(self, quarter, section):
+        source = self.context_index.get((quarter, section))
+        if source is None:
+            answered = self.quarters.get(section)
+            if answered and quarter > answered[-1]:
+                source = answered[-1]  # Beyond the last answered quarter: the index stops one past it
+        return source
+
+
+class QuarterHistory:
+    def __init__(self, store=None):
+        self.store = store or answer_store.get_store()
+        self._lock = threading.Lock()
+        self._projects = {}  # project number -> ProjectHistory
+        self._views = OrderedDict()  # (project, base quarter, quarter, version, sections) -> rows, LRU
+        self.store.add_listener(self._answer_saved)
+
+    def _project(self, project_number):
+        project_number = str(project_number)
+        with self._lock:
+            project = self._projects.get(project_number)
+            if project is None:
+                # Loaded under the lock so an answer saved meanwhile can't slip between the read and the index
+                project = self._projects[project_number] = ProjectHistory()
+                with instrumentation.span("history.load"):
+                    for quarter, answers in sorted(self.store.load_project(project_number).items()):
+                        for section, text in answers.items():
+                            project.record(quarter, section, text)
+                logger.debug("Loaded project history", project=project_number, answers=len(project.entries))
+            return project
+
+    def _answer_saved(self, project_number, quarter, section, text):
+        with self._lock:
+            project = self._projects.get(str(project_number))
+            if project is not None:  # Not loaded yet: the load will read this answer from the store
+                project.record(quarter, section, text)
+
+    def context(self, project_number, quarter, section):
+        """``(source quarter, snippet)`` of the latest earlier answer to ``section``, or None."""
+        project = self._project(project_number)
+        with self._lock:
+            source = project.context_quarter(quarter, section)
+            return (source, project.entries[(source, section)].snippet) if source is not None else None
+
+    def report_context(self, project_number, quarter, section_keys):
+        """``{section: (source quarter, snippet)}`` for every section with earlier context."""
+        contexts = {}
+        for section in section_keys:
+            found = self.context(project_number, quarter, section)
+            if found:
+                contexts[section] = found
+        return contexts
+
+    def section_diff(self, project_number, section, base_quarter, quarter):
+        """How ``section`` changed from ``base_quarter`` to ``quarter``.
+
+        Returns a dict with both snippets, a status (``UNCHANGED``, ``CHANGED``,
+        ``ADDED``, ``REMOVED`` or ``MISSING``) and the number of sentences added
+        and removed.
+        """
+        project = self._project(project_number)
+        with self._lock:
+            before = project.entries.get((base_quarter, section))
+            after = project.entries.get((quarter, section))
+        if before is None and after is None:
+            status = MISSING
+        elif before is None:
+            status = ADDED
+        elif after is None:
+            status = REMOVED
+        else:
+            status = UNCHANGED if before.text_hash == after.text_hash else CHANGED
+        before_sentences = before.sentences if before else frozenset()
+        after_sentences = after.sentences if after else frozenset()
+        return {
+            "section": section,
+            "before": before.snippet if before else None,
+            "after": after.snippet if after else None,
+            "status": status,
+            "sentences_added": len(after_sentences - before_sentences),
+            "sentences_removed": len(before_sentences - after_sentences),
+        }
+
+    def changes_since(self, project_number, base_quarter, quarter, section_keys):
+        """Side-by-side diff rows (see ``section_diff``) for every section, from ``base_quarter`` to ``quarter``.
+
+        Cached until the project's answers change.
+        """
+        project = self._project(project_number)
+        key = (str(project_number), base_quarter, quarter, project.version, tuple(section_keys))
+        with self._lock:
+            rows = self._views.get(key)
+            if rows is not None:
+                self._views.move_to_end(key)
+                return rows
+        rows = [self.section_diff(project_number, section, base_quarter, quarter) for section in section_keys]
+        with self._lock:
+            self._views[key] = rows
+            while len(self._views) > MAX_CACHED_VIEWS:
+                self._views.popitem(last=False)
+        return rows
+
+    def quarters(self, project_number):
+        """Quarters with at least one answer."""
+        project = self._project(project_number)
+        with self._lock:
+            return sorted({quarter for quarter, _ in project.entries})
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """Returns the process-wide quarter history."""
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                _history = QuarterHistory()
+    return _history
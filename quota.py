@@ -0,0 +1,203 @@
+"""Process-wide rate limiting for Google API calls.
+
+Every call made through ``google_services.execute()`` first takes a token from
+two buckets for its API class ("docs.read", "docs.write" or "drive"). One
+bucket is shared by the whole project (the OAuth client) and one belongs to
+the user (the credentials). Budgets follow Google's default per-minute quotas,
+refilled continuously at ``QUOTA_HEADROOM`` of the quota rate. Each bucket
+holds at most ``BURST_FRACTION`` of a window's budget, so no window ever sees
+more than the quota. At reporting deadlines calls queue here instead of coming
+back as 429s.
+
+Callers waiting for a project bucket are served by priority. Interactive
+generations go ahead of bulk jobs, which run inside
+``with quota.priority(quota.BULK):``. Within a user, calls are served in
+arrival order. Time spent waiting is recorded in the ``quota.wait.interactive``
+and ``quota.wait.bulk`` spans (see instrumentation.py).
+
+A caller that would wait longer than ``MAX_WAIT_WINDOWS`` quota windows gets
+a ``QuotaTimeoutError`` instead, so a job can't hang forever behind a
+backlog.
+
+``GRANTI_QUOTA_SCALE`` scales every budget (e.g. 2 for a project with doubled
+quotas). ``GRANTI_QUOTA_WINDOW_SECONDS`` changes the quota window, which load
+tests use to compress time. ``GRANTI_QUOTA=0`` turns the limiter off.
+"""
+import contextlib
+import heapq
+import itertools
+import os
+import threading
+import time
+
+import instrumentation
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Requests per window (a minute): Google's default Docs and Drive API quotas
+BUDGETS = {
+    "docs.read": {"project": 3000, "user": 300},
+    "docs.write": {"project": 600, "user": 60},
+    "drive": {"project": 12000, "user": 12000},
+}
+ENABLED = os.environ.get("GRANTI_QUOTA", "1") != "0"
+QUOTA_SCALE = float(os.environ.get("GRANTI_QUOTA_SCALE", "1"))
+WINDOW_SECONDS = float(os.environ.get("GRANTI_QUOTA_WINDOW_SECONDS", "60"))
+QUOTA_HEADROOM = 0.85
+BURST_FRACTION = 0.1
+MAX_USER_BUCKETS = 4096
+MAX_WAIT_WINDOWS = 5
+
+logger = instrumentation.get_logger("quota")
+
+_local = threading.local()
+
+
+class QuotaTimeoutError(RuntimeError):
+    """Raised when a call can't get its quota within the caller's timeout."""
+
+
+def scaled_budgets(scale=None):
+    """``BUDGETS`` multiplied by ``GRANTI_QUOTA_SCALE`` (or ``scale``)."""
+    scale = QUOTA_SCALE if scale is None else scale
+    return {api: {scope: max(1, int(limit * scale)) for scope, limit in limits.items()} for api, limits in BUDGETS.items()}
+
+
+def api_class(method, uri):
+    """The quota a request counts against, from its HTTP method and URI; None if it isn't limited."""
+    if "/drive/" in uri:
+        return "drive"
+    if "/documents" in uri:
+        return "docs.read" if method == "GET" else "docs.write"
+    return None
+
+
+def current_priority():
+    return getattr(_local, 'priority', INTERACTIVE)
+
+
+@contextlib.contextmanager
+def priority(level):
+    """Runs the ``with`` block's API calls (on this thread) at ``level``."""
+    previous = current_priority()
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now=None):
+        self.rate = rate  # Tokens per second
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic() if now is None else now
+
+    def delay(self, cost, now):
+        """Seconds until ``cost`` tokens can be taken (0 if they can now)."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # A cost above the capacity (a large batch) is let through once the bucket is full; the debt delays later calls
+        needed = min(cost, self.capacity)
+        return 0.0 if self.tokens >= needed else (needed - self.tokens) / self.rate
+
+    def take(self, cost):
+        self.tokens -= cost
+
+    def full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class QuotaLimiter:
+    def __init__(self, budgets=None, window_seconds=WINDOW_SECONDS, headroom=QUOTA_HEADROOM, clock=time.monotonic, sleep=time.sleep):
+        self.budgets = budgets or scaled_budgets()
+        self.window_seconds = window_seconds
+        self.headroom = headroom
+        self._clock = clock  # Injectable, with ``sleep``, for tests
+        self._sleep = sleep
+        self._cond = threading.Condition()
+        self._buckets = {}  # (api, "project"/"user", key) -> TokenBucket
+        self._waiters = {}  # (api, project) -> heap of (priority, seq)
+        self._seq = itertools.count()
+
+    def _bucket(self, api, scope, key, now):
+        bucket = self._buckets.get((api, scope, key))
+        if bucket is None:
+            if len(self._buckets) >= MAX_USER_BUCKETS:
+                # Full buckets are indistinguishable from new ones, so they can go
+                for k in [k for k, b in self._buckets.items() if b.full(now)]:
+                    del self._buckets[k]
+            budget = self.budgets[api][scope]
+            bucket = self._buckets[(api, scope, key)] = TokenBucket(
+                budget * self.headroom / self.window_seconds, max(1.0, budget * BURST_FRACTION), now)
+        return bucket
+
+    def acquire(self, api, project, user, cost=1, level=None, timeout=None):
+        """Blocks until ``cost`` calls of ``api`` fit the project's and the user's budgets. Returns seconds waited.
+
+        Raises ``QuotaTimeoutError`` as soon as it is clear the calls can't go
+        ahead within ``timeout`` seconds.
+        """
+        if not ENABLED or api not in self.budgets:
+            return 0.0
+        level = current_priority() if level is None else level
+        start = self._clock()
+        deadline = None if timeout is None else start + timeout
+        with instrumentation.span(f"quota.wait.{PRIORITY_NAMES.get(level, level)}", api=api, cost=cost):
+            # The user's bucket is reserved in arrival order: take now, then wait out the debt
+            with self._cond:
+                user_bucket = self._bucket(api, "user", user, start)
+                delay = user_bucket.delay(cost, start)
+                if deadline is not None and start + delay > deadline:
+                    raise QuotaTimeoutError(f"{api} user quota would take {delay:.0f}s")
+                user_bucket.take(cost)
+            if delay:
+                self._sleep(delay)
+            # The project's bucket goes to the highest-priority, then longest-waiting, caller
+            ticket = (level, next(self._seq))
+            with self._cond:
+                waiters = self._waiters.setdefault((api, project), [])
+                heapq.heappush(waiters, ticket)
+                try:
+                    while True:
+                        now = self._clock()
+                        bucket = self._bucket(api, "project", project, now)
+                        delay = bucket.delay(cost, now)
+                        if waiters[0] == ticket and not delay:
+                            bucket.take(cost)
+                            break
+                        wait = delay or None
+                        if deadline is not None:
+                            if now + delay >= deadline:
+                                raise QuotaTimeoutError(f"{api} project quota not available within {timeout:.0f}s")
+                            wait = min(wait or deadline - now, deadline - now)
+                        self._cond.wait(wait)
+                finally:
+                    waiters.remove(ticket)
+                    heapq.heapify(waiters)
+                    if not waiters:
+                        del self._waiters[(api, project)]
+                    self._cond.notify_all()
+        waited = self._clock() - start
+        if waited > 1.0:
+            logger.debug("Waited for Google API quota", api=api, priority=PRIORITY_NAMES.get(level, level), waited_s=round(waited, 2))
+        return waited
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """Returns the process-wide quota limiter."""
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                _limiter = QuotaLimiter()
+    return _limiter
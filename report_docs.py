@@ -0,0 +1,497 @@
+"""Google Docs publishing for Granti Aunty (the report model is built in report_model.py).
+
+Nothing in here touches Streamlit, so it can run on generation worker threads.
+Errors are raised to the caller; ``describe_google_error`` turns them into a
+message for the chat.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from googleapiclient.errors import HttpError
+
+import docs_renderer
+import google_services
+import instrumentation
+import publish_records
+import quota
+from report_model import content_hash
+
+DOCS_URL_TEMPLATE = "https://docs.google.com/document/d/{0}/edit"
+APP_PROPERTY_KEY = "grantiReportKey"
+MAX_BATCH_SIZE = 100  # Google's per-batch request limit
+MAX_CACHED_RENDER_BYTES = 32 * 1024 * 1024
+
+logger = instrumentation.get_logger("report_docs")
+
+
+_rendered = OrderedDict()  # content hash -> (batchUpdate request chunks, estimated bytes), LRU
+_rendered_bytes = 0
+_rendered_lock = threading.Lock()
+
+
+def _estimated_bytes(chunks):
+    """Rough memory held by rendered chunks: the inserted text plus a fixed size per request."""
+    return sum(len(request['insertText']['text']) if 'insertText' in request else docs_renderer.STYLE_REQUEST_BYTES
+               for requests in chunks for request in requests)
+
+
+def render_report(model, text_hash=None):
+    """The batchUpdate request chunks that render ``model`` into an empty document.
+
+    Rendered once per content hash and kept in an LRU of at most
+    ``MAX_CACHED_RENDER_BYTES``, so a retry or a repeat generation of unchanged
+    content doesn't lay the report out again. The chunks are shared: don't
+    modify them.
+    """
+    global _rendered_bytes
+    text_hash = text_hash or content_hash(model)
+    with _rendered_lock:
+        cached = _rendered.get(text_hash)
+        if cached is not None:
+            _rendered.move_to_end(text_hash)
+            return cached[0]
+    chunks = docs_renderer.render_requests(docs_renderer.report_segments(model))
+    size = _estimated_bytes(chunks)
+    with _rendered_lock:
+        if text_hash not in _rendered and size <= MAX_CACHED_RENDER_BYTES:
+            _rendered[text_hash] = (chunks, size)
+            _rendered_bytes += size
+            while _rendered_bytes > MAX_CACHED_RENDER_BYTES:
+                _, (_, evicted_size) = _rendered.popitem(last=False)
+                _rendered_bytes -= evicted_size
+    return chunks
+
+
+def _published_result(record):
+    return {"title": record['title'], "doc_id": record['doc_id'], "url": DOCS_URL_TEMPLATE.format(record['doc_id'])}
+
+
+def published_report(session_id, quarter, model):
+    """The result of an earlier complete publish of exactly this content for the session's quarter, or None.
+
+    Makes no API calls; the report model covers the answers, the
+    previous-quarter context and the project details that appear in the report.
+    """
+    record = publish_records.get_store().get(session_id, quarter, content_hash(model))
+    return _published_result(record) if record and record['state'] == publish_records.POPULATED else None
+
+
+def _app_key(session_id, quarter, text_hash):
+    """Value stored in the Drive file's appProperties so an attempt's file can be found again."""
+    return hashlib.sha256(f"{session_id}:{quarter}:{text_hash}".encode('utf-8')).hexdigest()[:40]
+
+
+def _find_docs_by_key(credentials, service_drive, app_key):
+    query = f"appProperties has {{ key='{APP_PROPERTY_KEY}' and value='{app_key}' }} and trashed = false"
+    response = google_services.execute(service_drive.files().list(q=query, fields='files(id)', spaces='drive'), credentials)
+    return [f['id'] for f in response.get('files', [])]
+
+
+def _document_body_end(credentials, service_docs, doc_id):
+    doc = google_services.execute(service_docs.documents().get(documentId=doc_id, fields='body(content(endIndex))'), credentials)
+    content = doc.get('body', {}).get('content', [])
+    return content[-1].get('endIndex', 2) if content else 2
+
+
+def _send_chunks(credentials, service_docs, doc_id, chunks, clear_to=None):
+    """Sends rendered batchUpdate chunks in order, first clearing the body up to ``clear_to`` if given."""
+    chunks = list(chunks)
+    if chunks and clear_to and clear_to > 2:
+        # Rendering over partial content: clear the body first (the final newline can't be deleted)
+        chunks[0] = [{'deleteContentRange': {'range': {'startIndex': 1, 'endIndex': clear_to - 1}}}] + chunks[0]
+    for requests in chunks:
+        with instrumentation.span("docs.batch_update", doc_id=doc_id, requests=requests):
+            google_services.execute(service_docs.documents().batchUpdate(documentId=doc_id, body={'requests': requests}), credentials, idempotent=False)
+
+
+def _populate(credentials, service_docs, doc_id, model, clear_to=None, text_hash=None):
+    """Renders the model into the document, in one batchUpdate unless it is too large for one request.
+
+    A batchUpdate isn't idempotent, so one that may have been applied (a 5xx
+    or a lost response) is never resent as is. The body is read again and the
+    whole report re-rendered over it, like a resumed publish.
+    """
+    chunks = render_report(model, text_hash)
+    attempts = []
+
+    def attempt():
+        body_end = _document_body_end(credentials, service_docs, doc_id) if attempts else clear_to
+        attempts.append(body_end)
+        _send_chunks(credentials, service_docs, doc_id, chunks, body_end)
+    google_services.with_retries(attempt)
+    logger.debug("Populated doc", doc_id=doc_id, batch_updates=len(chunks), attempts=len(attempts))
+
+
+def _delete_file(credentials, service_drive, doc_id):
+    try:
+        google_services.execute(service_drive.files().delete(fileId=doc_id), credentials)
+        logger.debug("Deleted orphaned draft", doc_id=doc_id)
+        return True
+    except HttpError as e:
+        if e.resp.status == 404:
+            return True
+        logger.warn("Could not delete orphaned draft", doc_id=doc_id, error=e)
+        return False
+
+
+def cleanup_orphans(credentials, session_id, quarter, keep_hash, keep_doc_id=None):
+    """Deletes drafts this app created for a session/quarter that will never be completed.
+
+    That covers unfinished attempts for earlier content and duplicates of the
+    kept document left by a create retried after a lost response.
+    """
+    records = publish_records.get_store()
+    service_drive = google_services.get_service('drive', 'v3', credentials)
+    for record in records.unfinished(session_id, quarter, exclude_hash=keep_hash):
+        doc_ids = [record['doc_id']] if record['doc_id'] else _find_docs_by_key(credentials, service_drive, _app_key(session_id, quarter, record['content_hash']))
+        if all([_delete_file(credentials, service_drive, doc_id) for doc_id in doc_ids]):
+            records.delete(session_id, quarter, record['content_hash'])
+    if keep_doc_id:
+        for doc_id in _find_docs_by_key(credentials, service_drive, _app_key(session_id, quarter, keep_hash)):
+            if doc_id != keep_doc_id:
+                _delete_file(credentials, service_drive, doc_id)
+
+
+def _create_doc(credentials, service_drive, title, app_key, resuming):
+    """Creates the Drive file for an attempt, or finds the one an interrupted earlier attempt created."""
+    if resuming:
+        existing = _find_docs_by_key(credentials, service_drive, app_key)
+        if existing:
+            logger.debug("Resuming with previously created doc", doc_id=existing[0])
+            return existing[0]
+    # --- Create Document using Drive API first (often more reliable for creation) ---
+    file_metadata = {
+        'name': title,
+        'mimeType': 'application/vnd.google-apps.document',
+        'appProperties': {APP_PROPERTY_KEY: app_key},
+    }
+    with instrumentation.span("drive.create"):
+        created_file = google_services.execute(service_drive.files().create(body=file_metadata, fields='id'), credentials)
+    doc_id = created_file.get('id')
+    if not doc_id:
+        raise RuntimeError("Failed to create Google Doc: No document ID returned from Drive API.")
+    logger.debug("Google Doc created via Drive API", doc_id=doc_id)
+    return doc_id
+
+
+def publish_report(credentials, title, model, session_id, quarter):
+    """Creates a Google Doc via Drive and renders the report model into it. Returns title, doc id and URL.
+
+    Idempotent per (session, quarter, content): a retry after a failure resumes
+    the document the earlier attempt created, and a repeat after success
+    returns the finished document without any API calls.
+    """
+    logger.debug("Publishing report", session_id=session_id, quarter=quarter)
+    records = publish_records.get_store()
+    text_hash = content_hash(model)
+    record = records.get(session_id, quarter, text_hash)
+    if record and record['state'] == publish_records.POPULATED:
+        logger.debug("Report already published", doc_id=record['doc_id'])
+        return _published_result(record)
+
+    service_docs = google_services.get_service('docs', 'v1', credentials)
+    service_drive = google_services.get_service('drive', 'v3', credentials)
+    if record:
+        title = record['title']
+    else:
+        records.put(session_id, quarter, text_hash, title, publish_records.CREATING)
+
+    doc_id = record and record['doc_id']
+    clear_to = None
+    if doc_id:
+        clear_to = _document_body_end(credentials, service_docs, doc_id)
+    else:
+        doc_id = _create_doc(credentials, service_drive, title, _app_key(session_id, quarter, text_hash), resuming=record is not None)
+        records.put(session_id, quarter, text_hash, title, publish_records.CREATED, doc_id)
+
+    # --- Now populate the created document using Docs API ---
+    _populate(credentials, service_docs, doc_id, model, clear_to, text_hash)
+    records.put(session_id, quarter, text_hash, title, publish_records.POPULATED, doc_id)
+
+    try:
+        cleanup_orphans(credentials, session_id, quarter, text_hash, keep_doc_id=doc_id)
+    except Exception as e:
+        logger.warn("Orphan cleanup failed", error=e)
+    return {"title": title, "doc_id": doc_id, "url": DOCS_URL_TEMPLATE.format(doc_id)}
+
+
+def describe_google_error(error):
+    """Returns a user-facing description of an exception raised while publishing."""
+    if isinstance(error, HttpError):
+        error_details_bytes = getattr(error, 'content', None) or b'{}'
+        error_details_str = error_details_bytes.decode('utf-8', errors='ignore')
+        logger.error("Google API error", status=error.resp.status, details=error_details_str)
+        try:
+            google_error_message = json.loads(error_details_str).get('error', {}).get('message', 'No specific message found in JSON.')
+        except Exception as parse_error:
+            logger.warn("Could not parse Google error details as JSON", error=parse_error)
+            google_error_message = error_details_str
+        return f"Google API Error during document operation (HTTP {error.resp.status}): {google_error_message}"
+    logger.error("Unexpected error during document creation", error=error)  # The traceback was logged when the job failed
+    return f"Unexpected error during document creation: {error}"
+
+
+def _run_batch(service, credentials, request_factories, idempotent=True):
+    """Runs ``{request_id: factory}`` as batch requests, retrying retryable per-request failures.
+
+    With ``idempotent=False`` only failures that certainly weren't applied are
+    retried (see ``google_services.is_retryable``), and a batch whose response
+    was lost reports all of its requests as failed with that error.
+    Returns ``(responses, errors)`` keyed by request ID.
+    """
+    responses, errors = {}, {}
+    pending = dict(request_factories)
+    for attempt in range(google_services.MAX_RETRIES + 1):
+        retry = {}
+
+        def callback(request_id, response, exception):
+            if exception is None:
+                responses[request_id] = response
+                errors.pop(request_id, None)
+            else:
+                errors[request_id] = exception
+                if google_services.is_retryable(exception, idempotent):
+                    retry[request_id] = pending[request_id]
+
+        ids = list(pending)
+        for start in range(0, len(ids), MAX_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for request_id in ids[start:start + MAX_BATCH_SIZE]:
+                batch.add(pending[request_id](), request_id=request_id)
+            try:
+                google_services.execute(batch, credentials, idempotent=idempotent)
+            except Exception as e:
+                if idempotent or not google_services.is_retryable(e):
+                    raise
+                for request_id in ids[start:start + MAX_BATCH_SIZE]:
+                    errors[request_id] = e
+        if not retry or attempt == google_services.MAX_RETRIES:
+            break
+        delay = max(google_services.backoff_delay(attempt, errors[rid]) for rid in retry)
+        logger.warn("Batched requests failed; retrying", failed=len(retry), delay_s=round(delay, 1))
+        time.sleep(delay)
+        pending = retry
+    return responses, errors
+
+
+def publish_reports_batch(credentials, reports, session_id):
+    """Publishes several quarters at once. ``reports`` maps quarter -> (title, model).
+
+    All Drive creates go out in one batch request and all Docs populations in a
+    second one, so N quarters cost two round trips instead of 2N. Quarters
+    already (partly) published by an earlier attempt are resumed like
+    ``publish_report`` does. Returns quarter -> result dict (as from
+    ``publish_report``) or ``{"title", "error"}``. Its API calls queue for quota
+    behind interactive generations.
+    """
+    with quota.priority(quota.BULK):
+        return _publish_reports_batch(credentials, reports, session_id)
+
+
+def _publish_reports_batch(credentials, reports, session_id):
+    logger.debug("Publishing reports in a batch", session_id=session_id, quarters=sorted(reports))
+    records = publish_records.get_store()
+    service_docs = google_services.get_service('docs', 'v1', credentials)
+    service_drive = google_services.get_service('drive', 'v3', credentials)
+    results = {}
+    to_create, to_populate = {}, {}
+
+    for quarter, (title, model) in reports.items():
+        text_hash = content_hash(model)
+        record = records.get(session_id, quarter, text_hash)
+        if record and record['state'] == publish_records.POPULATED:
+            results[quarter] = _published_result(record)
+        elif record:
+            # Rare: an earlier attempt was interrupted; resume this quarter on its own
+            try:
+                results[quarter] = publish_report(credentials, title, model, session_id, quarter)
+            except Exception as e:
+                results[quarter] = {"title": record['title'], "error": e}
+        else:
+            records.put(session_id, quarter, text_hash, title, publish_records.CREATING)
+            to_create[quarter] = (title, text_hash)
+
+    if to_create:
+        def create_request(quarter):
+            title, text_hash = to_create[quarter]
+            file_metadata = {
+                'name': title,
+                'mimeType': 'application/vnd.google-apps.document',
+                'appProperties': {APP_PROPERTY_KEY: _app_key(session_id, quarter, text_hash)},
+            }
+            return lambda: service_drive.files().create(body=file_metadata, fields='id')
+
+        with instrumentation.span("drive.create", batch=len(to_create)):
+            responses, errors = _run_batch(service_drive, credentials, {str(q): create_request(q) for q in to_create})
+        for quarter, (title, text_hash) in to_create.items():
+            doc_id = responses.get(str(quarter), {}).get('id')
+            if doc_id:
+                records.put(session_id, quarter, text_hash, title, publish_records.CREATED, doc_id)
+                to_populate[quarter] = doc_id
+            else:
+                results[quarter] = {"title": title, "error": errors.get(str(quarter)) or RuntimeError("Failed to create Google Doc: No document ID returned from Drive API.")}
+        logger.debug("Drive batch created docs", quarters=sorted(to_populate))
+
+    if to_populate:
+        rendered = {q: render_report(reports[q][1], to_create[q][1]) for q in to_populate}
+
+        def populate_request(quarter):
+            requests = rendered[quarter][0]
+            return lambda: service_docs.documents().batchUpdate(documentId=to_populate[quarter], body={'requests': requests})
+
+        with instrumentation.span("docs.batch_update", batch=len(to_populate)):
+            responses, errors = _run_batch(service_docs, credentials, {str(q): populate_request(q) for q in to_populate}, idempotent=False)
+        for quarter, doc_id in to_populate.items():
+            title, text_hash = to_create[quarter]
+            error = None
+            if str(quarter) in responses:
+                try:
+                    # Reports too large for one request: send the remaining chunks in order
+                    _send_chunks(credentials, service_docs, doc_id, rendered[quarter][1:])
+                except Exception as e:
+                    error = e
+            else:
+                error = errors.get(str(quarter)) or RuntimeError("No response to the batched document update.")
+            if error is not None and google_services.is_retryable(error):
+                # The failed update may have been applied: re-render the whole report over the body, like a resumed publish
+                try:
+                    _populate(credentials, service_docs, doc_id, reports[quarter][1], _document_body_end(credentials, service_docs, doc_id), text_hash)
+                    error = None
+                except Exception as e:
+                    error = e
+            if error is not None:
+                results[quarter] = {"title": title, "doc_id": doc_id, "error": error}
+                continue
+            records.put(session_id, quarter, text_hash, title, publish_records.POPULATED, doc_id)
+            results[quarter] = {"title": title, "doc_id": doc_id, "url": DOCS_URL_TEMPLATE.format(doc_id)}
+        logger.debug("Docs batch populated quarters", quarters=sorted(q for q in to_populate if 'url' in results[q]))
+
+    for quarter, result in results.items():
+        if 'url' in result:
+            try:
+                cleanup_orphans(credentials, session_id, quarter, content_hash(reports[quarter][1]), keep_doc_id=result['doc_id'])
+            except Exception as e:
+                logger.warn("Orphan cleanup failed", quarter=quarter, error=e)
+    return dict(sorted(results.items()))
+
+
+# --- In-place Updates ---
+def _text_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _read_paragraphs(credentials, service_docs, doc_id):
+    """Fetches the document once and returns its body paragraphs as ``(start, end, text, named_style)``."""
+    fields = 'body(content(startIndex,endIndex,paragraph(paragraphStyle(namedStyleType),elements(textRun(content)))))'
+    doc = google_services.execute(service_docs.documents().get(documentId=doc_id, fields=fields), credentials)
+    paragraphs = []
+    for element in doc.get('body', {}).get('content', []):
+        if 'paragraph' not in element: continue
+        paragraph = element['paragraph']
+        text = "".join(e.get('textRun', {}).get('content', '') for e in paragraph.get('elements', []))
+        style = paragraph.get('paragraphStyle', {}).get('namedStyleType', docs_renderer.NORMAL_TEXT)
+        paragraphs.append((element.get('startIndex', 0), element['endIndex'], text, style))
+    return paragraphs
+
+
+def _locate_sections(paragraphs, sections):
+    """Maps each section key to the ``(start, end, text)`` of its body in the document, or returns None.
+
+    A body runs from the end of the section's heading to the start of the next
+    heading (or of the footer, for the last section).
+    """
+    boundaries = []
+    search_from = 0
+    for section in sections:
+        i = next((i for i in range(search_from, len(paragraphs)) if paragraphs[i][3] == docs_renderer.HEADING_2 and paragraphs[i][2] == section['title'] + "\n"), None)
+        if i is None:
+            return None
+        boundaries.append((section['key'], i))
+        search_from = i + 1
+    footer = next((i for i in range(search_from, len(paragraphs)) if paragraphs[i][2] == docs_renderer.FOOTER_TEXT + "\n"), None)
+    if footer is None:
+        return None
+    located = {}
+    for n, (key, i) in enumerate(boundaries):
+        j = boundaries[n + 1][1] if n + 1 < len(boundaries) else footer
+        located[key] = (paragraphs[i][1], paragraphs[j][0], "".join(p[2] for p in paragraphs[i + 1:j]))
+    return located
+
+
+def _replace_range_requests(start, end, segments):
+    requests = []
+    if end > start:
+        requests.append({'deleteContentRange': {'range': {'startIndex': start, 'endIndex': end}}})
+    for chunk in docs_renderer.render_requests(segments, start_index=start, max_request_bytes=float('inf')):
+        requests.extend(chunk)
+    return requests
+
+
+def _changed_ranges(paragraphs, model, doc_id):
+    """``(start, end, segments)`` for every part of the document that differs from ``model``."""
+    located = _locate_sections(paragraphs, model['sections'])
+    changes = []
+    if located is None:
+        logger.warn("Document structure not recognised; replacing the whole body", doc_id=doc_id)
+        body_end = paragraphs[-1][1] - 1 if paragraphs else 1
+        changes.append((1, body_end, docs_renderer.report_segments(model)))
+        return changes
+    new_date = docs_renderer.date_segment(model)
+    date_paragraph = next((p for p in paragraphs if p[2].startswith(docs_renderer.QUARTER_END_DATE_LABEL)), None)
+    if date_paragraph and date_paragraph[2] != new_date.text:
+        changes.append((date_paragraph[0], date_paragraph[1], [new_date]))
+    for section in model['sections']:
+        start, end, current_text = located[section['key']]
+        segments = docs_renderer.section_body_segments(section)
+        if _text_hash(current_text) != _text_hash(docs_renderer.segments_text(segments)):
+            changes.append((start, end, segments))
+    return changes
+
+
+def _retag(credentials, doc_id, app_key):
+    """Points the Drive file's app key at new content, so orphan cleanup for its old content leaves it alone."""
+    service_drive = google_services.get_service('drive', 'v3', credentials)
+    google_services.execute(service_drive.files().update(fileId=doc_id, body={'appProperties': {APP_PROPERTY_KEY: app_key}}, fields='id'), credentials)
+
+
+def update_report(credentials, doc_id, title, model, session_id, quarter):
+    """Updates an existing report document in place, rewriting only the sections that changed.
+
+    The document is fetched once; each section body found in it is compared by
+    content hash with the freshly rendered one, and a single batchUpdate deletes
+    and re-renders just the changed ranges (applied back to front so earlier
+    indices stay valid). If the document no longer has the expected structure
+    its whole body is re-rendered instead. If the batchUpdate fails in a way
+    that may have been applied, the document is read and compared again, so a
+    retry never applies a change twice.
+
+    The document then belongs to the new content. Its Drive app key and its
+    publish records move from the old content hash to the new one, so
+    publishing the old content again creates a new document.
+    """
+    logger.debug("Updating report in place", doc_id=doc_id)
+    service_docs = google_services.get_service('docs', 'v1', credentials)
+    changed = []
+
+    def attempt():
+        changes = _changed_ranges(_read_paragraphs(credentials, service_docs, doc_id), model, doc_id)
+        changed.append(len(changes))
+        if not changes:
+            logger.debug("No sections changed; nothing to update", doc_id=doc_id)
+            return
+        requests = []
+        for start, end, segments in sorted(changes, key=lambda c: c[0], reverse=True):
+            requests.extend(_replace_range_requests(start, end, segments))
+        with instrumentation.span("docs.batch_update", doc_id=doc_id, requests=requests):
+            google_services.execute(service_docs.documents().batchUpdate(documentId=doc_id, body={'requests': requests}), credentials, idempotent=False)
+        if logger.enabled(instrumentation.DEBUG):  # Serialising the payload just to measure it is not free
+            logger.debug("Updated changed ranges", doc_id=doc_id, ranges=len(changes), payload_bytes=docs_renderer.payload_bytes(requests))
+    google_services.with_retries(attempt)
+    text_hash = content_hash(model)
+    _retag(credentials, doc_id, _app_key(session_id, quarter, text_hash))
+    publish_records.get_store().adopt(session_id, quarter, text_hash, title, doc_id)
+    # A retry after a lost response finds nothing left to change; report what the first attempt found
+    return {"title": title, "doc_id": doc_id, "url": DOCS_URL_TEMPLATE.format(doc_id), "changed_sections": changed[0]}
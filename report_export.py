@@ -0,0 +1,366 @@
+"""Local exports of the report model as Markdown, DOCX or PDF.
+
+The report is laid out from the same segments as the Google Doc (see
+docs_renderer.py), so every output has the same headings, labels and
+emphasis. Nothing here needs OAuth or the network. Each format is written
+paragraph by paragraph as a stream of byte chunks: ``iter_report`` yields
+them, and ``write_report`` writes them to any file-like object. DOCX is a
+streamed zip of WordprocessingML, and PDF is laid out with the built-in
+Helvetica fonts, so no extra libraries are needed.
+
+Finished exports are cached in memory by the model's content hash and
+format. Downloading an unchanged report again replays the cached chunks.
+"""
+import itertools
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+
+import docs_renderer
+import instrumentation
+from report_model import content_hash
+
+CHUNK_BYTES = 64 * 1024
+MAX_CACHED_BYTES = 32 * 1024 * 1024
+
+logger = instrumentation.get_logger("report_export")
+
+
+class _Paragraph:
+    """A paragraph of the export: its style and ``(text, bold, italic)`` runs."""
+    __slots__ = ("style", "runs")
+
+    def __init__(self, style):
+        self.style = style
+        self.runs = []
+
+    @property
+    def text(self):
+        return "".join(text for text, _, _ in self.runs)
+
+
+def report_paragraphs(model):
+    """Yields the report as ``_Paragraph``s, one per line of the segments' text."""
+    paragraph = None
+    for segment in docs_renderer.report_segments(model):
+        text = segment.text
+        position = 0
+        while position < len(text):
+            if paragraph is None:
+                paragraph = _Paragraph(segment.style)
+            newline = text.find("\n", position)
+            end = newline if newline != -1 else len(text)
+            # Split the line where the segment's bold/italic runs start and stop
+            cuts = sorted({position, end} | {b for s, e, _ in segment.runs for b in (s, e) if position < b < end})
+            for start, stop in zip(cuts, cuts[1:]):
+                style = {}
+                for s, e, text_style in segment.runs:
+                    if s <= start and stop <= e:
+                        style.update(text_style)
+                paragraph.runs.append((text[start:stop], bool(style.get('bold')), bool(style.get('italic'))))
+            if newline == -1:
+                break  # A long paragraph split across segments (docs_renderer._split_long) goes on in the next one
+            yield paragraph
+            paragraph = None
+            position = newline + 1
+    if paragraph is not None:
+        yield paragraph
+
+
+# --- Markdown ---
+_MARKDOWN_PREFIX = {docs_renderer.HEADING_1: "# ", docs_renderer.HEADING_2: "## "}
+
+
+def _markdown_run(text, bold, italic):
+    stripped = text.strip()
+    if not stripped or not (bold or italic):
+        return text
+    marker = ("**" if bold else "") + ("_" if italic else "")
+    # Markers have to hug the text, so surrounding spaces stay outside them
+    lead, trail = text[:len(text) - len(text.lstrip())], text[len(text.rstrip()):]
+    return f"{lead}{marker}{stripped}{marker[::-1]}{trail}"
+
+
+def render_markdown(model):
+    for paragraph in report_paragraphs(model):
+        prefix = _MARKDOWN_PREFIX.get(paragraph.style)
+        if prefix:
+            line = prefix + paragraph.text  # Headings are bold already
+        else:
+            line = "".join(_markdown_run(*run) for run in paragraph.runs)
+        yield (line + "\n\n").encode('utf-8')
+
+
+# --- DOCX ---
+_DOCX_STYLE_IDS = {docs_renderer.HEADING_1: "Heading1", docs_renderer.HEADING_2: "Heading2"}
+_DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>')
+_DOCX_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+    '</Relationships>')
+_DOCX_DOCUMENT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+    '</Relationships>')
+_DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/>'
+    '<w:pPr><w:spacing w:after="120"/></w:pPr><w:rPr><w:sz w:val="22"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:spacing w:before="240"/><w:outlineLvl w:val="0"/></w:pPr><w:rPr><w:b/><w:sz w:val="36"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/><w:basedOn w:val="Normal"/>'
+    '<w:pPr><w:keepNext/><w:spacing w:before="200"/><w:outlineLvl w:val="1"/></w:pPr><w:rPr><w:b/><w:sz w:val="28"/></w:rPr></w:style>'
+    '</w:styles>')
+_DOCX_DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>')
+_DOCX_DOCUMENT_END = '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/></w:sectPr></w:body></w:document>'
+
+
+def _docx_paragraph(paragraph):
+    parts = ["<w:p>"]
+    style_id = _DOCX_STYLE_IDS.get(paragraph.style)
+    if style_id:
+        parts.append(f'<w:pPr><w:pStyle w:val="{style_id}"/></w:pPr>')
+    for text, bold, italic in paragraph.runs:
+        props = ("<w:b/>" if bold else "") + ("<w:i/>" if italic else "")
+        parts.append(f'<w:r>{f"<w:rPr>{props}</w:rPr>" if props else ""}<w:t xml:space="preserve">{escape(text)}</w:t></w:r>')
+    parts.append("</w:p>")
+    return "".join(parts)
+
+
+class _ChunkSink:
+    """A write-only stream that hands back what was written since the last ``drain``."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def render_docx(model):
+    sink = _ChunkSink()
+    # zipfile writes data descriptors instead of seeking back when the stream can't seek
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("[Content_Types].xml", _DOCX_CONTENT_TYPES)
+        archive.writestr("_rels/.rels", _DOCX_RELS)
+        archive.writestr("word/_rels/document.xml.rels", _DOCX_DOCUMENT_RELS)
+        archive.writestr("word/styles.xml", _DOCX_STYLES)
+        with archive.open("word/document.xml", "w") as document:
+            document.write(_DOCX_DOCUMENT_START.encode('utf-8'))
+            for paragraph in report_paragraphs(model):
+                document.write(_docx_paragraph(paragraph).encode('utf-8'))
+                data = sink.drain()
+                if data:
+                    yield data
+            document.write(_DOCX_DOCUMENT_END.encode('utf-8'))
+    yield sink.drain()
+
+
+# --- PDF ---
+PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT = 595, 842  # A4 in points
+PDF_MARGIN = 56
+PDF_FONT_SIZES = {docs_renderer.HEADING_1: 18, docs_renderer.HEADING_2: 14, docs_renderer.NORMAL_TEXT: 11}
+PDF_LINE_SPACING = 1.3
+# Resource names of the base-14 Helvetica faces by (bold, italic)
+_PDF_FONTS = {(False, False): ("F1", "Helvetica"), (True, False): ("F2", "Helvetica-Bold"),
+              (False, True): ("F3", "Helvetica-Oblique"), (True, True): ("F4", "Helvetica-BoldOblique")}
+# Helvetica advance widths (1/1000 em) for ASCII 32-126; other characters use DEFAULT_WIDTH
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584]
+_DEFAULT_WIDTH = 556
+_BOLD_WIDTH_FACTOR = 1.06  # Helvetica-Bold is slightly wider; close enough for line breaking
+
+
+def _text_width(text, size, bold):
+    units = sum(_HELVETICA_WIDTHS[ord(ch) - 32] if 32 <= ord(ch) < 127 else _DEFAULT_WIDTH for ch in text)
+    return units * size / 1000 * (_BOLD_WIDTH_FACTOR if bold else 1.0)
+
+
+def _pdf_string(text):
+    # The standard fonts use WinAnsiEncoding; anything outside it becomes "?"
+    data = text.encode('cp1252', errors='replace')
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _pdf_lines(paragraph, width):
+    """Word-wraps a paragraph into lines of ``(text, bold, italic)`` runs."""
+    size = PDF_FONT_SIZES.get(paragraph.style, PDF_FONT_SIZES[docs_renderer.NORMAL_TEXT])
+    heading = paragraph.style != docs_renderer.NORMAL_TEXT
+    lines, line, line_width = [], [], 0.0
+    for text, bold, italic in paragraph.runs:
+        bold = bold or heading
+        words = text.replace("\t", " ").split(" ")
+        for i, word in enumerate(words):
+            if i < len(words) - 1:
+                word += " "
+            if not word:
+                continue
+            word_width = _text_width(word, size, bold)
+            if line and line_width + _text_width(word.rstrip(" "), size, bold) > width:
+                lines.append(line)
+                line, line_width = [], 0.0
+            line.append((word, bold, italic))
+            line_width += word_width
+    lines.append(line)
+    return size, lines
+
+
+def render_pdf(model):
+    width = PDF_PAGE_WIDTH - 2 * PDF_MARGIN
+    offsets = {}
+    position = 0
+    page_ids = []
+
+    def obj(number, body):
+        nonlocal position
+        offsets[number] = position
+        data = f"{number} 0 obj\n".encode('latin-1') + body + b"\nendobj\n"
+        position += len(data)
+        return data
+
+    header = b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n"
+    position = len(header)
+    out = [header, obj(1, b"<< /Type /Catalog /Pages 2 0 R >>")]
+    for number, (name, base_font) in enumerate(_PDF_FONTS.values(), start=3):
+        out.append(obj(number, f"<< /Type /Font /Subtype /Type1 /BaseFont /{base_font} /Encoding /WinAnsiEncoding >>".encode('latin-1')))
+    yield b"".join(out)
+    fonts = " ".join(f"/{name} {number} 0 R" for number, (name, _) in enumerate(_PDF_FONTS.values(), start=3))
+    next_id = 3 + len(_PDF_FONTS)
+
+    def page(content):
+        nonlocal next_id
+        stream = zlib.compress(b"".join(content))
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        page_ids.append(page_id)
+        return obj(content_id, f"<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n".encode('latin-1') + stream + b"\nendstream") + \
+            obj(page_id, f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PDF_PAGE_WIDTH} {PDF_PAGE_HEIGHT}] "
+                         f"/Contents {content_id} 0 R /Resources << /Font << {fonts} >> >> >>".encode('latin-1'))
+
+    content, y = [], PDF_PAGE_HEIGHT - PDF_MARGIN
+    for paragraph in report_paragraphs(model):
+        size, lines = _pdf_lines(paragraph, width)
+        leading = size * PDF_LINE_SPACING
+        if paragraph.style != docs_renderer.NORMAL_TEXT:
+            y -= size * 0.6  # Space above headings
+        for line in lines:
+            if y - leading < PDF_MARGIN:
+                yield page(content)
+                content, y = [], PDF_PAGE_HEIGHT - PDF_MARGIN
+            y -= leading
+            parts = [f"BT {PDF_MARGIN} {y:.2f} Td ".encode('latin-1')]
+            for face, words in itertools.groupby(line, key=lambda word: word[1:]):
+                text = "".join(word[0] for word in words)
+                parts.append(f"/{_PDF_FONTS[face][0]} {size} Tf ".encode('latin-1') + _pdf_string(text) + b" Tj ")
+            parts.append(b"ET\n")
+            content.append(b"".join(parts))
+        y -= size * 0.4  # Space between paragraphs
+    yield page(content)
+
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    pages = obj(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode('latin-1'))
+    xref_at = position
+    size = max(offsets) + 1
+    xref = [f"xref\n0 {size}\n0000000000 65535 f \n"]
+    xref.extend(f"{offsets[number]:010d} 00000 n \n" if number in offsets else "0000000000 65535 f \n" for number in range(1, size))
+    xref.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_at}\n%%EOF\n")
+    yield pages + "".join(xref).encode('latin-1')
+
+
+FORMATS = {
+    "md": {"label": "Markdown", "extension": "md", "mime": "text/markdown", "render": render_markdown},
+    "docx": {"label": "Word (DOCX)", "extension": "docx", "mime": "application/vnd.openxmlformats-officedocument.wordprocessingml.document", "render": render_docx},
+    "pdf": {"label": "PDF", "extension": "pdf", "mime": "application/pdf", "render": render_pdf},
+}
+
+
+def export_filename(model, fmt):
+    return f"Innovate UK Q{model['quarter']} Report - {model['project_number']}.{FORMATS[fmt]['extension']}"
+
+
+# --- Cache ---
+_cache = OrderedDict()  # (content hash, format) -> list of chunks, LRU
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+
+
+def _coalesce(chunks):
+    buffer, size = [], 0
+    for chunk in chunks:
+        buffer.append(chunk)
+        size += len(chunk)
+        if size >= CHUNK_BYTES:
+            yield b"".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield b"".join(buffer)
+
+
+def iter_report(model, fmt):
+    """Yields the report in ``fmt`` ("md", "docx" or "pdf") as byte chunks, from the cache if it was exported before."""
+    global _cache_bytes
+    render = FORMATS[fmt]["render"]
+    key = (content_hash(model), fmt)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+    if cached is not None:
+        yield from cached
+        return
+    chunks = []
+    with instrumentation.span("export.render", format=fmt):
+        for chunk in _coalesce(render(model)):
+            chunks.append(chunk)
+            yield chunk
+    total = sum(len(c) for c in chunks)
+    logger.debug("Exported report", quarter=model['quarter'], format=fmt, bytes=total)
+    with _cache_lock:
+        if key not in _cache and total <= MAX_CACHED_BYTES:
+            _cache[key] = chunks
+            _cache_bytes += total
+            while _cache_bytes > MAX_CACHED_BYTES:
+                _, evicted = _cache.popitem(last=False)
+                _cache_bytes -= sum(len(c) for c in evicted)
+
+
+def write_report(model, fmt, out):
+    """Streams the report into the file-like ``out``. Returns the number of bytes written."""
+    written = 0
+    for chunk in iter_report(model, fmt):
+        out.write(chunk)
+        written += len(chunk)
+    return written
+
+
+def export(model, fmt):
+    """The whole report in ``fmt`` as bytes."""
+    return b"".join(iter_report(model, fmt))
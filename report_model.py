@@ -0,0 +1,56 @@
+"""The report model: plain data for one quarter's report, shared by every output.
+
+Google Docs publishing (report_docs.py) and local exports (report_export.py)
+both render from this model, and ``content_hash`` identifies a model's content
+for idempotent publishing and export caching.
+"""
+import hashlib
+import json
+from datetime import datetime
+
+import quarter_history
+
+
+def contexts_from_answers(quarter_number, all_answers, section_keys):
+    """``{section: (source quarter, snippet)}`` from the latest earlier quarter in ``{quarter: {section: answer}}``.
+
+    For callers without a quarter history (see quarter_history.py), which gives the same result.
+    """
+    contexts = {}
+    for key in section_keys:
+        earlier = [q for q, answers in all_answers.items() if q < quarter_number and answers.get(key)]
+        if earlier:
+            source = max(earlier)
+            contexts[key] = (source, quarter_history.snippet(all_answers[source][key]))
+    return contexts
+
+
+def build_report_model(project_details, section_keys, quarter_number, answers, contexts):
+    """Builds the report model (plain data) for a quarter.
+
+    ``contexts`` maps sections to ``(source quarter, snippet)`` of the latest
+    earlier answer (see ``QuarterHistory.report_context``).
+    """
+    sections = []
+    for key in section_keys:
+        if key == "quarter_end_date": continue
+        context = None
+        if key in contexts:
+            source_quarter, answer_snippet = contexts[key]
+            context = f"(Context: Your answer for Q{source_quarter} was: '{answer_snippet}')"
+        sections.append({"key": key, "title": key.replace('_', ' ').title(), "content": answers.get(key), "context": context})
+    return {
+        "quarter": quarter_number,
+        "project_title": project_details['Project title'],
+        "project_number": project_details['Project Number'],
+        "quarter_end_date": answers.get('quarter_end_date', 'N/A'),
+        "sections": sections,
+    }
+
+
+def report_title(project_details, quarter_number):
+    return f"Innovate UK Q{quarter_number} Report - {project_details['Project Number']} - Draft {datetime.now().strftime('%Y%m%d_%H%M')}"
+
+
+def content_hash(model):
+    return hashlib.sha256(json.dumps(model, sort_keys=True).encode('utf-8')).hexdigest()
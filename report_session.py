@@ -0,0 +1,298 @@
+"""Headless report conversation engine.
+
+``ReportSession`` runs the chat flow (pick a quarter, upload the grant
+application, answer each section, confirm, generate) without any UI.
+Transitions are listed in ``TRANSITIONS`` as ``(stage, event) -> handler``.
+Handlers return the bot's reply and move the session to its next stage.
+Answers and documents go through injected backends, and the document
+backend decides how and where documents are actually published. This means
+the engine can be driven from the Streamlit view (app.py), from tests or
+from load generators.
+"""
+import generation_jobs
+import instrumentation
+import quarter_history
+
+# Stages
+START = "start"
+REQUEST_GRANT_APP = "request_grant_app"
+ASK_SECTION = "ask_section"
+CONFIRM_GENERATE = "confirm_generate"
+GENERATING = "generating"
+DONE = "done"
+
+# Events
+MESSAGE = "message"  # The user sent a chat message (payload: text)
+GRANT_APP_UPLOADED = "grant_app_uploaded"  # payload: {"name", "size", "type", "sha256"}
+JOB_FINISHED = "job_finished"  # payload: the finished generation_jobs.GenerationJob (None if it was lost)
+
+TRANSITIONS = {
+    (START, MESSAGE): "_choose_quarter",
+    (REQUEST_GRANT_APP, MESSAGE): "_remind_grant_app",
+    (REQUEST_GRANT_APP, GRANT_APP_UPLOADED): "_grant_app_received",
+    (ASK_SECTION, MESSAGE): "_answer_section",
+    (CONFIRM_GENERATE, MESSAGE): "_confirm_generate",
+    (GENERATING, MESSAGE): "_still_generating",
+    (GENERATING, JOB_FINISHED): "_job_finished",
+    (DONE, MESSAGE): "_restart",
+}
+
+CONFIRM_WORDS = frozenset(["yes", "y", "ok", "generate", "confirm"])
+UPDATE_WORDS = frozenset(["update", "update draft", "update existing"])
+ALL_WORDS = frozenset(["all", "generate all", "all quarters"])
+UPLOAD_REMINDER_SECTIONS = frozenset(["time", "risk_management", "cost"])
+AUTH_NEEDED_TEXT = "Authentication needed. Please use the 'Login with Google' button in the sidebar and complete the authorization steps first."
+
+logger = instrumentation.get_logger("report_session")
+
+
+class SessionState:
+    """Everything a conversation needs to carry between turns."""
+    __slots__ = ("stage", "quarter", "section_index", "generation_job_id", "quarter_docs", "grant_app", "messages")
+
+    # Slot -> autosave key (see autosave.py); the keys predate this class
+    SNAPSHOT_KEYS = {
+        "stage": "stage",
+        "quarter": "current_quarter",
+        "section_index": "current_section_index",
+        "generation_job_id": "generation_job_id",
+        "quarter_docs": "quarter_docs",
+        "grant_app": "grant_app_info",
+    }
+
+    def __init__(self, messages=None):
+        self.stage = START
+        self.quarter = None
+        self.section_index = 0
+        self.generation_job_id = None
+        self.quarter_docs = {}  # {quarter: {"doc_id", "title"}}, used for in-place updates
+        self.grant_app = None
+        self.messages = messages if messages is not None else []
+
+    def snapshot(self):
+        return {key: getattr(self, slot) for slot, key in self.SNAPSHOT_KEYS.items()}
+
+    @classmethod
+    def from_snapshot(cls, values, messages):
+        state = cls(list(messages))
+        for slot, key in cls.SNAPSHOT_KEYS.items():
+            if key in values:
+                setattr(state, slot, values[key])
+        # JSON turns the quarter keys into strings
+        state.quarter_docs = {int(q): doc for q, doc in (state.quarter_docs or {}).items()}
+        return state
+
+
+class NoDocuments:
+    """Document backend for sessions that can't publish (e.g. not logged in)."""
+    def authenticated(self):
+        return False
+
+    def published(self, quarter):
+        return None
+
+    def generate(self, quarter):
+        return None
+
+    def update(self, quarter, doc):
+        return None
+
+    def generate_all(self):
+        return None
+
+    def job_status(self, job_id):
+        return "unknown"
+
+    def describe_error(self, error):
+        return str(error)
+
+
+class ReportSession:
+    """Drives one conversation.
+
+    ``answers`` needs ``save_answer`` and ``get_answer`` (see answer_store.py).
+    ``documents`` needs the methods of ``NoDocuments``: ``generate``,
+    ``update`` and ``generate_all`` return the queued job, or None if it could
+    not be queued. ``published(quarter)`` returns the result of an earlier
+    publish of the quarter's current content (as a finished job's ``result``),
+    or None. ``document_context(section_key)`` returns extra prompt text
+    for a section, such as passages from the uploaded documents.
+    ``history`` gives each section's context from earlier quarters (see
+    quarter_history.py). Without it, only last quarter's answer is shown.
+    """
+    def __init__(self, state, project_details, section_keys, prompts, answers, documents=None, document_context=None,
+                 history=None):
+        self.state = state
+        self.project_details = project_details
+        self.section_keys = section_keys
+        self.prompts = prompts
+        self.answers = answers
+        self.documents = documents or NoDocuments()
+        self.document_context = document_context or (lambda section_key: "")
+        self.history = history
+        self.error = None  # Last unexpected exception raised by a handler, for the view to show
+
+    @property
+    def project_number(self):
+        return self.project_details['Project Number']
+
+    def opening_message(self):
+        return self.prompts["start"].format(self.project_details['Total Quarters'])
+
+    def send(self, text):
+        """Handles a chat message from the user. Returns the reply (also appended to the transcript)."""
+        logger.debug("User input received", stage=self.state.stage, chars=len(text))
+        self.state.messages.append({"role": "user", "content": text})
+        return self.dispatch(MESSAGE, text)
+
+    def dispatch(self, event, payload=None):
+        """Runs the handler for ``event`` in the current stage. Returns the reply, or None if there is none."""
+        stage = self.state.stage
+        handler = TRANSITIONS.get((stage, event))
+        if handler is None:
+            if event != MESSAGE:
+                logger.warn("Ignoring event", event=event, stage=stage)
+                return None
+            logger.error("Unknown stage encountered; resetting", stage=stage)
+            self.state.stage = START
+            reply = self.prompts.get("error", "Sorry, I'm in an unknown state. Let's start over.")
+        else:
+            try:
+                with instrumentation.span(f"stage.{stage}", event=event):
+                    reply = getattr(self, handler)(payload)
+            except Exception as e:
+                logger.exception("Unexpected exception in chatbot logic", stage=stage, event=event, error=e)
+                self.error = e
+                self.state.stage = START
+                reply = self.prompts.get("error", "An unexpected error occurred. Resetting.")
+        logger.debug("Event processed", stage=stage, event=event, next_stage=self.state.stage)
+        if reply:
+            self.state.messages.append({"role": "assistant", "content": reply})
+        return reply
+
+    # --- Handlers ---
+    def _choose_quarter(self, text):
+        quarter_options = list(range(1, self.project_details['Total Quarters'] + 1))
+        try:
+            quarter = int(text)
+        except ValueError:
+            return f"Please tell me which quarter number {quarter_options} you want to report on."
+        if quarter not in quarter_options:
+            return f"Please enter a valid quarter number {quarter_options} to begin."
+        self.state.quarter = quarter
+        self.state.stage = REQUEST_GRANT_APP
+        return self.prompts["request_grant_app"].format(quarter)
+
+    def _remind_grant_app(self, text):
+        return "Please use the file uploader that appeared below to upload your Grant Application PDF."
+
+    def _grant_app_received(self, info):
+        logger.debug("Grant application uploaded", name=info['name'])
+        self.state.grant_app = info
+        self.state.stage = ASK_SECTION
+        self.state.section_index = 0
+        return self.prompts["grant_app_received"].format(self.state.quarter)
+
+    def _answer_section(self, text):
+        state = self.state
+        # Persist the answer straight away
+        self.answers.save_answer(self.project_number, state.quarter, self.section_keys[state.section_index], text)
+        state.section_index += 1
+        if state.section_index >= len(self.section_keys):
+            logger.debug("All sections collected", quarter=state.quarter)
+            state.stage = CONFIRM_GENERATE
+            reply = self.prompts["ready_to_generate"].format(state.quarter)
+            if state.quarter in state.quarter_docs:
+                reply += "\n\n" + self.prompts["update_available"].format(state.quarter_docs[state.quarter]['title'])
+            return reply
+        next_key = self.section_keys[state.section_index]
+        reply = self.prompts.get(next_key, "Please provide details for the next section.")
+        context = self._earlier_context(next_key)
+        if context:
+            reply += f"\n\n*(For context, in Q{context[0]} you wrote: '{context[1]}')*"
+        reply += self.document_context(next_key)
+        if next_key in UPLOAD_REMINDER_SECTIONS:
+            reply += "\n\n" + self.prompts["upload_request"]
+        return reply
+
+    def _earlier_context(self, section_key):
+        """``(quarter, snippet)`` of the latest earlier answer to the section, or None."""
+        quarter = self.state.quarter
+        if self.history is not None:
+            return self.history.context(self.project_number, quarter, section_key)
+        if quarter > 1:
+            prev_answer = self.answers.get_answer(self.project_number, quarter - 1, section_key)
+            if prev_answer:
+                return quarter - 1, quarter_history.snippet(prev_answer)
+        return None
+
+    def _confirm_generate(self, text):
+        state = self.state
+        choice = text.lower()
+        update = choice in UPDATE_WORDS and state.quarter in state.quarter_docs
+        if not (update or choice in ALL_WORDS or choice in CONFIRM_WORDS):
+            return "Okay, I won't generate the document yet. Let me know if you change your mind or type 'yes' to generate."
+        if not self.documents.authenticated():
+            logger.debug("Credentials invalid/missing for generation")
+            return AUTH_NEEDED_TEXT
+        if update:
+            job = self.documents.update(state.quarter, state.quarter_docs[state.quarter])
+            if not job:
+                return self.prompts["error"] + " I couldn't start the update. Type 'yes' to create a new draft instead."
+            reply = "Okay, updating your existing draft with the changed sections..."
+        elif choice in ALL_WORDS:
+            job = self.documents.generate_all()
+            if not job:
+                return self.prompts["error"] + " I couldn't start the document generation. Type 'yes' to try again."
+            reply = f"Okay, generating documents for quarters {', '.join(f'Q{q}' for q in job.quarter)} together..."
+        else:
+            published = self.documents.published(state.quarter)
+            if published:
+                # Nothing changed since this content was published: hand back that draft, no job or API calls
+                logger.debug("Report unchanged since it was published", doc_id=published['doc_id'])
+                return self._published_reply(state.quarter, published)
+            job = self.documents.generate(state.quarter)
+            if not job:
+                return self.prompts["error"] + " I couldn't start the document generation. Type 'yes' to try again."
+            reply = "Okay, generating the Google Doc now... I'll post the link here as soon as it's ready."
+        state.generation_job_id = job.job_id
+        state.stage = GENERATING
+        return reply
+
+    def _still_generating(self, text):
+        job_status = self.documents.job_status(self.state.generation_job_id)
+        return f"I'm still working on your Q{self.state.quarter} document (status: {job_status}). The link will appear here when it's ready."
+
+    def _job_finished(self, job):
+        state = self.state
+        state.generation_job_id = None
+        if job and job.status == generation_jobs.DONE and isinstance(job.quarter, tuple):  # Bulk job: one result per quarter
+            lines = []
+            for quarter, result in job.result.items():
+                if 'error' in result:
+                    lines.append(f"- **Q{quarter}:** failed - {self.documents.describe_error(result['error'])}")
+                else:
+                    state.quarter_docs[quarter] = {"doc_id": result['doc_id'], "title": result['title']}
+                    lines.append(f"- **Q{quarter}:** [{result['title']}]({result['url']})")
+            state.stage = DONE
+            return "Here are your generated drafts:\n\n" + "\n".join(lines)
+        if job and job.status == generation_jobs.DONE:
+            logger.debug("Document creation successful", doc_id=job.result['doc_id'])
+            return self._published_reply(job.quarter, job.result)
+        error_detail = self.documents.describe_error(job.error) if job else "The generation job was lost (server restarted?)."
+        logger.error("Document creation failed", detail=error_detail)
+        state.stage = CONFIRM_GENERATE
+        return self.prompts["error"] + f" Failed during document creation: {error_detail}\n\nPlease check Google permissions or type 'yes' to try again."
+
+    def _published_reply(self, quarter, result):
+        self.state.quarter_docs[quarter] = {"doc_id": result['doc_id'], "title": result['title']}
+        if 'changed_sections' in result:
+            reply = self.prompts["update_complete"].format(result['title'], result['changed_sections'])
+        else:
+            reply = self.prompts["generation_complete"].format(result['title'])
+        self.state.stage = DONE
+        return reply + f"\n\n**[Open Generated Document]({result['url']})**"
+
+    def _restart(self, text):
+        self.state.stage = START
+        return "Report generation complete. You can start a new report by telling me the quarter number."
@@ -0,0 +1,186 @@
+"""In-process BM25 retrieval over a session's uploaded documents.
+
+Each session gets a ``SessionIndex``: extracted documents (see
+text_extract.py) are split into overlapping passages and merged into an
+inverted index as they arrive. After every addition the top passages for each
+report section are recomputed, so when the chat reaches a section its
+passages are a dictionary lookup. Tokenised passages are cached per document
+hash, so the same grant application is only analysed once per process.
+
+Session indexes are kept in an LRU bounded both by count
+(``MAX_SESSION_INDEXES``) and by the passages they hold in total
+(``MAX_INDEXED_PASSAGES``), so a few sessions with very large uploads can't
+grow it without limit. When an evicted session asks again, ``get_index``
+reports a new index, and app.py adds the session's uploads back into it.
+"""
+import heapq
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+
+import instrumentation
+import text_extract
+
+PASSAGE_WORDS = 120
+PASSAGE_OVERLAP_WORDS = 30
+TOP_K = 3
+BM25_K1 = 1.5
+BM25_B = 0.75
+MAX_SESSION_INDEXES = 256
+MAX_INDEXED_PASSAGES = 100000  # Across all session indexes; ~5 KB each (see benchmarks/retrieval_bench.py)
+MAX_ANALYZED_DOCUMENTS = 32
+
+logger = instrumentation.get_logger("retrieval")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset("""
+a about also an and any are as at be been by can did do does for from had has have how i in into is it
+its let me my next now of on or other our over please so such than that the their them then there these
+this to very was we were what which who will with you your
+""".split())
+
+
+def tokenize(text):
+    return [t for t in _TOKEN_RE.findall(text.lower()) if len(t) > 1 and t not in STOPWORDS]
+
+
+def _passages(pages):
+    """Splits pages into overlapping word windows: ``[(page_number, text, term_counts), ...]``."""
+    passages = []
+    step = PASSAGE_WORDS - PASSAGE_OVERLAP_WORDS
+    for page_number, page in enumerate(pages, start=1):
+        words = page.split()
+        for start in range(0, max(len(words) - PASSAGE_OVERLAP_WORDS, 1), step):
+            text = " ".join(words[start:start + PASSAGE_WORDS])
+            counts = Counter(tokenize(text))
+            if counts:
+                passages.append((page_number, text, counts))
+    return passages
+
+
+_analyzed = OrderedDict()  # sha256 -> passages, LRU
+_analyzed_lock = threading.Lock()
+
+
+def _analyzed_passages(digest):
+    with _analyzed_lock:
+        passages = _analyzed.get(digest)
+        if passages is not None:
+            _analyzed.move_to_end(digest)
+            return passages
+    pages = text_extract.get_pages(digest)
+    if pages is None:
+        return None
+    passages = _passages(pages)
+    with _analyzed_lock:
+        _analyzed[digest] = passages
+        while len(_analyzed) > MAX_ANALYZED_DOCUMENTS:
+            _analyzed.popitem(last=False)
+    return passages
+
+
+class SessionIndex:
+    def __init__(self, section_queries):
+        self._lock = threading.Lock()
+        self._section_terms = {key: Counter(tokenize(query)) for key, query in section_queries.items()}
+        self._sources = set()
+        self._passages = []  # (source_name, page_number, text)
+        self._lengths = []
+        self._total_length = 0
+        self._postings = {}  # term -> [(passage_id, term_frequency)]
+        self._section_hits = {}
+
+    def add_source(self, digest, name):
+        """Indexes an extracted document (no-op if already indexed) and refreshes the per-section passages."""
+        with self._lock:
+            if digest in self._sources:
+                return
+        passages = _analyzed_passages(digest)
+        if passages is None:
+            return
+        with self._lock:
+            if digest in self._sources:
+                return
+            self._sources.add(digest)
+            for page_number, text, counts in passages:
+                passage_id = len(self._passages)
+                self._passages.append((name, page_number, text))
+                length = sum(counts.values())
+                self._lengths.append(length)
+                self._total_length += length
+                for term, tf in counts.items():
+                    self._postings.setdefault(term, []).append((passage_id, tf))
+            self._section_hits = {key: self._search_locked(terms, TOP_K) for key, terms in self._section_terms.items()}
+        logger.debug("Indexed document", name=name, passages=len(passages), index_passages=len(self._passages))
+        _index_grew(self)
+
+    def _search_locked(self, query_terms, k):
+        n = len(self._passages)
+        if not n:
+            return []
+        avg_length = self._total_length / n
+        scores = {}
+        for term, query_tf in query_terms.items():
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for passage_id, tf in postings:
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[passage_id] / avg_length)
+                scores[passage_id] = scores.get(passage_id, 0.0) + query_tf * idf * tf * (BM25_K1 + 1) / norm
+        top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [self._passages[passage_id] + (score,) for passage_id, score in top]
+
+    def search(self, query, k=TOP_K):
+        """Returns the top ``(source_name, page_number, text, score)`` passages for a free-text query."""
+        terms = Counter(tokenize(query))
+        with self._lock:
+            return self._search_locked(terms, k)
+
+    def section_passages(self, section_key):
+        """Precomputed top passages for a report section."""
+        return self._section_hits.get(section_key, [])
+
+    @property
+    def passage_count(self):
+        return len(self._passages)
+
+    @property
+    def sources(self):
+        return frozenset(self._sources)
+
+
+_indexes = OrderedDict()  # session_id -> SessionIndex, LRU
+_indexes_lock = threading.Lock()
+
+
+def get_index(session_id, section_queries):
+    """Returns the session's index, creating it (and the second value True) if needed."""
+    with _indexes_lock:
+        index = _indexes.get(session_id)
+        created = index is None
+        if created:
+            index = _indexes[session_id] = SessionIndex(section_queries)
+            _evict_locked()
+        else:
+            _indexes.move_to_end(session_id)
+    return index, created
+
+
+def _evict_locked():
+    """Drops least recently used indexes until the LRU is within both caps, always keeping the newest one."""
+    total = sum(index.passage_count for index in _indexes.values())
+    while len(_indexes) > 1 and (len(_indexes) > MAX_SESSION_INDEXES or total > MAX_INDEXED_PASSAGES):
+        session_id, evicted = _indexes.popitem(last=False)
+        total -= evicted.passage_count
+        logger.debug("Evicted session index", session_id=session_id, passages=evicted.passage_count)
+
+
+def _index_grew(index):
+    with _indexes_lock:
+        session_id = next((key for key, value in _indexes.items() if value is index), None)
+        if session_id is None:
+            return  # Already evicted
+        _indexes.move_to_end(session_id)  # It is in use, so evict others first
+        _evict_locked()
@@ -0,0 +1,67 @@
+"""Test setup: the app's modules are imported from the repository root, with
+their data in a throwaway directory, the Google clients built from the
+discovery fixtures in fixtures/discovery (no network) and the quota limiter off."""
+import os
+import sys
+import tempfile
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+FIXTURES_DIR = os.path.join(TESTS_DIR, "fixtures")
+
+# Read by the app's modules when they are imported
+os.environ["GRANTI_DATA_DIR"] = tempfile.mkdtemp(prefix="granti-tests-")
+os.environ["GRANTI_DISCOVERY_DIR"] = os.path.join(FIXTURES_DIR, "discovery")
+os.environ["GRANTI_QUOTA"] = "0"  # Tests make bursts of calls a real user's quota wouldn't allow
+os.environ.pop("GRANTI_GOOGLE_API_ROOT", None)
+sys.path.insert(0, os.path.dirname(TESTS_DIR))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), "benchmarks"))
+
+from collections import OrderedDict  # noqa: E402
+
+import pytest  # noqa: E402
+
+SCOPES = ['https://www.googleapis.com/auth/documents', 'https://www.googleapis.com/auth/drive.file']
+
+
+@pytest.fixture
+def credentials():
+    from google.oauth2.credentials import Credentials
+    return Credentials(token="test-token", scopes=SCOPES)
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    """Retries happen straight away."""
+    import google_services
+    monkeypatch.setattr(google_services, "backoff_delay", lambda attempt, error=None: 0)
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    """Replaces the HTTP client ``google_services.execute`` uses; set ``.http`` (e.g. an HttpMockSequence) to play back responses."""
+    import google_services
+    holder = type("Transport", (), {"http": None})()
+    monkeypatch.setattr(google_services, "authorized_http", lambda credentials: holder.http)
+    return holder
+
+
+@pytest.fixture
+def records(monkeypatch):
+    """A fresh, in-memory publish record store."""
+    import publish_records
+    store = publish_records.PublishRecords(":memory:")
+    monkeypatch.setattr(publish_records, "_store", store)
+    return store
+
+
+@pytest.fixture
+def fake_google(monkeypatch, records):
+    """The fake Google server from benchmarks/fake_google.py, with the app's clients pointed at it."""
+    import google_services
+    from fake_google import FakeGoogleServer
+    server = FakeGoogleServer().start()
+    monkeypatch.setattr(google_services, "API_ROOT_OVERRIDE", server.url)
+    monkeypatch.setattr(google_services, "_discovery_docs", {})
+    monkeypatch.setattr(google_services, "_services", OrderedDict())
+    yield server
+    server.stop()
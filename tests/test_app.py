@@ -0,0 +1,51 @@
+import os
+import uuid
+
+from streamlit.testing.v1 import AppTest
+
+import autosave
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+USER_KEY = "0123456789abcdef0123456789abcdef"
+
+
+def test_uid_link_is_stripped_from_the_address_bar():
+    at = AppTest.from_file(APP_PATH, default_timeout=30)
+    at.query_params["uid"] = USER_KEY
+    at.run()
+
+    assert not at.exception
+    assert "uid" not in at.query_params
+    assert at.session_state["user_key"] == USER_KEY  # Kept for this session and moved into the cookie
+    assert any("don't share" in warning.value for warning in at.warning)
+
+
+def test_first_visit_has_no_cached_login():
+    at = AppTest.from_file(APP_PATH, default_timeout=30)
+    at.run()
+
+    assert not at.exception
+    assert at.session_state["user_key"] is None
+
+
+def test_sid_link_is_stripped_from_the_address_bar():
+    session_id = uuid.uuid4().hex
+    autosave.get_autosaver().record(session_id, {"stage": "start"}, [{"role": "user", "content": "Our secret results"}])
+    at = AppTest.from_file(APP_PATH, default_timeout=30)
+    at.query_params["sid"] = session_id
+    at.run()
+
+    assert not at.exception
+    assert "sid" not in at.query_params
+    assert at.session_state["session_id"] == session_id  # Restored, and moved into the cookie
+    assert any(m["content"] == "Our secret results" for m in at.session_state["report_state"].messages)
+    assert any("don't share" in warning.value for warning in at.warning)
+
+
+def test_new_session_id_stays_out_of_the_url():
+    at = AppTest.from_file(APP_PATH, default_timeout=30)
+    at.run()
+
+    assert not at.exception
+    assert "sid" not in at.query_params
+    assert autosave.valid_session_id(at.session_state["session_id"])
@@ -0,0 +1,108 @@
+import os
+import random
+import signal
+import subprocess
+import sys
+import time
+import uuid
+
+import pytest
+
+import autosave
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MESSAGE_CHARS = 20000  # Larger than a file buffer, so a kill can land mid-record
+
+# Appends messages until killed; in "compact" mode it also compacts the log every few records
+WRITER = """
+import os, sys
+sys.path.insert(0, {root!r})
+import autosave
+os.makedirs(autosave.SESSIONS_DIR, exist_ok=True)
+log = autosave.SessionLog({session_id!r})
+messages = []
+print("ready", flush=True)
+for i in range(5000):
+    messages.append({{"role": "user", "content": f"{{i}}:" + "x" * {chars}}})
+    log.record({{"stage": str(i)}}, messages)
+    if sys.argv[1] == "compact" and i % 5 == 4:
+        log.compact()
+"""
+
+
+def new_session_id():
+    return uuid.uuid4().hex
+
+
+def expected_message(i):
+    return {"role": "user", "content": f"{i}:" + "x" * MESSAGE_CHARS}
+
+
+def assert_prefix(messages):
+    assert messages == [expected_message(i) for i in range(len(messages))]
+
+
+def kill_writer(session_id, mode):
+    """Starts a writer process and SIGKILLs it at a random point."""
+    writer = subprocess.Popen([sys.executable, "-c", WRITER.format(root=ROOT, session_id=session_id, chars=MESSAGE_CHARS), mode],
+                              stdout=subprocess.PIPE, env=os.environ)
+    assert writer.stdout.readline() == b"ready\n"
+    time.sleep(random.uniform(0.005, 0.15))
+    writer.send_signal(signal.SIGKILL)
+    writer.wait()
+
+
+@pytest.mark.parametrize("mode", ["append", "compact"])
+def test_restore_after_a_killed_writer_returns_a_prefix(mode):
+    for _ in range(5):
+        session_id = new_session_id()
+        kill_writer(session_id, mode)
+
+        state, messages = autosave.get_autosaver().restore(session_id)
+        assert_prefix(messages)
+
+        # The log can be reopened (dropping any torn record) and written to again
+        log = autosave.SessionLog(session_id)
+        log.record(state, messages + [expected_message(len(messages))])
+        log.close()
+        assert_prefix(autosave.get_autosaver().restore(session_id)[1])
+        assert len(autosave.get_autosaver().restore(session_id)[1]) == len(messages) + 1
+
+
+def test_restore_of_a_log_cut_at_any_byte_returns_a_prefix(tmp_path):
+    session_id = new_session_id()
+    log = autosave.SessionLog(session_id)
+    messages = []
+    for i in range(4):
+        messages.append({"role": "user", "content": f"message {i} ✓"})
+        log.record({"stage": str(i)}, messages)
+    log.close()
+    with open(autosave._log_path(session_id), 'rb') as f:
+        data = f.read()
+
+    for cut in range(len(data) + 1):
+        path = tmp_path / f"cut-{cut}.wal"
+        path.write_bytes(data[:cut])
+        _, restored, _, _ = autosave._replay(str(path))
+        assert restored == messages[:len(restored)]
+    assert autosave._replay(str(path))[1] == messages
+
+
+def test_second_live_tab_cannot_claim_the_log():
+    saver = autosave.get_autosaver()
+    session_id = new_session_id()
+    live = {"tab-1", "tab-2"}
+
+    assert saver.claim(session_id, "tab-1", live.__contains__)
+    assert saver.claim(session_id, "tab-1", live.__contains__)  # Reruns of the same tab
+    assert not saver.claim(session_id, "tab-2", live.__contains__)
+
+    # Only the owner's transcript is logged
+    saver.record(session_id, {"stage": "start"}, [{"role": "user", "content": "from tab 1"}], owner="tab-1")
+    saver.record(session_id, {"stage": "start"}, [{"role": "user", "content": "from tab 2"}, {"role": "user", "content": "more"}], owner="tab-2")
+    assert saver.restore(session_id)[1] == [{"role": "user", "content": "from tab 1"}]
+
+    # Once the first tab is gone (e.g. refreshed), the log can be claimed again
+    live.discard("tab-1")
+    assert saver.claim(session_id, "tab-2", live.__contains__)
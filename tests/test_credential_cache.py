@@ -0,0 +1,106 @@
+import datetime
+import os
+import threading
+import time
+
+import pytest
+from cryptography.fernet import InvalidToken
+from google.auth.exceptions import RefreshError
+from google.oauth2.credentials import Credentials
+
+import credential_cache
+
+SCOPES = ['https://www.googleapis.com/auth/documents', 'https://www.googleapis.com/auth/drive.file']
+CLIENT_CONFIG = {"web": {"client_id": "test-client", "client_secret": "secret", "token_uri": "https://oauth2.googleapis.com/token"}}
+
+
+class FakeRefresh:
+    """Stands in for ``Credentials.refresh``: counts token requests, or rejects them like a revoked grant."""
+    def __init__(self, monkeypatch, delay=0.0):
+        self.calls = 0
+        self.revoked = False
+        self.delay = delay
+        self._lock = threading.Lock()
+        fake = self
+
+        def refresh(credentials, request):
+            with fake._lock:
+                fake.calls += 1
+            time.sleep(fake.delay)
+            if fake.revoked:
+                raise RefreshError("invalid_grant: Token has been expired or revoked.")
+            credentials.token = f"access-token-{fake.calls}"
+            credentials.expiry = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None) + datetime.timedelta(hours=1)
+        monkeypatch.setattr(Credentials, "refresh", refresh)
+
+
+@pytest.fixture
+def refresh(monkeypatch):
+    monkeypatch.setenv("GRANTI_CREDENTIAL_KEY", "test-server-secret")
+    return FakeRefresh(monkeypatch)
+
+
+def login(client_id="test-client", scopes=SCOPES):
+    return Credentials(token="access-token", refresh_token="refresh-token-1", token_uri="https://oauth2.googleapis.com/token",
+                       client_id=client_id, client_secret="secret", scopes=scopes)
+
+
+def test_saved_credentials_round_trip_encrypted(refresh):
+    user_key = credential_cache.new_user_key()
+    assert credential_cache.CredentialManager().save(user_key, login())
+    with open(credential_cache._path(user_key), 'rb') as f:
+        assert b"refresh-token-1" not in f.read()
+
+    # A new process (nothing in memory) reads the file back and gets an access token
+    credentials = credential_cache.CredentialManager().load(user_key, CLIENT_CONFIG, SCOPES)
+
+    assert credentials.refresh_token == "refresh-token-1"
+    assert credentials.token == "access-token-1" and refresh.calls == 1
+    # Another user key can't read the file
+    with open(credential_cache._path(user_key), 'rb') as f:
+        with pytest.raises(InvalidToken):
+            credential_cache._fernet(b"test-server-secret", credential_cache.new_user_key()).decrypt(f.read())
+
+
+@pytest.mark.parametrize("client_id, scopes", [("other-client", SCOPES), ("test-client", SCOPES[:1])])
+def test_credentials_for_another_client_or_scopes_are_discarded(refresh, client_id, scopes):
+    user_key = credential_cache.new_user_key()
+    credential_cache.CredentialManager().save(user_key, login(client_id, scopes))
+
+    assert credential_cache.CredentialManager().load(user_key, CLIENT_CONFIG, SCOPES) is None
+    assert not os.path.exists(credential_cache._path(user_key))
+    assert refresh.calls == 0
+
+
+def test_concurrent_callers_share_one_refresh(refresh):
+    refresh.delay = 0.1
+    manager = credential_cache.CredentialManager()
+    user_key = credential_cache.new_user_key()
+    expired = login()
+    expired.token = None
+    manager.save(user_key, expired)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(manager.fresh(user_key))) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert refresh.calls == 1
+    assert len(results) == 8 and all(r is expired and r.token == "access-token-1" for r in results)
+
+
+def test_revoked_credentials_are_forgotten(refresh):
+    manager = credential_cache.CredentialManager()
+    user_key = credential_cache.new_user_key()
+    credentials = login()
+    manager.save(user_key, credentials)
+    credentials.token = None  # Expired while in memory
+    refresh.revoked = True
+
+    assert manager.load(user_key, CLIENT_CONFIG, SCOPES) is None
+    assert not os.path.exists(credential_cache._path(user_key))
+    # Later reruns don't call the token endpoint again
+    assert manager.load(user_key, CLIENT_CONFIG, SCOPES) is None
+    assert refresh.calls == 1
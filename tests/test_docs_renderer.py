@@ -0,0 +1,14 @@
+import docs_renderer
+
+
+def test_chunks_stay_under_the_limit_as_serialized():
+    # Non-ASCII text is sent as \uXXXX escapes, up to 12 bytes per character
+    segments = [docs_renderer.Segment("Åsa's farm 🐔 costs within 5%.\n" * 200) for _ in range(20)]
+    limit = 64 * 1024
+
+    chunks = docs_renderer.render_requests(segments, max_request_bytes=limit)
+
+    assert len(chunks) > 1
+    assert all(docs_renderer.payload_bytes(requests) <= limit for requests in chunks)
+    inserted = "".join(r['insertText']['text'] for requests in chunks for r in requests if 'insertText' in r)
+    assert inserted == docs_renderer.segments_text(segments)
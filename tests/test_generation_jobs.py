@@ -0,0 +1,39 @@
+import threading
+import time
+
+import generation_jobs
+
+
+def test_submit_while_a_job_is_finishing(monkeypatch):
+    """A submit that prunes while another job is finishing must not see it finished without a finish time."""
+    queue = generation_jobs.GenerationQueue(max_workers=1)
+    monkeypatch.setattr(generation_jobs, "FINISHED_JOB_TTL_SECONDS", -60)  # Prune every finished job
+    returned = threading.Event()
+    errors = []
+
+    def submit_from_another_session():
+        try:
+            queue.submit("other-session", 1, lambda: None)
+        except Exception as e:
+            errors.append(e)
+
+    class Clock:
+        """Submits from another thread at the moment the finishing job reads the time."""
+        triggered = False
+
+        def time(self):
+            if returned.is_set() and not self.triggered:
+                self.triggered = True
+                other = threading.Thread(target=submit_from_another_session)
+                other.start()
+                other.join(timeout=1)
+            return time.time()
+
+    monkeypatch.setattr(generation_jobs, "time", Clock())
+    job = queue.submit("session", 1, returned.set)
+    deadline = time.time() + 5
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+
+    assert job.status == generation_jobs.DONE and job.finished_at is not None
+    assert errors == []
@@ -0,0 +1,85 @@
+import json
+import os
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+import google_services
+
+
+@pytest.fixture
+def fresh_cache(monkeypatch):
+    """Empties the per-process discovery and service caches for one test."""
+    monkeypatch.setattr(google_services, "_discovery_docs", {})
+    monkeypatch.setattr(google_services, "_services", google_services.OrderedDict())
+
+
+@pytest.fixture
+def offline(monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError("Tried to use the network")
+    monkeypatch.setattr(httplib2.Http, "request", no_network)
+    monkeypatch.setattr("googleapiclient.discovery_cache.get_static_doc", no_network)
+
+
+def test_builds_clients_from_local_discovery_fixture(fresh_cache, offline, credentials):
+    creds = credentials
+    docs = google_services.get_service('docs', 'v1', creds)
+    drive = google_services.get_service('drive', 'v3', creds)
+
+    assert google_services.load_discovery_doc('docs', 'v1')["title"] == "Google Docs API (test fixture)"
+    assert docs.documents().get(documentId="abc").uri.startswith("https://docs.googleapis.com/v1/documents/abc")
+    request = drive.files().create(body={"name": "Report"}, fields='id')
+    assert request.method == "POST" and request.uri.startswith("https://www.googleapis.com/drive/v3/files")
+    # Shared per credentials
+    assert google_services.get_service('docs', 'v1', creds) is docs
+
+
+def test_missing_discovery_doc_is_seeded_into_the_data_directory(fresh_cache, monkeypatch, tmp_path):
+    monkeypatch.setattr(google_services, "DISCOVERY_DIR", str(tmp_path))
+    doc = google_services.load_discovery_doc('docs', 'v1')
+
+    with open(os.path.join(tmp_path, "docs.v1.json"), encoding='utf-8') as f:
+        assert json.load(f)["id"] == doc["id"] == "docs:v1"
+
+
+# --- Retries ---
+def test_read_is_retried_through_429_and_500(fresh_cache, credentials, no_backoff, transport):
+    transport.http = HttpMockSequence([
+        ({'status': '429'}, '{"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}'),
+        ({'status': '500'}, '{"error": {"code": 500}}'),
+        ({'status': '200'}, '{"documentId": "abc", "title": "Report"}'),
+    ])
+    docs = google_services.get_service('docs', 'v1', credentials)
+
+    assert google_services.execute(docs.documents().get(documentId="abc"), credentials) == {"documentId": "abc", "title": "Report"}
+    assert len(transport.http.request_sequence) == 3
+
+
+def test_batch_update_is_retried_after_429_but_not_after_500(fresh_cache, credentials, no_backoff, transport):
+    docs = google_services.get_service('docs', 'v1', credentials)
+    transport.http = HttpMockSequence([
+        ({'status': '429'}, '{"error": {"code": 429}}'),
+        ({'status': '200'}, '{"documentId": "abc"}'),
+    ])
+    request = docs.documents().batchUpdate(documentId="abc", body={'requests': []})
+    assert google_services.execute(request, credentials, idempotent=False) == {"documentId": "abc"}
+
+    # A 500 may have been applied: it is raised for the caller to recover, never resent
+    transport.http = HttpMockSequence([
+        ({'status': '500'}, '{"error": {"code": 500}}'),
+        ({'status': '200'}, '{"documentId": "abc"}'),
+    ])
+    request = docs.documents().batchUpdate(documentId="abc", body={'requests': []})
+    with pytest.raises(HttpError):
+        google_services.execute(request, credentials, idempotent=False)
+    assert len(transport.http.request_sequence) == 1
+
+
+def test_only_calls_that_certainly_were_not_applied_are_retryable_when_not_idempotent():
+    assert google_services.is_retryable(TimeoutError())
+    assert not google_services.is_retryable(TimeoutError(), idempotent=False)
+    assert not google_services.is_retryable(ConnectionResetError(), idempotent=False)
+    assert google_services.is_retryable(ConnectionRefusedError(), idempotent=False)
@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+import quota
+
+# One call per second, at most 6 at once, for the whole project; users are effectively unlimited
+BUDGETS = {"docs.write": {"project": 60, "user": 6000}}
+
+
+class Clock:
+    """A monotonic clock that only moves when told to (or when the limiter sleeps)."""
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    monkeypatch.setattr(quota, "ENABLED", True)
+    return Clock()
+
+
+def limiter(clock, budgets=BUDGETS):
+    return quota.QuotaLimiter(budgets, window_seconds=60, headroom=1.0, clock=clock, sleep=clock.sleep)
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_bucket_refills_at_its_rate():
+    bucket = quota.TokenBucket(rate=2.0, capacity=10, now=0.0)
+    bucket.take(10)
+
+    assert bucket.delay(4, now=1.0) == pytest.approx(1.0)  # 2 tokens refilled, 2 more to go
+    assert bucket.delay(4, now=2.0) == 0.0
+    assert bucket.tokens == pytest.approx(4.0)
+
+
+def test_bucket_caps_the_burst():
+    bucket = quota.TokenBucket(rate=2.0, capacity=10, now=0.0)
+
+    assert bucket.delay(1, now=3600.0) == 0.0
+    assert bucket.tokens == 10  # An idle hour doesn't bank more than the capacity
+    # A batch larger than the capacity goes through on a full bucket and leaves a debt
+    bucket.take(25)
+    assert bucket.delay(1, now=3600.0) == pytest.approx(8.0)
+
+
+def test_limiter_buckets_hold_a_fraction_of_the_window(clock):
+    bucket = quota.QuotaLimiter(BUDGETS, window_seconds=60, headroom=0.5, clock=clock)._bucket("docs.write", "project", "p", clock())
+
+    assert bucket.capacity == 60 * quota.BURST_FRACTION
+    assert bucket.rate == pytest.approx(0.5)
+
+
+def test_user_debt_is_slept_off(clock):
+    budgets = {"docs.write": {"project": 6000, "user": 60}}
+    l = limiter(clock, budgets)
+    l.acquire("docs.write", "project", "user", cost=6)
+
+    waited = l.acquire("docs.write", "project", "user", cost=2)
+
+    assert clock.slept == [pytest.approx(2.0)]
+    assert waited == pytest.approx(2.0)
+
+
+def test_interactive_calls_go_before_bulk(clock):
+    l = limiter(clock)
+    l.acquire("docs.write", "project", "user", cost=6)  # Drains the project bucket
+    served = []
+
+    def call(name, level):
+        l.acquire("docs.write", "project", name, level=level)
+        served.append(name)
+    bulk = threading.Thread(target=call, args=("bulk", quota.BULK))
+    bulk.start()
+    wait_until(lambda: len(l._waiters.get(("docs.write", "project"), [])) == 1)
+    interactive = threading.Thread(target=call, args=("interactive", quota.INTERACTIVE))
+    interactive.start()
+    wait_until(lambda: len(l._waiters.get(("docs.write", "project"), [])) == 2)
+
+    # One token: the interactive call arrived last but is served first
+    with l._cond:
+        clock.now += 1
+        l._cond.notify_all()
+    interactive.join(5)
+    assert served == ["interactive"]
+
+    with l._cond:
+        clock.now += 1
+        l._cond.notify_all()
+    bulk.join(5)
+    assert served == ["interactive", "bulk"]
+    assert not l._waiters
+
+
+def test_project_wait_past_the_timeout_raises(clock):
+    l = limiter(clock)
+    l.acquire("docs.write", "project", "user", cost=6)
+
+    with pytest.raises(quota.QuotaTimeoutError):
+        l.acquire("docs.write", "project", "user", timeout=0.5)
+    assert not l._waiters
+    # A timeout the wait fits in doesn't raise
+    clock.now += 1
+    l.acquire("docs.write", "project", "user", timeout=0.5)
+
+
+def test_user_wait_past_the_timeout_raises_without_spending_quota(clock):
+    budgets = {"docs.write": {"project": 6000, "user": 60}}
+    l = limiter(clock, budgets)
+    l.acquire("docs.write", "project", "user", cost=6)
+
+    with pytest.raises(quota.QuotaTimeoutError):
+        l.acquire("docs.write", "project", "user", cost=3, timeout=2)
+    assert clock.slept == []
+    assert l._buckets[("docs.write", "user", "user")].tokens == pytest.approx(0.0)
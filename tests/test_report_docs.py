@@ -0,0 +1,183 @@
+import json
+
+import google_auth_httplib2
+import httplib2
+import pytest
+from googleapiclient.http import HttpMockSequence
+
+import docs_renderer
+import google_services
+import report_docs
+import report_model
+
+PROJECT_DETAILS = {"Project title": "Test project", "Project Number": "10000001", "Total Quarters": 4}
+SECTION_KEYS = ["quarter_end_date", "overall_summary", "progress", "risks"]
+
+
+def make_model(quarter=1, answer="All on track."):
+    answers = {key: f"{answer} ({key})" for key in SECTION_KEYS}
+    answers["quarter_end_date"] = "2025-06-30"
+    return report_model.build_report_model(PROJECT_DETAILS, SECTION_KEYS, quarter, answers, {})
+
+
+def batch_response(parts):
+    """A multipart batch response: ``parts`` is ``[(request_id, status, payload)]``."""
+    body = "".join(f"--batch_test\r\nContent-Type: application/http\r\nContent-ID: <response-test + {request_id}>\r\n\r\n"
+                   f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n\r\n"
+                   f"{json.dumps(payload)}\r\n" for request_id, status, payload in parts)
+    return {'status': '200', 'content-type': 'multipart/mixed; boundary="batch_test"'}, body + "--batch_test--\r\n"
+
+
+def test_batch_retries_only_the_failed_sub_requests(credentials, no_backoff, transport, monkeypatch):
+    monkeypatch.setattr(report_docs.time, "sleep", lambda seconds: None)
+    transport.http = HttpMockSequence([
+        batch_response([("1", 200, {"id": "doc-1"}), ("2", 503, {"error": {"code": 503, "message": "Backend error"}}),
+                        ("3", 200, {"id": "doc-3"})]),
+        batch_response([("2", 200, {"id": "doc-2"})]),
+    ])
+    drive = google_services.get_service('drive', 'v3', credentials)
+    factories = {str(q): (lambda q=q: drive.files().create(body={'name': f"Q{q}"}, fields='id')) for q in (1, 2, 3)}
+
+    responses, errors = report_docs._run_batch(drive, credentials, factories)
+
+    assert responses == {"1": {"id": "doc-1"}, "2": {"id": "doc-2"}, "3": {"id": "doc-3"}}
+    assert errors == {}
+    first, retried = [request[2] for request in transport.http.request_sequence]
+    assert first.count("POST /drive/v3/files") == 3
+    assert retried.count("POST /drive/v3/files") == 1 and '"Q2"' in retried
+
+
+def test_batch_gives_up_on_sub_requests_that_cannot_succeed(credentials, no_backoff, transport):
+    transport.http = HttpMockSequence([
+        batch_response([("1", 200, {"id": "doc-1"}), ("2", 403, {"error": {"code": 403, "message": "Forbidden"}})]),
+    ])
+    drive = google_services.get_service('drive', 'v3', credentials)
+    factories = {str(q): (lambda q=q: drive.files().create(body={'name': f"Q{q}"}, fields='id')) for q in (1, 2)}
+
+    responses, errors = report_docs._run_batch(drive, credentials, factories)
+
+    assert responses == {"1": {"id": "doc-1"}}
+    assert errors["2"].resp.status == 403
+    assert len(transport.http.request_sequence) == 1
+
+
+def test_bulk_publish_rewrites_a_report_whose_batched_update_may_have_been_applied(credentials, no_backoff, transport, records):
+    transport.http = HttpMockSequence([
+        batch_response([("1", 200, {"id": "doc-1"})]),  # Drive creates
+        batch_response([("1", 503, {"error": {"code": 503, "message": "Backend error"}})]),  # Docs populates
+        ({'status': '200'}, json.dumps({"body": {"content": [{"endIndex": 40}]}})),  # Re-read of the body
+        ({'status': '200'}, json.dumps({"documentId": "doc-1"})),
+        ({'status': '200'}, json.dumps({"files": [{"id": "doc-1"}]})),  # Orphan cleanup finds only the kept doc
+    ])
+
+    results = report_docs.publish_reports_batch(credentials, {1: ("Q1 report", make_model())}, "bulk-session")
+
+    assert results[1]['doc_id'] == "doc-1" and 'url' in results[1]
+    uri, method, body, headers = transport.http.request_sequence[3]
+    assert ":batchUpdate" in uri
+    assert json.loads(body)['requests'][0] == {'deleteContentRange': {'range': {'startIndex': 1, 'endIndex': 39}}}
+    assert len(transport.http.request_sequence) == 5
+
+
+class LosesResponses:
+    """An HTTP client whose first ``lose`` batchUpdate responses are lost after the server applied them."""
+    def __init__(self, credentials, lose=1):
+        self.http = google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+        self.lose = lose
+        self.lost = 0
+
+    def __getattr__(self, name):
+        return getattr(self.http, name)
+
+    def request(self, uri, method="GET", body=None, headers=None, **kwargs):
+        response = self.http.request(uri, method=method, body=body, headers=headers, **kwargs)
+        if ":batchUpdate" in uri and self.lost < self.lose:
+            self.lost += 1
+            raise TimeoutError("timed out")
+        return response
+
+
+@pytest.fixture
+def lossy(monkeypatch, credentials):
+    http = LosesResponses(credentials)
+    monkeypatch.setattr(google_services, "authorized_http", lambda creds: http)
+    return http
+
+
+def test_lost_batch_update_response_does_not_duplicate_the_report(fake_google, credentials, no_backoff, lossy):
+    lossy.lose = 0
+    expected = report_docs.publish_report(credentials, "Control", make_model(), "control-session", 1)
+
+    lossy.lose = 1
+    result = report_docs.publish_report(credentials, "Report", make_model(), "lossy-session", 1)
+
+    assert lossy.lost == 1
+    assert fake_google.bodies[result['doc_id']] == fake_google.bodies[expected['doc_id']]
+    assert fake_google.bodies[result['doc_id']].count("Test project") == 1
+
+
+def test_lost_update_response_is_not_applied_twice(fake_google, credentials, no_backoff, lossy):
+    lossy.lose = 0
+    published = report_docs.publish_report(credentials, "Report", make_model(), "update-session", 1)
+    expected = report_docs.publish_report(credentials, "Control", make_model(answer="Behind on hiring."), "control-session", 1)
+
+    lossy.lose, lossy.lost = 1, 0
+    result = report_docs.update_report(credentials, published['doc_id'], "Report", make_model(answer="Behind on hiring."), "update-session", 1)
+
+    assert lossy.lost == 1
+    assert result['changed_sections'] > 0
+    assert fake_google.bodies[published['doc_id']] == fake_google.bodies[expected['doc_id']]
+
+
+
+def test_update_rewrites_only_the_changed_section(fake_google, credentials):
+    answers = {key: f"{key}: " + "Trial farms onboarded and costs within plan. " * 40 for key in SECTION_KEYS}
+    answers["quarter_end_date"] = "2025-06-30"
+    published = report_docs.publish_report(credentials, "Report", report_model.build_report_model(PROJECT_DETAILS, SECTION_KEYS, 1, answers, {}),
+                                           "section-session", 1)
+    doc_id = published['doc_id']
+    before = fake_google.paragraph_styles(doc_id)
+    text_before = fake_google.bodies[doc_id]
+
+    answers["progress"] = "Two farms onboarded, one behind plan."
+    model = report_model.build_report_model(PROJECT_DETAILS, SECTION_KEYS, 1, answers, {})
+    result = report_docs.update_report(credentials, doc_id, "Report", model, "section-session", 1)
+
+    assert result['changed_sections'] == 1
+    requests = fake_google.last_requests[doc_id]
+    # The progress body (between its heading and the next) is deleted and re-inserted, nothing else
+    body_start = text_before.index("Progress\n") + len("Progress\n")
+    body_end = text_before.index("Risks\n")
+    assert [r['deleteContentRange']['range'] for r in requests if 'deleteContentRange' in r] == [{'startIndex': body_start + 1, 'endIndex': body_end + 1}]
+    inserted = [r['insertText'] for r in requests if 'insertText' in r]
+    assert len(inserted) == 1 and inserted[0]['location']['index'] == body_start + 1
+    assert "Two farms onboarded, one behind plan." in inserted[0]['text']
+
+    # Everything outside the progress body keeps its text and paragraph style
+    after = fake_google.paragraph_styles(doc_id)
+    text_after = fake_google.bodies[doc_id]
+    assert text_after[:body_start] == text_before[:body_start]
+    assert text_after[body_start + len(inserted[0]['text']):] == text_before[body_end:]
+    assert [p for p in after if p[1] != "NORMAL_TEXT"] == [p for p in before if p[1] != "NORMAL_TEXT"]
+    assert ("Progress\n", "HEADING_2") in after and ("Risks\n", "HEADING_2") in after
+
+    full_render = sum(docs_renderer.payload_bytes(chunk) for chunk in report_docs.render_report(model))
+    assert docs_renderer.payload_bytes(requests) * 10 < full_render
+
+
+def test_render_cache_is_capped_by_bytes(monkeypatch):
+    monkeypatch.setattr(report_docs, "_rendered", type(report_docs._rendered)())
+    monkeypatch.setattr(report_docs, "_rendered_bytes", 0)
+    models = [make_model(answer=f"Answer {n}. " * 50) for n in range(4)]
+    size = report_docs._estimated_bytes(report_docs.render_report(models[0]))
+    monkeypatch.setattr(report_docs, "MAX_CACHED_RENDER_BYTES", int(size * 2.5))
+
+    for model in models[1:]:
+        report_docs.render_report(model)
+
+    assert list(report_docs._rendered) == [report_model.content_hash(m) for m in models[2:]]
+    assert report_docs._rendered_bytes == sum(entry[1] for entry in report_docs._rendered.values()) <= report_docs.MAX_CACHED_RENDER_BYTES
+    # A render larger than the whole cache is returned but not kept
+    large = make_model(answer="A much longer answer. " * 2000)
+    assert report_docs.render_report(large)
+    assert report_model.content_hash(large) not in report_docs._rendered
@@ -0,0 +1,116 @@
+import time
+
+import pytest
+
+import answer_store
+import generation_jobs
+import project_registry
+import report_docs
+import report_model
+import report_session
+
+SESSION_ID = "session-under-test"
+
+
+class GoogleDocs(report_session.NoDocuments):
+    """Document backend wired like app.py's GoogleDocsBackend, publishing through a job queue."""
+    def __init__(self, credentials, answers, project):
+        self.credentials = credentials
+        self.answers = answers
+        self.project = project
+        self.queue = generation_jobs.GenerationQueue(max_workers=1)
+
+    def model(self, quarter):
+        number = self.project.details['Project Number']
+        contexts = report_model.contexts_from_answers(quarter, self.answers.load_project(number), self.project.section_keys)
+        return report_model.build_report_model(self.project.details, self.project.section_keys, quarter,
+                                               self.answers.load_quarter(number, quarter), contexts)
+
+    def authenticated(self):
+        return True
+
+    def published(self, quarter):
+        return report_docs.published_report(SESSION_ID, quarter, self.model(quarter))
+
+    def generate(self, quarter):
+        model = self.model(quarter)
+        return self.queue.submit_unique(report_model.content_hash(model), SESSION_ID, quarter, report_docs.publish_report,
+                                        self.credentials, report_model.report_title(self.project.details, quarter), model, SESSION_ID, quarter)
+
+    def update(self, quarter, doc):
+        return self.queue.submit(SESSION_ID, quarter, report_docs.update_report, self.credentials, doc['doc_id'], doc['title'], self.model(quarter),
+                                 SESSION_ID, quarter)
+
+    def job_status(self, job_id):
+        job = self.queue.get(job_id)
+        return job.status if job else "unknown"
+
+    def describe_error(self, error):
+        return report_docs.describe_google_error(error)
+
+
+@pytest.fixture
+def conversation(fake_google, credentials):
+    project = project_registry.get_registry().get("netflox360")
+    answers = answer_store.SQLiteAnswerStore(":memory:")
+    documents = GoogleDocs(credentials, answers, project)
+    return report_session.ReportSession(report_session.SessionState(), project.details, project.section_keys,
+                                        project.prompts, answers, documents)
+
+
+def answer_quarter(session, quarter, answer):
+    """Runs a conversation from the quarter choice to the generate confirmation."""
+    session.state.stage = report_session.START
+    session.send(str(quarter))
+    session.dispatch(report_session.GRANT_APP_UPLOADED, {"name": "app.pdf", "size": 1, "type": "application/pdf", "sha256": None})
+    for key in session.section_keys:
+        session.send("2025-06-30" if key == "quarter_end_date" else f"{answer} ({key})")
+    assert session.state.stage == report_session.CONFIRM_GENERATE
+
+
+def finish_job(session):
+    """Waits for the session's generation job, like the app's status poller, and reports it to the session."""
+    job = session.documents.queue.get(session.state.generation_job_id)
+    deadline = time.time() + 30
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    return session.dispatch(report_session.JOB_FINISHED, job)
+
+
+def test_conversation_publishes_report_to_google_docs(conversation, fake_google):
+    answer_quarter(conversation, 2, "Trial farms onboarded")
+    assert conversation.send("yes").startswith("Okay, generating")
+    assert conversation.state.stage == report_session.GENERATING
+
+    reply = finish_job(conversation)
+
+    assert conversation.state.stage == report_session.DONE
+    doc = conversation.state.quarter_docs[2]
+    assert f"https://docs.google.com/document/d/{doc['doc_id']}/edit" in reply
+    body = fake_google.bodies[doc['doc_id']]
+    assert "NetFLOX360" in body and "Trial farms onboarded (progress)" in body
+    assert fake_google.files[doc['doc_id']]['name'] == doc['title']
+
+
+def test_reverted_answers_are_not_answered_with_the_updated_draft(conversation, fake_google):
+    answer_quarter(conversation, 2, "Trial farms onboarded")
+    conversation.send("yes")
+    finish_job(conversation)
+    first = conversation.state.quarter_docs[2]
+
+    answer_quarter(conversation, 2, "Hiring is behind plan")
+    conversation.send("update")
+    assert "is up to date" in finish_job(conversation)
+    assert conversation.state.quarter_docs[2]['doc_id'] == first['doc_id']
+
+    # Back to the first answers: the draft now holds the second ones, so a new draft has to be published
+    answer_quarter(conversation, 2, "Trial farms onboarded")
+    conversation.send("yes")
+    if conversation.state.stage == report_session.GENERATING:
+        finish_job(conversation)
+
+    doc = conversation.state.quarter_docs[2]
+    assert doc['doc_id'] != first['doc_id']
+    assert "Trial farms onboarded (progress)" in fake_google.bodies[doc['doc_id']]
+    # The updated draft is kept, not cleaned up as an orphan of the first answers
+    assert "Hiring is behind plan (progress)" in fake_google.bodies[first['doc_id']]
@@ -0,0 +1,65 @@
+import hashlib
+import os
+
+import pytest
+
+import retrieval
+import text_extract
+
+SECTION_QUERIES = {"progress": "progress milestones", "risk_management": "risks mitigation"}
+
+
+def extracted_document(pages):
+    """Writes ``pages`` of text to the extracted-text cache and returns the document's digest."""
+    text = text_extract.PAGE_SEPARATOR.join(pages)
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()
+    os.makedirs(text_extract.CACHE_DIR, exist_ok=True)
+    with open(text_extract._cache_path(digest), "w", encoding='utf-8') as f:
+        f.write(text)
+    return digest
+
+
+@pytest.fixture
+def indexes(monkeypatch):
+    monkeypatch.setattr(retrieval, "_indexes", type(retrieval._indexes)())
+    return retrieval._indexes
+
+
+def test_index_finds_relevant_passages(indexes):
+    index, created = retrieval.get_index("session", SECTION_QUERIES)
+    index.add_source(extracted_document(["Milestones reached: progress on the farm trial.", "Risks: supplier delays."]), "plan.pdf")
+
+    assert created and retrieval.get_index("session", SECTION_QUERIES) == (index, False)
+    assert index.section_passages("risk_management")[0][:2] == ("plan.pdf", 2)
+
+
+def test_cache_evicts_least_recently_used_sessions_past_the_passage_cap(indexes, monkeypatch):
+    # Each document is 5 passages; the cap fits two sessions' worth
+    monkeypatch.setattr(retrieval, "MAX_INDEXED_PASSAGES", 10)
+    document = [" ".join(f"word{n} progress" for n in range(page * 100, page * 100 + 45)) for page in range(5)]
+    for n in range(3):
+        index, _ = retrieval.get_index(f"session-{n}", SECTION_QUERIES)
+        index.add_source(extracted_document([f"{page} doc{n}" for page in document]), f"doc{n}.pdf")
+        retrieval.get_index("session-0", SECTION_QUERIES)  # session-0 stays in use
+
+    assert sorted(indexes) == ["session-0", "session-2"]
+    assert [index.passage_count for index in indexes.values()] == [5, 5]
+    # An evicted session gets a new, empty index
+    index, created = retrieval.get_index("session-1", SECTION_QUERIES)
+    assert created and index.passage_count == 0
+
+
+def test_cache_evicts_past_the_session_cap(indexes, monkeypatch):
+    monkeypatch.setattr(retrieval, "MAX_SESSION_INDEXES", 3)
+    for n in range(5):
+        retrieval.get_index(f"session-{n}", SECTION_QUERIES)
+
+    assert list(indexes) == ["session-2", "session-3", "session-4"]
+
+
+def test_one_session_larger_than_the_cap_is_kept(indexes, monkeypatch):
+    monkeypatch.setattr(retrieval, "MAX_INDEXED_PASSAGES", 1)
+    index, _ = retrieval.get_index("session", SECTION_QUERIES)
+    index.add_source(extracted_document([" ".join(["progress"] * 500)]), "big.pdf")
+
+    assert list(indexes) == ["session"] and index.passage_count > 1
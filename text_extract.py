@@ -0,0 +1,154 @@
+"""Background text extraction for uploaded files (Grant Application, supporting evidence).
+
+Uploads live in the blob store (see blob_store.py) and are identified by its
+SHA-256 digest. Extraction runs on a small worker pool, reading the blob from
+disk - PDFs page by page - and the text is streamed to
+``granti_data/extracted/<sha256>.txt`` (pages separated by form feeds), so the
+chat stays responsive and re-uploading the same file later - in another
+quarter or another session - is answered straight from the cache.
+"""
+import os
+import re
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import blob_store
+import instrumentation
+
+DATA_DIR = os.environ.get("GRANTI_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "granti_data"))
+CACHE_DIR = os.path.join(DATA_DIR, "extracted")
+PAGE_SEPARATOR = "\f"
+MAX_WORKERS = 2
+SUPPORTED_TYPES = ("pdf", "txt", "docx")
+
+PENDING = "pending"
+DONE = "done"
+FAILED = "failed"
+
+logger = instrumentation.get_logger("text_extract")
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="granti-extract")
+_lock = threading.Lock()
+_progress = {}  # sha256 -> {"status", "pages_done", "pages_total", "error"}
+
+
+def _cache_path(digest):
+    return os.path.join(CACHE_DIR, f"{digest}.txt")
+
+
+def _pdf_pages(digest, path, progress):
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    progress["pages_total"] = len(reader.pages)
+    for page in reader.pages:
+        yield page.extract_text() or ""
+
+
+def _docx_pages(digest, path, progress):
+    progress["pages_total"] = 1
+    with zipfile.ZipFile(path) as archive:
+        xml = archive.read("word/document.xml").decode('utf-8', errors='ignore')
+    paragraphs = (re.sub(r"<[^>]+>", "", p) for p in re.split(r"</w:p>", xml))
+    yield "\n\n".join(p for p in paragraphs if p.strip())
+
+
+def _txt_pages(digest, path, progress):
+    progress["pages_total"] = 1
+    with blob_store.get_store().open_view(digest) as view:
+        text = str(view, 'utf-8', errors='ignore')
+    yield text
+
+
+_PAGE_READERS = {"pdf": _pdf_pages, "docx": _docx_pages, "txt": _txt_pages}
+
+
+def _extract(digest, file_type, on_done):
+    path = _cache_path(digest)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    progress = _progress[digest]
+    try:
+        blob_path = blob_store.get_store().touch(digest)
+        if blob_path is None:
+            raise FileNotFoundError("Upload is no longer in the blob store")
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for page_number, text in enumerate(_PAGE_READERS[file_type](digest, blob_path, progress)):
+                if page_number:
+                    f.write(PAGE_SEPARATOR)
+                f.write(text.replace(PAGE_SEPARATOR, " "))
+                progress["pages_done"] = page_number + 1
+        os.replace(tmp_path, path)
+        progress["status"] = DONE
+        logger.debug("Extracted upload text", digest=digest[:12], file_type=file_type, pages=progress['pages_total'])
+    except Exception as e:
+        logger.exception("Text extraction failed", digest=digest[:12], error=e)
+        with _lock:
+            _progress[digest].update(status=FAILED, error=str(e))
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return
+    _notify(digest, on_done)
+
+
+def _notify(digest, on_done):
+    if on_done is None:
+        return
+    try:
+        on_done(digest)
+    except Exception as e:
+        logger.exception("Extraction callback failed", digest=digest[:12], error=e)
+
+
+def submit(digest, file_type="pdf", on_done=None):
+    """Starts extracting the blob ``digest`` unless it is cached or already running. Returns the digest.
+
+    ``on_done(sha256)`` is called (on a worker thread) once the text is
+    available - immediately if it was already cached.
+    """
+    if file_type not in SUPPORTED_TYPES:
+        raise ValueError(f"Unsupported file type for text extraction: {file_type}")
+    with _lock:
+        progress = _progress.get(digest)
+        cached = os.path.exists(_cache_path(digest))
+        if cached:
+            _progress.setdefault(digest, {"status": DONE, "pages_done": None, "pages_total": None, "error": None})
+        elif progress is None or progress["status"] == FAILED:
+            _progress[digest] = {"status": PENDING, "pages_done": 0, "pages_total": None, "error": None}
+            _executor.submit(_extract, digest, file_type, on_done)
+            return digest
+    if cached or progress["status"] == DONE:
+        _executor.submit(_notify, digest, on_done)
+    elif on_done is not None:
+        # Already being extracted for someone else; wait for it on a separate thread (not a pool worker)
+        threading.Thread(target=_wait_and_notify, args=(digest, on_done), daemon=True).start()
+    return digest
+
+
+def _wait_and_notify(digest, on_done):
+    while status(digest)["status"] == PENDING:
+        time.sleep(0.2)
+    if status(digest)["status"] == DONE:
+        _notify(digest, on_done)
+
+
+def status(digest):
+    """Returns ``{"status", "pages_done", "pages_total", "error"}`` for an upload (DONE if only on disk)."""
+    with _lock:
+        progress = _progress.get(digest)
+        if progress:
+            return dict(progress)
+    if digest and os.path.exists(_cache_path(digest)):
+        return {"status": DONE, "pages_done": None, "pages_total": None, "error": None}
+    return {"status": FAILED, "pages_done": 0, "pages_total": None, "error": "Not extracted"}
+
+
+def get_pages(digest):
+    """Returns the extracted text as a list of pages, or None if extraction hasn't finished."""
+    try:
+        with open(_cache_path(digest), encoding='utf-8') as f:
+            return f.read().split(PAGE_SEPARATOR)
+    except (FileNotFoundError, TypeError):
+        return None
@@ -0,0 +1,90 @@
+"""Windowed rendering of the chat transcript.
+
+Only the last ``WINDOW_MESSAGES`` or so messages are drawn as chat bubbles.
+Older messages are grouped into pages of ``PAGE_MESSAGES``. A page stays
+collapsed, and is not rendered at all, until the user picks it. A picked page
+is drawn as one markdown block, built only while the page is open (joining
+``PAGE_MESSAGES`` strings is cheaper than caching them). The user's avatar is
+shrunk to a small thumbnail once per picture instead of being sent at full
+size with every message.
+"""
+import io
+import threading
+from collections import OrderedDict
+
+import blob_store
+import instrumentation
+
+WINDOW_MESSAGES = 20
+PAGE_MESSAGES = 50
+AVATAR_SIZE = 64
+MAX_CACHED_AVATARS = 64
+ROLE_LABELS = {"user": "You", "assistant": "Granti Aunty"}
+
+logger = instrumentation.get_logger("transcript")
+
+
+def split_window(count, window=WINDOW_MESSAGES, page_size=PAGE_MESSAGES):
+    """Returns ``(pages, window_start)``.
+
+    ``pages`` is a list of ``(start, end)`` bounds for the collapsed older
+    messages. ``window_start`` is the index of the first message drawn in
+    full. The window start is rounded down to a page boundary, so a page keeps
+    the same bounds as the transcript grows. As a result the window holds
+    between ``window`` and ``window + page_size - 1`` messages.
+    """
+    window_start = max(count - window, 0)
+    window_start -= window_start % page_size
+    return [(start, min(start + page_size, window_start)) for start in range(0, window_start, page_size)], window_start
+
+
+def page_label(bounds):
+    start, end = bounds
+    return f"Messages {start + 1}-{end}"
+
+
+def message_markdown(role, content):
+    """Pre-rendered markdown for one message in a collapsed page."""
+    return f"**{ROLE_LABELS.get(role, role.title())}:** {content}"
+
+
+def page_markdown(messages, bounds):
+    start, end = bounds
+    return "\n\n---\n\n".join(message_markdown(m["role"], m["content"]) for m in messages[start:end])
+
+
+_avatars = OrderedDict()  # profile picture digest -> thumbnail PNG bytes, LRU
+_avatars_lock = threading.Lock()
+
+
+def avatar_thumbnail(digest):
+    """Returns PNG bytes for a small thumbnail of a profile picture blob, or None if it's gone.
+
+    The thumbnail is built only once per picture.
+    """
+    if not digest:
+        return None
+    with _avatars_lock:
+        thumbnail = _avatars.get(digest)
+        if thumbnail is not None:
+            _avatars.move_to_end(digest)
+            return thumbnail
+    path = blob_store.get_store().touch(digest)
+    if path is None:
+        return None
+    try:
+        from PIL import Image  # Installed with streamlit
+        with Image.open(path) as image:
+            image.thumbnail((AVATAR_SIZE, AVATAR_SIZE))
+            out = io.BytesIO()
+            image.convert("RGBA").save(out, format="PNG")
+        thumbnail = out.getvalue()
+    except Exception as e:
+        logger.warn("Could not build avatar thumbnail", digest=digest[:12], error=e)
+        with open(path, 'rb') as f:
+            thumbnail = f.read()
+    with _avatars_lock:
+        _avatars[digest] = thumbnail
+        while len(_avatars) > MAX_CACHED_AVATARS:
+            _avatars.popitem(last=False)
+    return thumbnail